@@ -10,3 +10,10 @@ class DFLIMG():
             return DFLJPG.load ( str(filepath), loader_func=loader_func )
         else:
             return None
+
+    @staticmethod
+    def load_meta(filepath, loader_func=None):
+        if filepath.suffix == '.jpg':
+            return DFLJPG.load_meta ( str(filepath), loader_func=loader_func )
+        else:
+            return None
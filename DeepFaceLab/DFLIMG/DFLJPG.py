@@ -1,6 +1,7 @@
 import pickle
 import struct
 import traceback
+from io import BytesIO
 
 import cv2
 import numpy as np
@@ -154,6 +155,63 @@ class DFLJPG(object):
             io.log_err (f'Exception occured while DFLJPG.load : {traceback.format_exc()}')
             return None
 
+    @staticmethod
+    def load_meta(filename, loader_func=None):
+        """
+        Fast metadata path.
+
+        Parses only the chunks before SOS, so the compressed image data is never scanned
+        and, when reading from disk, never read. Returns DFLJPG with dfl_dict and shape set.
+        Returned instance cannot be saved.
+        """
+        try:
+            if loader_func is not None:
+                f = BytesIO(loader_func(filename))
+            else:
+                f = open(filename, "rb")
+
+            with f:
+                inst = DFLJPG(filename)
+                inst.chunks = None
+                inst.dfl_dict = {}
+
+                while True:
+                    marker = f.read(2)
+                    if len(marker) < 2:
+                        break
+                    chunk_m_l, chunk_m_h = marker
+                    if chunk_m_l != 0xFF:
+                        raise ValueError(f"No Valid JPG info in {filename}")
+
+                    if chunk_m_h == 0xDA or chunk_m_h == 0xD9:
+                        #SOS or EOI, metadata is over
+                        break
+                    elif chunk_m_h & 0xF0 == 0xD0 and (chunk_m_h & 0x0F) <= 8:
+                        #RSTn or SOI
+                        continue
+                    elif chunk_m_h == 0xDD:
+                        #DRI
+                        f.read(2)
+                        continue
+
+                    chunk_size, = struct.unpack (">H", f.read(2))
+                    chunk_data = f.read(chunk_size-2)
+
+                    if chunk_m_h == 0xE0:
+                        c, id, _ = struct_unpack (chunk_data, 0, "=4sB")
+                        if id != b"JFIF":
+                            raise Exception("Unknown jpeg ID: %s" % (id) )
+                    elif chunk_m_h == 0xC0 or chunk_m_h == 0xC2:
+                        c, precision, height, width = struct_unpack (chunk_data, 0, ">BHH")
+                        inst.shape = (height, width, 3)
+                    elif chunk_m_h == 0xEF:
+                        inst.dfl_dict = pickle.loads(chunk_data)
+
+            return inst
+        except Exception as e:
+            io.log_err (f'Exception occured while DFLJPG.load_meta : {traceback.format_exc()}')
+            return None
+
     def has_data(self):
         return len(self.dfl_dict.keys()) != 0
 
@@ -165,6 +223,9 @@ class DFLJPG(object):
             raise Exception( f'cannot save {self.filename}' )
 
     def dump(self):
+        if self.chunks is None:
+            raise Exception(f"{self.filename} is loaded via load_meta and cannot be saved.")
+
         data = b""
 
         dict_data = self.dfl_dict
@@ -205,6 +266,32 @@ class DFLJPG(object):
 
         return data
 
+    @staticmethod
+    def dump_image(img, dfl_dict, jpeg_quality=100):
+        """
+        Encodes img to jpg and embeds dfl_dict as APP15 chunk in memory.
+
+        Only the APPn headers written by the encoder are walked,
+        the compressed image data is never parsed.
+
+        returns bytes of DFL jpg file
+        """
+        ret, buf = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality] )
+        if not ret:
+            raise Exception("DFLJPG.dump_image: unable to encode image")
+        data = buf.tobytes()
+
+        # insert after the last APPn following SOI
+        c = 2
+        while data[c] == 0xFF and data[c+1] & 0xF0 == 0xE0:
+            chunk_size, = struct.unpack (">H", data[c+2:c+4])
+            c += 2 + chunk_size
+
+        dict_data = { key : value for key, value in dfl_dict.items() if value is not None }
+        dict_data = pickle.dumps(dict_data)
+
+        return b''.join([ data[:c], struct.pack (">BBH", 0xFF, 0xEF, len(dict_data)+2 ), dict_data, data[c:] ])
+
     def get_img(self):
         if self.img is None:
             self.img = cv2_imread(self.filename)
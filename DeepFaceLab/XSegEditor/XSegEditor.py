@@ -1,3 +1,4 @@
+import collections
 import json
 import multiprocessing
 import os
@@ -6,6 +7,7 @@ import sys
 import tempfile
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from enum import IntEnum
 from types import SimpleNamespace as sn
 
@@ -102,6 +104,9 @@ class ImagePreviewSequenceBar(QFrame):
         return self.preview_images_count
 
     def update_images(self, prev_imgs=None, next_imgs=None):
+        """
+        prev_imgs, next_imgs    lists of QImage or None
+        """
         # Fix arrays
         if prev_imgs is None:
             prev_imgs = []
@@ -124,10 +129,10 @@ class ImagePreviewSequenceBar(QFrame):
             next_imgs = next_imgs[:next_img_conts_len]
 
         for i,img in enumerate(prev_imgs):
-            self.prev_img_conts[i].setPixmap( QPixmap.fromImage( QImage_from_np(img) ) if img is not None else self.black_q_pixmap )
+            self.prev_img_conts[i].setPixmap( QPixmap.fromImage(img) if img is not None else self.black_q_pixmap )
 
         for i,img in enumerate(next_imgs):
-            self.next_img_conts[i].setPixmap( QPixmap.fromImage( QImage_from_np(img) ) if img is not None else self.black_q_pixmap )
+            self.next_img_conts[i].setPixmap( QPixmap.fromImage(img) if img is not None else self.black_q_pixmap )
 
 class ColorScheme():
     def __init__(self, unselected_color, selected_color, outline_color, outline_width, pt_outline_color, cross_cursor):
@@ -349,22 +354,37 @@ class QCanvasOperator(QWidget):
         self.initialized = False
         self.last_state = None
 
-    def initialize(self, img, img_look_pt=None, view_scale=None, ie_polys=None, xseg_mask=None, canvas_config=None ):
-        q_img = self.q_img = QImage_from_np(img)
+    @staticmethod
+    def get_xseg_mask_images(img, xseg_mask):
+        """
+        returns uint8 xseg_mask and xseg_overlay_mask images of img size
+        """
+        h,w,c = img.shape
+        xseg_mask = cv2.resize(xseg_mask, (w,h), interpolation=cv2.INTER_CUBIC)
+        xseg_mask = imagelib.normalize_channels(xseg_mask, 1)
+        xseg_img = img.astype(np.float32)/255.0
+        xseg_overlay_mask = xseg_img*(1-xseg_mask)*0.5 + xseg_img*xseg_mask
+        xseg_overlay_mask = np.clip(xseg_overlay_mask*255, 0, 255).astype(np.uint8)
+        xseg_mask = np.clip(xseg_mask*255, 0, 255).astype(np.uint8)
+        return xseg_mask, xseg_overlay_mask
+
+    def initialize(self, img, img_look_pt=None, view_scale=None, ie_polys=None, xseg_mask=None, canvas_config=None, q_img=None, xseg_q_imgs=None ):
+        """
+        q_img, xseg_q_imgs   optional QImages of img and (xseg_mask, xseg_overlay_mask) prepared beforehand
+        """
+        if q_img is None:
+            q_img = QImage_from_np(img)
+        self.q_img = q_img
         self.img_pixmap = QPixmap.fromImage(q_img)
 
+        if xseg_q_imgs is None and xseg_mask is not None:
+            xseg_q_imgs = [ QImage_from_np(x) for x in QCanvasOperator.get_xseg_mask_images(img, xseg_mask) ]
+
         self.xseg_mask_pixmap = None
         self.xseg_overlay_mask_pixmap = None
-        if xseg_mask is not None:
-            h,w,c = img.shape
-            xseg_mask = cv2.resize(xseg_mask, (w,h), interpolation=cv2.INTER_CUBIC)
-            xseg_mask = imagelib.normalize_channels(xseg_mask, 1)
-            xseg_img = img.astype(np.float32)/255.0
-            xseg_overlay_mask = xseg_img*(1-xseg_mask)*0.5 + xseg_img*xseg_mask
-            xseg_overlay_mask = np.clip(xseg_overlay_mask*255, 0, 255).astype(np.uint8)
-            xseg_mask = np.clip(xseg_mask*255, 0, 255).astype(np.uint8)
-            self.xseg_mask_pixmap = QPixmap.fromImage(QImage_from_np(xseg_mask))
-            self.xseg_overlay_mask_pixmap = QPixmap.fromImage(QImage_from_np(xseg_overlay_mask))
+        if xseg_q_imgs is not None:
+            self.xseg_mask_pixmap = QPixmap.fromImage(xseg_q_imgs[0])
+            self.xseg_overlay_mask_pixmap = QPixmap.fromImage(xseg_q_imgs[1])
 
         self.img_size = QSize_to_np (self.img_pixmap.size())
 
@@ -1155,6 +1175,111 @@ class LoaderQSubprocessor(QSubprocessor):
                 return idx, True, ie_polys.has_polys()
             return idx, False, False
 
+class ImagePrefetcher():
+    """
+    Loads images ahead on worker threads into memory bounded LRU cache.
+
+    Every entry holds decoded image with prepared QImages, preview bar thumbnail and seg_ie_polys,
+    so switching to prefetched face costs only a dict lookup.
+    """
+    def __init__(self, thumbnail_size, threads_count=4, max_bytes=1024*1024*1024):
+        self.thumbnail_size = thumbnail_size
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(threads_count)
+        self.entries = collections.OrderedDict()
+        self.window = set()
+
+    @staticmethod
+    def load_entry(image_path, thumbnail_size):
+        try:
+            data = image_path.read_bytes()
+            img = cv2_imread(image_path, loader_func=lambda _: data)
+            if img is None:
+                io.log_err(f'Unable to load {image_path}')
+                return None
+
+            e = sn(img=img, q_img=QImage_from_np(img), has_data=False, ie_polys=None, xseg_imgs=None, xseg_q_imgs=None)
+            e.thumbnail = cv2.resize(img, (thumbnail_size,thumbnail_size), interpolation=cv2.INTER_AREA)
+            e.thumbnail_q_img = QImage_from_np(e.thumbnail)
+            e.nbytes = img.nbytes + e.thumbnail.nbytes
+
+            dflimg = DFLIMG.load(image_path, loader_func=lambda _: data)
+            if dflimg is not None and dflimg.has_data():
+                e.has_data = True
+                e.ie_polys = dflimg.get_seg_ie_polys().dump()
+                xseg_mask = dflimg.get_xseg_mask()
+                if xseg_mask is not None:
+                    e.xseg_imgs = QCanvasOperator.get_xseg_mask_images(img, xseg_mask)
+                    e.xseg_q_imgs = [ QImage_from_np(x) for x in e.xseg_imgs ]
+                    e.nbytes += sum( x.nbytes for x in e.xseg_imgs )
+            return e
+        except:
+            io.log_err(f'Unable to load {image_path} : {traceback.format_exc()}')
+            return None
+
+    def prefetch(self, image_paths):
+        """
+        schedules loading of image_paths in order of priority,
+        entries not in image_paths can be evicted
+        """
+        self.window = set(image_paths)
+        for image_path in image_paths:
+            if image_path not in self.entries:
+                self.entries[image_path] = self.executor.submit(ImagePrefetcher.load_entry, image_path, self.thumbnail_size)
+        self.evict()
+
+    def evict(self):
+        # pending loads, which are out of the window, are cancelled
+        for image_path, future in list(self.entries.items()):
+            if image_path not in self.window and future.cancel():
+                del self.entries[image_path]
+
+        def get_nbytes(future):
+            e = future.result() if future.done() and not future.cancelled() else None
+            return e.nbytes if e is not None else 0
+
+        # least recently used first
+        total = sum( get_nbytes(future) for future in self.entries.values() )
+        for image_path, future in list(self.entries.items()):
+            if total <= self.max_bytes:
+                break
+            if image_path not in self.window and future.done():
+                total -= get_nbytes(future)
+                del self.entries[image_path]
+
+    def get(self, image_path):
+        """
+        returns entry, waits for it if it's not loaded yet
+        """
+        future = self.entries.get(image_path, None)
+        if future is None:
+            future = self.entries[image_path] = self.executor.submit(ImagePrefetcher.load_entry, image_path, self.thumbnail_size)
+        self.entries.move_to_end(image_path)
+        return future.result()
+
+    def get_ready(self, image_path):
+        """
+        returns entry if it's already loaded, otherwise None
+        """
+        future = self.entries.get(image_path, None)
+        if future is not None and future.done():
+            return future.result()
+        return None
+
+    def is_pending(self, image_path):
+        future = self.entries.get(image_path, None)
+        return future is not None and not future.done()
+
+    def invalidate(self, image_path):
+        future = self.entries.pop(image_path, None)
+        if future is not None:
+            future.cancel()
+
+    def finalize(self):
+        for future in self.entries.values():
+            future.cancel()
+        self.executor.shutdown(wait=False)
+
 class MainWindow(QXMainWindow):
 
     def __init__(self, input_dirpath, cfg_root_path):
@@ -1170,8 +1295,7 @@ class MainWindow(QXMainWindow):
         self.cfg_path = cfg_root_path / 'MainWindow_cfg.dat'
         self.cfg_dict = pickle.loads(self.cfg_path.read_bytes()) if self.cfg_path.exists() else {}
 
-        self.cached_images = {}
-        self.cached_has_ie_polys = {}
+        self.image_prefetcher = ImagePrefetcher(thumbnail_size=QUIConfig.preview_bar_icon_q_size.width()*2)
 
         self.spin_box = QSpinBox()
 
@@ -1218,57 +1342,38 @@ class MainWindow(QXMainWindow):
     def closeEvent(self, ev):
         self.cfg_dict['geometry'] = self.saveGeometry().data()
         self.cfg_path.write_bytes( pickle.dumps(self.cfg_dict) )
+        self.image_prefetcher.finalize()
 
 
     def update_cached_images (self, count=5):
-        d = self.cached_images
+        # current and next images first
+        self.image_prefetcher.prefetch( self.image_paths[:count+1] + self.image_paths_done[-1:-count-1:-1] )
 
-        for image_path in self.image_paths_done[:-count]+self.image_paths[count:]:
-            if image_path in d:
-                del d[image_path]
-
-        for image_path in self.image_paths[:count]+self.image_paths_done[-count:]:
-            if image_path not in d:
-                img = cv2_imread(image_path)
-                if img is not None:
-                    d[image_path] = img
+    def update_preview_bar(self):
+        count = self.image_bar.get_preview_images_count()
+        prev_image_paths = self.image_paths_done[-1:-count:-1]
+        next_image_paths = self.image_paths[:count]
 
-    def load_image(self, image_path):
-        try:
-            img = self.cached_images.get(image_path, None)
-            if img is None:
-                img = cv2_imread(image_path)
-                self.cached_images[image_path] = img
-            if img is None:
-                io.log_err(f'Unable to load {image_path}')
-        except:
-            img = None
+        def get_thumbnail(image_path):
+            e = self.image_prefetcher.get_ready(image_path)
+            return e.thumbnail_q_img if e is not None else None
 
-        return img
+        self.image_bar.update_images( [ get_thumbnail(x) for x in prev_image_paths ], [ get_thumbnail(x) for x in next_image_paths ] )
 
-    def update_preview_bar(self):
-        count = self.image_bar.get_preview_images_count()
-        d = self.cached_images
-        prev_imgs = [ d.get(image_path, None) for image_path in self.image_paths_done[-1:-count:-1] ]
-        next_imgs = [ d.get(image_path, None) for image_path in self.image_paths[:count] ]
-        self.image_bar.update_images(prev_imgs, next_imgs)
+        # refresh when the pending thumbnails are loaded
+        if any( self.image_prefetcher.is_pending(x) for x in prev_image_paths+next_image_paths ):
+            QTimer.singleShot(50, self.update_preview_bar)
 
 
     def canvas_initialize(self, image_path, only_has_polys=False):
         if only_has_polys and not self.image_paths_has_ie_polys[image_path]:
             return False
 
-        dflimg = DFLIMG.load(image_path)
-        if not dflimg or not dflimg.has_data():
-            return False
-
-        ie_polys = dflimg.get_seg_ie_polys()
-        xseg_mask = dflimg.get_xseg_mask()
-        img = self.load_image(image_path)
-        if img is None:
+        e = self.image_prefetcher.get(image_path)
+        if e is None or not e.has_data:
             return False
 
-        self.canvas.op.initialize ( img,  ie_polys=ie_polys, xseg_mask=xseg_mask )
+        self.canvas.op.initialize ( e.img, ie_polys=SegIEPolys.load(e.ie_polys), q_img=e.q_img, xseg_q_imgs=e.xseg_q_imgs )
 
         self.filename_label.setText(f"{image_path.name}")
 
@@ -1294,6 +1399,7 @@ class MainWindow(QXMainWindow):
 
                 dflimg.set_seg_ie_polys( new_ie_polys )
                 dflimg.save()
+                self.image_prefetcher.invalidate(image_path)
 
         self.filename_label.setText(f"")
 
@@ -1350,6 +1456,7 @@ class MainWindow(QXMainWindow):
         
         img_path = self.image_paths_done.pop(-1)
         img_path = Path(img_path)
+        self.image_prefetcher.invalidate(img_path)
         self.trash_dirpath.mkdir(parents=True, exist_ok=True)
         img_path.rename( self.trash_dirpath / img_path.name )
         
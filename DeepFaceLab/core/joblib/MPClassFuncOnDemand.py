@@ -1,4 +1,5 @@
 import multiprocessing
+import threading
 from core.interact import interact as io
 
 class MPClassFuncOnDemand():
@@ -8,6 +9,7 @@ class MPClassFuncOnDemand():
         self.class_kwargs = class_kwargs
    
         self.class_func = None
+        self.class_func_lock = threading.Lock()
         
         self.s2c = multiprocessing.Queue()
         self.c2s = multiprocessing.Queue()
@@ -15,18 +17,25 @@ class MPClassFuncOnDemand():
         
         io.add_process_messages_callback(self.io_callback)
 
+    def call_class_func(self, *args, **kwargs):
+        with self.class_func_lock:
+            if self.class_func is None:
+                self.class_func = getattr( self.class_handle(**self.class_kwargs), self.class_func_name)
+            return self.class_func (*args, **kwargs)
+
     def io_callback(self):        
         while not self.c2s.empty():
             func_args, func_kwargs = self.c2s.get()
-            if self.class_func is None:
-                self.class_func = getattr( self.class_handle(**self.class_kwargs), self.class_func_name)
-            self.s2c.put ( self.class_func (*func_args, **func_kwargs) )
+            self.s2c.put ( self.call_class_func (*func_args, **func_kwargs) )
 
     def __call__(self, *args, **kwargs):
+        if 'class_handle' in self.__dict__:
+            # called in host process, e.g. from worker thread, calling directly
+            return self.call_class_func (*args, **kwargs)
+
         with self.lock:
             self.c2s.put ( (args, kwargs) )
             return self.s2c.get()
 
     def __getstate__(self):
         return {'s2c':self.s2c, 'c2s':self.c2s, 'lock':self.lock}
-
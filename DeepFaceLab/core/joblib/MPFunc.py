@@ -1,9 +1,11 @@
 import multiprocessing
+import threading
 from core.interact import interact as io
 
 class MPFunc():
     def __init__(self, func):
         self.func = func
+        self.func_lock = threading.Lock()
         
         self.s2c = multiprocessing.Queue()
         self.c2s = multiprocessing.Queue()
@@ -14,9 +16,15 @@ class MPFunc():
     def io_callback(self):        
         while not self.c2s.empty():
             func_args, func_kwargs = self.c2s.get()
-            self.s2c.put ( self.func (*func_args, **func_kwargs) )
+            with self.func_lock:
+                self.s2c.put ( self.func (*func_args, **func_kwargs) )
 
     def __call__(self, *args, **kwargs):
+        if 'func' in self.__dict__:
+            # called in host process, e.g. from worker thread, calling directly
+            with self.func_lock:
+                return self.func (*args, **kwargs)
+
         with self.lock:
             self.c2s.put ( (args, kwargs) )
             return self.s2c.get()
@@ -1,5 +1,7 @@
 import traceback
 import multiprocessing
+import multiprocessing.connection
+import threading
 import time
 import sys
 from core.interact import interact as io
@@ -13,12 +15,14 @@ class Subprocessor(object):
     class Cli(object):
         def __init__ ( self, client_dict ):
             s2c = multiprocessing.Queue()
-            c2s = multiprocessing.Queue()
-            self.p = multiprocessing.Process(target=self._subprocess_run, args=(client_dict,s2c,c2s) )
+            #one-way pipe, so the host can wait on connections of all clients
+            c2s, c2s_writer = multiprocessing.Pipe(duplex=False)
+            self.p = multiprocessing.Process(target=self._subprocess_run, args=(client_dict,s2c,c2s_writer) )
             self.s2c = s2c
             self.c2s = c2s
             self.p.daemon = True
             self.p.start()
+            c2s_writer.close()
 
             self.state = None
             self.sent_time = None
@@ -29,6 +33,24 @@ class Subprocessor(object):
         def kill(self):
             self.p.terminate()
             self.p.join()
+            self.c2s.close()
+
+        def get_messages(self):
+            """
+            returns messages received from subprocess,
+            'error' message if subprocess has exited without finalization
+            """
+            msgs = []
+            if self.c2s.closed:
+                return msgs
+            try:
+                while self.c2s.poll():
+                    msgs.append ( self.c2s.recv() )
+            except (EOFError, OSError):
+                self.c2s.close()
+                if not any ( msg.get('op','') in ['error', 'finalized'] for msg in msgs ):
+                    msgs.append ( {'op': 'error', 'data' : None, 'err_msg' : f'subprocess exited with code {self.p.exitcode}'} )
+            return msgs
 
         #overridable optional
         def on_initialize(self, client_dict):
@@ -50,18 +72,27 @@ class Subprocessor(object):
             #return string identificator of your 'data'
             return "undefined"
 
-        def log_info(self, msg): self.c2s.put ( {'op': 'log_info', 'msg':msg } )
-        def log_err(self, msg): self.c2s.put ( {'op': 'log_err' , 'msg':msg } )
-        def progress_bar_inc(self, c): self.c2s.put ( {'op': 'progress_bar_inc' , 'c':c } )
+        def log_info(self, msg): self.send ( {'op': 'log_info', 'msg':msg } )
+        def log_err(self, msg): self.send ( {'op': 'log_err' , 'msg':msg } )
+        def progress_bar_inc(self, c): self.send ( {'op': 'progress_bar_inc' , 'c':c } )
+
+        def send(self, obj):
+            """
+            sends message to host, can be called from any thread of subprocess
+            """
+            #large messages are written to pipe in parts, so they must not interleave
+            with self.c2s_lock:
+                self.c2s.send (obj)
 
         def _subprocess_run(self, client_dict, s2c, c2s):
             self.c2s = c2s
+            self.c2s_lock = threading.Lock()
             data = None
             is_error = False
             try:
                 self.on_initialize(client_dict)
 
-                c2s.put ( {'op': 'init_ok'} )
+                self.send ( {'op': 'init_ok'} )
 
                 while True:
                     msg = s2c.get()
@@ -69,20 +100,24 @@ class Subprocessor(object):
                     if op == 'data':
                         data = msg['data']
                         result = self.process_data (data)
-                        c2s.put ( {'op': 'success', 'data' : data, 'result' : result} )
+                        self.send ( {'op': 'success', 'data' : data, 'result' : result} )
+                        data = None
+                    elif op == 'data_chunk':
+                        chunk, results = msg['data'], []
+                        for data in chunk:
+                            results.append ( self.process_data (data) )
+                        self.send ( {'op': 'success_chunk', 'data' : chunk, 'result' : results} )
                         data = None
                     elif op == 'close':
                         break
 
-                    time.sleep(0.001)
-
                 self.on_finalize()
-                c2s.put ( {'op': 'finalized'} )
+                self.send ( {'op': 'finalized'} )
             except Subprocessor.SilenceException as e:
-                c2s.put ( {'op': 'error', 'data' : data} )
+                self.send ( {'op': 'error', 'data' : data} )
             except Exception as e:
                 err_msg = traceback.format_exc()
-                c2s.put ( {'op': 'error', 'data' : data, 'err_msg' : err_msg} )
+                self.send ( {'op': 'error', 'data' : data, 'err_msg' : err_msg} )
 
             c2s.close()
             s2c.close()
@@ -95,7 +130,16 @@ class Subprocessor(object):
             self.__dict__.update(d)
 
     #overridable
-    def __init__(self, name, SubprocessorCli_class, no_response_time_sec = 0, io_loop_sleep_time=0.005, initialize_subprocesses_in_serial=False):
+    def __init__(self, name, SubprocessorCli_class, no_response_time_sec = 0, io_loop_sleep_time=0.005, initialize_subprocesses_in_serial=False, items_in_flight=1, data_chunk_size=1):
+        """
+        io_loop_sleep_time  max time to wait for messages from subprocesses before next on_tick and io.process_messages
+
+        items_in_flight     max number of data messages queued to a subprocess at once,
+                            allows subprocess to start next one without waiting the host
+
+        data_chunk_size     number of get_data items sent to a subprocess in one data message,
+                            on_result is still called per item
+        """
         if not issubclass(SubprocessorCli_class, Subprocessor.Cli):
             raise ValueError("SubprocessorCli_class must be subclass of Subprocessor.Cli")
 
@@ -104,6 +148,8 @@ class Subprocessor(object):
         self.no_response_time_sec = no_response_time_sec
         self.io_loop_sleep_time = io_loop_sleep_time
         self.initialize_subprocesses_in_serial = initialize_subprocesses_in_serial
+        self.items_in_flight = max(1, items_in_flight)
+        self.data_chunk_size = max(1, data_chunk_size)
 
     #overridable
     def process_info_generator(self):
@@ -150,6 +196,18 @@ class Subprocessor(object):
     def on_check_run(self):
         return True
 
+    def wait_messages(self, timeout, clis=None):
+        """
+        blocks until any of clis has a message or timeout, then processes io messages
+        """
+        if clis is None:
+            clis = self.clis
+
+        if timeout != 0 and len(clis) != 0:
+            multiprocessing.connection.wait ( [ cli.c2s for cli in clis if not cli.c2s.closed ], timeout=timeout )
+
+        io.process_messages(0)
+
     def run(self):
         if not self.on_check_run():
             return self.get_result()
@@ -157,8 +215,7 @@ class Subprocessor(object):
         self.clis = []
 
         def cli_init_dispatcher(cli):
-            while not cli.c2s.empty():
-                obj = cli.c2s.get()
+            for obj in cli.get_messages():
                 op = obj.get('op','')
                 if op == 'init_ok':
                     cli.state = 0
@@ -180,7 +237,7 @@ class Subprocessor(object):
                 cli = self.SubprocessorCli_class(client_dict)
                 cli.state = 1
                 cli.sent_time = 0
-                cli.sent_data = None
+                cli.sent_data = []
                 cli.name = name
                 cli.host_dict = host_dict
 
@@ -191,7 +248,7 @@ class Subprocessor(object):
                         cli_init_dispatcher(cli)
                         if cli.state == 0:
                             break
-                        io.process_messages(0.005)
+                        self.wait_messages(0.005, [cli])
             except:
                 raise Exception (f"Unable to start subprocess {name}. Error: {traceback.format_exc()}")
 
@@ -204,7 +261,7 @@ class Subprocessor(object):
                 cli_init_dispatcher(cli)
             if all ([cli.state == 0 for cli in self.clis]):
                 break
-            io.process_messages(0.005)
+            self.wait_messages(0.005)
 
         if len(self.clis) == 0:
             raise Exception ( "Unable to start subprocesses." )
@@ -216,25 +273,35 @@ class Subprocessor(object):
         #main loop of data processing
         while True:
             for cli in self.clis[:]:
-                while not cli.c2s.empty():
-                    obj = cli.c2s.get()
+                for obj in cli.get_messages():
                     op = obj.get('op','')
-                    if op == 'success':
+                    if op == 'success' or op == 'success_chunk':
                         #success processed data, return data and result to on_result
-                        self.on_result (cli.host_dict, obj['data'], obj['result'])
-                        self.sent_data = None
-                        cli.state = 0
+                        if op == 'success':
+                            datas, results = [ obj['data'] ], [ obj['result'] ]
+                        else:
+                            datas, results = obj['data'], obj['result']
+
+                        cli.sent_data.pop(0)
+                        cli.sent_time = time.time()
+                        if len(cli.sent_data) == 0:
+                            cli.state = 0
+
+                        for data, result in zip(datas, results):
+                            self.on_result (cli.host_dict, data, result)
                     elif op == 'error':
-                        #some error occured while process data, returning chunk to on_data_return
+                        #some error occured while process data, returning all sent data to on_data_return
                         err_msg = obj.get('err_msg', None)
                         if err_msg is not None:
                             io.log_info(f'Error while processing data: {err_msg}')
-                            
-                        if 'data' in obj.keys():
-                            self.on_data_return (cli.host_dict, obj['data'] )                        
+
+                        for chunk in cli.sent_data:
+                            for data in chunk:
+                                self.on_data_return (cli.host_dict, data )
                         #and killing process
                         cli.kill()
                         self.clis.remove(cli)
+                        break
                     elif op == 'log_info':
                         io.log_info(obj['msg'])
                     elif op == 'log_err':
@@ -247,30 +314,42 @@ class Subprocessor(object):
                     if cli.sent_time != 0 and self.no_response_time_sec != 0 and (time.time() - cli.sent_time) > self.no_response_time_sec:
                         #subprocess busy too long
                         print ( '%s doesnt response, terminating it.' % (cli.name) )
-                        self.on_data_return (cli.host_dict, cli.sent_data )
+                        for chunk in cli.sent_data:
+                            for data in chunk:
+                                self.on_data_return (cli.host_dict, data )
                         cli.kill()
                         self.clis.remove(cli)
 
             for cli in self.clis[:]:
-                if cli.state == 0:
-                    #free state of subprocess, get some data from get_data
-                    data = self.get_data(cli.host_dict)
-                    if data is not None:
-                        #and send it to subprocess
-                        cli.s2c.put ( {'op': 'data', 'data' : data} )
+                #keep up to items_in_flight chunks of data queued to subprocess, get them from get_data
+                while len(cli.sent_data) < self.items_in_flight:
+                    chunk = []
+                    while len(chunk) < self.data_chunk_size:
+                        data = self.get_data(cli.host_dict)
+                        if data is None:
+                            break
+                        chunk.append(data)
+
+                    if len(chunk) == 0:
+                        break
+
+                    #and send it to subprocess
+                    if self.data_chunk_size == 1:
+                        cli.s2c.put ( {'op': 'data', 'data' : chunk[0]} )
+                    else:
+                        cli.s2c.put ( {'op': 'data_chunk', 'data' : chunk} )
+
+                    if len(cli.sent_data) == 0:
                         cli.sent_time = time.time()
-                        cli.sent_data = data
-                        cli.state = 1
+                    cli.sent_data.append(chunk)
+                    cli.state = 1
 
-            if self.io_loop_sleep_time != 0:
-                io.process_messages(self.io_loop_sleep_time)
+            self.wait_messages(self.io_loop_sleep_time)
 
             if self.on_tick() and all ([cli.state == 0 for cli in self.clis]):
                 #all subprocesses free and no more data available to process, ending loop
                 break
 
-
-
         #gracefully terminating subprocesses
         for cli in self.clis[:]:
             cli.s2c.put ( {'op': 'close'} )
@@ -278,11 +357,12 @@ class Subprocessor(object):
 
         while True:
             for cli in self.clis[:]:
+                if cli.state == 2:
+                    continue
                 terminate_it = False
-                while not cli.c2s.empty():
-                    obj = cli.c2s.get()
+                for obj in cli.get_messages():
                     obj_op = obj['op']
-                    if obj_op == 'finalized':
+                    if obj_op == 'finalized' or obj_op == 'error':
                         terminate_it = True
                         break
 
@@ -296,6 +376,8 @@ class Subprocessor(object):
             if all ([cli.state == 2 for cli in self.clis]):
                 break
 
+            self.wait_messages(0.005, [ cli for cli in self.clis if cli.state != 2 ])
+
         #finalizing host logic and return result
         self.on_clients_finalized()
 
@@ -0,0 +1,32 @@
+import collections
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ThreadPoolMap(object):
+    """
+    Ordered map of func over iterable in a pool of threads,
+    with bounded number of items in flight, so memory does not grow with iterable length.
+
+    Suitable for I/O bound work and for numpy/cv2 work which releases the GIL.
+
+    for result in ThreadPoolMap(func, threads_count=8)(iterable):
+        ...
+    """
+    def __init__(self, func, threads_count=None, prefetch=None):
+        if threads_count is None:
+            threads_count = min(multiprocessing.cpu_count(), 8)
+        self.func = func
+        self.threads_count = max(1, threads_count)
+        self.prefetch = prefetch if prefetch is not None else self.threads_count*2
+
+    def __call__(self, iterable):
+        with ThreadPoolExecutor(self.threads_count) as executor:
+            futures = collections.deque()
+            for item in iterable:
+                futures.append( executor.submit(self.func, item) )
+                if len(futures) >= self.prefetch:
+                    yield futures.popleft().result()
+
+            while len(futures) != 0:
+                yield futures.popleft().result()
@@ -4,3 +4,4 @@ from .SubprocessGenerator import SubprocessGenerator
 from .MPFunc import MPFunc
 from .MPClassFuncOnDemand import MPClassFuncOnDemand
 from .Undaemonize import Undaemonize
+from .ThreadPoolMap import ThreadPoolMap
@@ -1,3 +1,4 @@
+import mmap
 import pickle
 from pathlib import Path
 from core import pathex
@@ -67,9 +68,9 @@ class Saveable():
         """
         filepath = Path(filename)
         if filepath.exists():
-            result = True
-            d_dumped = filepath.read_bytes()
-            d = pickle.loads(d_dumped)
+            # unpickled from mapped file, so the file is not held in memory along with the weights
+            with open(filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                d = pickle.loads(mm)
         else:
             return False
 
@@ -17,6 +17,7 @@ Reasons why we cannot import tensorflow or any tensorflow.sub modules right here
 NCHW speed up training for 10-20%.
 """
 
+import multiprocessing
 import os
 import sys
 import warnings
@@ -41,6 +42,35 @@ class nn():
 
     floatx = None
 
+    # name : (share of the session cores for intra-op pool, inter-op threads, pin the session to its cores, XLA JIT)
+    cpu_profiles = { 'default'   : None,               # tensorflow defaults
+                     'dedicated' : (1.0, 2, True,  False), # sessions own the cores, training, extraction
+                     'shared'    : (0.5, 1, False, False), # half of the cores is left for other work, merging
+                     'xla'       : (1.0, 2, True,  True),
+                   }
+
+    @staticmethod
+    def get_cpu_profile_config(device_config):
+        """
+        returns intra_threads, inter_threads, cores to pin or None, xla_jit
+        for the CPU session of device_config, or None if tensorflow defaults are used
+
+        cores of the host are split equally between cpu_sessions_count sessions
+        """
+        profile = nn.cpu_profiles[device_config.cpu_profile]
+        if profile is None:
+            return None
+        intra_share, inter_threads, pin, xla_jit = profile
+
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(multiprocessing.cpu_count()))
+        sessions_count = min(max(1, device_config.cpu_sessions_count), len(cores))
+        per_session = len(cores) // sessions_count
+        session_idx = device_config.cpu_session_idx % sessions_count
+        session_cores = cores[session_idx*per_session:(session_idx+1)*per_session]
+
+        intra_threads = max(1, int(len(session_cores)*intra_share))
+        return intra_threads, inter_threads, session_cores if pin and sessions_count > 1 else None, xla_jit
+
     @staticmethod
     def initialize(device_config=None, floatx="float32", data_format="NHWC"):
 
@@ -51,6 +81,19 @@ class nn():
 
             # Manipulate environment variables before import tensorflow
 
+            cpu_profile_config = nn.get_cpu_profile_config(device_config) if len(device_config.devices) == 0 else None
+            if cpu_profile_config is not None:
+                intra_threads, inter_threads, pin_cores, xla_jit = cpu_profile_config
+                os.environ['TF_ENABLE_ONEDNN_OPTS'] = '1'
+                os.environ['OMP_NUM_THREADS'] = str(intra_threads)
+                if pin_cores is not None:
+                    # threads of tensorflow are created later and inherit the affinity
+                    os.environ['KMP_AFFINITY'] = 'granularity=fine,compact,1,0'
+                    if hasattr(os, 'sched_setaffinity'):
+                        os.sched_setaffinity(0, pin_cores)
+                if xla_jit:
+                    os.environ['TF_XLA_FLAGS'] = (os.environ.get('TF_XLA_FLAGS', '') + ' --tf_xla_cpu_global_jit').strip()
+
             first_run = False
             if len(device_config.devices) != 0:
                 if sys.platform[0:3] == 'win':
@@ -94,6 +137,7 @@ class nn():
 
             # Initialize framework
             import core.leras.ops
+            import core.leras.staging
             import core.leras.layers
             import core.leras.initializers
             import core.leras.optimizers
@@ -104,6 +148,12 @@ class nn():
             if len(device_config.devices) == 0:
                 config = tf.ConfigProto(device_count={'GPU': 0})
                 nn.tf_default_device_name = '/CPU:0'
+
+                if cpu_profile_config is not None:
+                    config.intra_op_parallelism_threads = intra_threads
+                    config.inter_op_parallelism_threads = inter_threads
+                    if xla_jit:
+                        config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
             else:
                 nn.tf_default_device_name = f'/{device_config.devices[0].tf_dev_type}:0'
                 
@@ -261,14 +311,27 @@ class nn():
         def ask_choose_device(*args, **kwargs):
             return nn.DeviceConfig.GPUIndexes( nn.ask_choose_device_idxs(*args,**kwargs) )
 
-        def __init__ (self, devices=None):
+        def __init__ (self, devices=None, cpu_profile=None, cpu_sessions_count=1, cpu_session_idx=0):
+            """
+            cpu_profile         name from nn.cpu_profiles, used if there are no devices
+
+            cpu_sessions_count  how many CPU sessions share the host, cpu_session_idx is index of this one
+            """
             devices = devices or []
 
             if not isinstance(devices, Devices):
                 devices = Devices(devices)
 
+            if cpu_profile is None:
+                cpu_profile = 'default'
+            if cpu_profile not in nn.cpu_profiles:
+                raise ValueError(f"unknown cpu_profile {cpu_profile}, available: {', '.join(nn.cpu_profiles.keys())}")
+
             self.devices = devices
             self.cpu_only = len(devices) == 0
+            self.cpu_profile = cpu_profile
+            self.cpu_sessions_count = cpu_sessions_count
+            self.cpu_session_idx = cpu_session_idx
 
         @staticmethod
         def BestGPU():
@@ -296,5 +359,11 @@ class nn():
             return nn.DeviceConfig(devices)
 
         @staticmethod
-        def CPU():
-            return nn.DeviceConfig([])
+        def CPU(cpu_profile=None, sessions_count=1, session_idx=0):
+            """
+            cpu_profile     name from nn.cpu_profiles, True and None are 'default',
+                            so cpu_only argument can be passed as is
+            """
+            if not isinstance(cpu_profile, str):
+                cpu_profile = None
+            return nn.DeviceConfig([], cpu_profile, sessions_count, session_idx)
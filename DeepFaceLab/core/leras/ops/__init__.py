@@ -19,6 +19,10 @@ def batch_set_value(tuples):
                 if isinstance(value, nn.tf.Operation) or \
                     isinstance(value, nn.tf.Variable):
                     assign_ops.append(value)
+                elif isinstance(x, nn.tf.Variable):
+                    # value is fed to the initializer of the variable, so no ops are added to the graph on every load
+                    assign_ops.append(x.initializer)
+                    feed_dict[x.initializer.inputs[1]] = np.asarray(value, dtype=x.dtype.as_numpy_dtype)
                 else:
                     value = np.asarray(value, dtype=x.dtype.as_numpy_dtype)
                     assign_placeholder = nn.tf.placeholder( x.dtype.base_dtype, shape=[None]*value.ndim )
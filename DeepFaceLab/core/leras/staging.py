@@ -0,0 +1,108 @@
+import queue
+import threading
+import traceback
+
+import numpy as np
+from core.leras import nn
+tf = nn.tf
+from tensorflow.python.ops.data_flow_ops import StagingArea
+
+class InputStaging():
+    """
+    Double-buffered input of the training step.
+
+    Feeder thread takes next batch from the generator func
+    and uploads it to StagingArea on the device, while the current step runs,
+    so the step does not wait for feed conversion and host-to-device transfer.
+
+    Placeholders are replaced by placeholder_with_default of staged tensors,
+    so loss graph is built as before. Run which feeds all used inputs does not touch the staging,
+    run which feeds none of them takes next staged batch.
+
+        self.input_staging = nn.InputStaging( [self.warped_src, self.target_src], device )
+        self.warped_src, self.target_src = self.input_staging.get_inputs()
+        ...build graph...
+
+        self.input_staging.start(self.generate_next_samples, lambda sample: [sample[0][0], sample[1][0]] )
+        ...
+        sample = self.input_staging.get()   # host copy of the batch, which is consumed by next unfed run
+        nn.tf_sess.run(train_op)
+    """
+    def __init__(self, placeholders, device=None, capacity=2):
+        self.placeholders = placeholders
+        self.device = device if device is not None else nn.tf_default_device_name
+        self.capacity = max(1, capacity)
+
+        with tf.device(self.device):
+            # not bounded in the session, blocked put would hold thread of the session pool
+            self.area = StagingArea( dtypes=[ ph.dtype for ph in placeholders ],
+                                     shapes=[ ph.shape for ph in placeholders ] )
+            self.put_op = self.area.put(placeholders)
+            staged = self.area.get()
+            staged = staged if isinstance(staged, (list,tuple)) else [staged]
+            self.inputs = [ tf.placeholder_with_default(t, ph.shape, name=ph.op.name+'_staged') for t, ph in zip(staged, placeholders) ]
+            self.drop_op = staged[0].op
+            self.clear_op = self.area.clear()
+
+        self.thread = None
+        self.slots = None
+        self.host_queue = None
+        self.stop_event = threading.Event()
+
+    def get_inputs(self):
+        return self.inputs
+
+    def start(self, generator_func, feed_func):
+        """
+        generator_func()        returns next batch
+
+        feed_func(batch)        returns list of arrays for the placeholders
+        """
+        self.stop()
+        self.stop_event.clear()
+        # staged batches, which are not taken by get() yet
+        self.slots = threading.Semaphore(self.capacity)
+        self.host_queue = queue.Queue()
+        self.thread = threading.Thread(target=self.feeder, args=(generator_func, feed_func), daemon=True)
+        self.thread.start()
+
+    def feeder(self, generator_func, feed_func):
+        try:
+            while True:
+                self.slots.acquire()
+                if self.stop_event.is_set():
+                    break
+                batch = generator_func()
+                feed_dict = { ph : np.ascontiguousarray(x, dtype=ph.dtype.as_numpy_dtype) for ph, x in zip(self.placeholders, feed_func(batch)) }
+                nn.tf_sess.run(self.put_op, feed_dict=feed_dict)
+                # batch is given to get() only when it is staged, so the step never waits inside the session
+                self.host_queue.put( (batch, None) )
+        except:
+            self.host_queue.put( (None, traceback.format_exc()) )
+
+    def get(self):
+        """
+        returns host copy of the batch, which is taken by next run without feeds
+        """
+        batch, err = self.host_queue.get()
+        if err is not None:
+            raise Exception(f'Input staging error: {err}')
+        self.slots.release()
+        return batch
+
+    def drop(self):
+        """
+        drops the batch returned by get() from the staging
+        """
+        nn.tf_sess.run(self.drop_op)
+
+    def stop(self):
+        if self.thread is not None:
+            self.stop_event.set()
+            self.slots.release()
+            self.thread.join()
+            nn.tf_sess.run(self.clear_op)
+            self.thread = None
+            self.host_queue = None
+
+nn.InputStaging = InputStaging
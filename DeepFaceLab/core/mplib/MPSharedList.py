@@ -1,3 +1,4 @@
+import bisect
 import multiprocessing
 import pickle
 import struct
@@ -16,6 +17,7 @@ class MPSharedList():
             self.table_offsets = None
             self.data_offsets  = None
             self.sh_bs         = None
+            self.obj_starts    = None
         else:
             obj_count, table_offset, data_offset, sh_b = MPSharedList.bake_data(obj_list)
 
@@ -23,6 +25,7 @@ class MPSharedList():
             self.table_offsets = [table_offset]
             self.data_offsets  = [data_offset]
             self.sh_bs         = [sh_b]
+            self.obj_starts    = [0, obj_count]
 
     def __add__(self, o):
         if isinstance(o, MPSharedList):
@@ -31,6 +34,8 @@ class MPSharedList():
             m.table_offsets = self.table_offsets + o.table_offsets
             m.data_offsets  = self.data_offsets  + o.data_offsets
             m.sh_bs         = self.sh_bs         + o.sh_bs
+            #prefix sums of obj_counts for chunk lookup
+            m.obj_starts    = [ sum(m.obj_counts[:i]) for i in range(len(m.obj_counts)+1) ]
             return m
         elif isinstance(o, int):
             return self
@@ -41,29 +46,25 @@ class MPSharedList():
         return self+o
 
     def __len__(self):
-        return sum(self.obj_counts)
+        return self.obj_starts[-1]
 
     def __getitem__(self, key):
-        obj_count = sum(self.obj_counts)
+        obj_starts = self.obj_starts
+        obj_count = obj_starts[-1]
         if key < 0:
             key = obj_count+key
         if key < 0 or key >= obj_count:
             raise ValueError("out of range")
 
-        for i in range(len(self.obj_counts)):
+        i = bisect.bisect_right(obj_starts, key) - 1
+        key -= obj_starts[i]
+        table_offset = self.table_offsets[i]
+        data_offset = self.data_offsets[i]
+        sh_b = memoryview(self.sh_bs[i]).cast('B')
 
-            if key < self.obj_counts[i]:
-                table_offset = self.table_offsets[i]
-                data_offset = self.data_offsets[i]
-                sh_b = self.sh_bs[i]
-                break
-            key -= self.obj_counts[i]
+        offset_start, offset_end = struct.unpack('<QQ', sh_b[ table_offset + key*8     : table_offset + (key+2)*8] )
 
-        sh_b = memoryview(sh_b).cast('B')
-
-        offset_start, offset_end = struct.unpack('<QQ', sh_b[ table_offset + key*8     : table_offset + (key+2)*8].tobytes() )
-
-        return pickle.loads( sh_b[ data_offset + offset_start : data_offset + offset_end ].tobytes() )
+        return pickle.loads( sh_b[ data_offset + offset_start : data_offset + offset_end ] )
 
     def __iter__(self):
         for i in range(self.__len__()):
@@ -171,89 +171,124 @@ class FaceEnhancer(object):
                                         (tf.float32, (None,1,) ),
                                     ])
 
+        self.tilings = {}
+
     def enhance (self, inp_img, is_tanh=False, preserve_size=True):
-        if not is_tanh:
-            inp_img = np.clip( inp_img * 2 -1, -1, 1 )
+        return self.enhance_batch ( [inp_img], is_tanh=is_tanh, preserve_size=preserve_size )[0]
+
+    def get_tiling(self, h, w, patch_size=192, up_res=4):
+        """
+        returns patch positions along both axes and normalized blending windows, cached per padded input size
+
+        Patches overlap by half, the last one is aligned to the border.
+        Blending mask is outer product of 1D triangle windows,
+        so the sum of the masks and their normalization are separable by axes too.
+        """
+        key = (h, w, patch_size, up_res)
+        tiling = self.tilings.get(key, None)
+        if tiling is None:
+            patch_size_half = patch_size // 2
+            out_patch_size = patch_size*up_res
+            win = np.concatenate ( [ np.linspace (0,1,patch_size_half*up_res), np.linspace (1,0,patch_size_half*up_res) ] ).astype(np.float32)
+
+            tiling = []
+            for size in [h, w]:
+                positions = np.unique( np.minimum( np.arange(0, size-patch_size+patch_size_half, patch_size_half), size-patch_size ) )
+
+                win_sum = np.zeros ( (size*up_res,), np.float32 )
+                for pos in positions:
+                    win_sum[pos*up_res:pos*up_res+out_patch_size] += win
+                win_sum[win_sum == 0] = 1.0
+
+                wins = np.stack( [ win / win_sum[pos*up_res:pos*up_res+out_patch_size] for pos in positions ] )
+                tiling += [positions, wins]
+            tiling = self.tilings[key] = tuple(tiling)
+        return tiling
+
+    def enhance_batch (self, inp_imgs, is_tanh=False, preserve_size=True, batch_size=4):
+        """
+        enhances list of images, patches of all images are run through the model
+        in batches of batch_size patches per forward pass
+
+        returns list of images
+        """
+        if len(inp_imgs) == 0:
+            return []
 
-        param = np.array([0.2])
-        param1 = np.array([1.0])
         up_res = 4
         patch_size = 192
-        patch_size_half = patch_size // 2
-
-        ih,iw,ic = inp_img.shape
-        h,w,c = ih,iw,ic
+        out_patch_size = patch_size*up_res
 
-        th,tw = h*up_res, w*up_res
+        jobs = []
+        patches = []
+        for inp_img in inp_imgs:
+            inp_img = inp_img.astype(np.float32)
+            if not is_tanh:
+                inp_img = np.clip( inp_img * 2 -1, -1, 1 )
 
-        t_padding = 0
-        b_padding = 0
-        l_padding = 0
-        r_padding = 0
+            ih,iw,ic = inp_img.shape
 
-        if h < patch_size:
-            t_padding = (patch_size-h)//2
-            b_padding = (patch_size-h) - t_padding
+            t_padding = max(0, patch_size-ih) // 2
+            b_padding = max(0, patch_size-ih) - t_padding
+            l_padding = max(0, patch_size-iw) // 2
+            r_padding = max(0, patch_size-iw) - l_padding
 
-        if w < patch_size:
-            l_padding = (patch_size-w)//2
-            r_padding = (patch_size-w) - l_padding
-
-        if t_padding != 0:
-            inp_img = np.concatenate ([ np.zeros ( (t_padding,w,c), dtype=np.float32 ), inp_img ], axis=0 )
+            if t_padding+b_padding+l_padding+r_padding != 0:
+                inp_img = np.pad (inp_img, ( (t_padding,b_padding), (l_padding,r_padding), (0,0) ) )
+            inp_img = np.ascontiguousarray(inp_img)
             h,w,c = inp_img.shape
 
-        if b_padding != 0:
-            inp_img = np.concatenate ([ inp_img, np.zeros ( (b_padding,w,c), dtype=np.float32 ) ], axis=0 )
-            h,w,c = inp_img.shape
+            ys, y_wins, xs, x_wins = self.get_tiling(h, w, patch_size, up_res)
 
-        if l_padding != 0:
-            inp_img = np.concatenate ([ np.zeros ( (h,l_padding,c), dtype=np.float32 ), inp_img ], axis=1 )
-            h,w,c = inp_img.shape
+            # view of all patch_size windows of the image, without copying
+            sh, sw, sc = inp_img.strides
+            windows = np.lib.stride_tricks.as_strided(inp_img, (h-patch_size+1, w-patch_size+1, patch_size, patch_size, c), (sh, sw, sh, sw, sc) )
+            patches.append( windows[ys[:,None], xs[None,:]].reshape( (-1, patch_size, patch_size, c) ) )
 
-        if r_padding != 0:
-            inp_img = np.concatenate ([ inp_img, np.zeros ( (h,r_padding,c), dtype=np.float32 ) ], axis=1 )
-            h,w,c = inp_img.shape
+            jobs.append ( (ih,iw,h,w,c, (t_padding,b_padding,l_padding,r_padding)) )
 
+        patches = np.concatenate(patches, 0)
+        bs = min(batch_size, len(patches))
+        params = [ np.full ( (bs,1), 0.2, np.float32 ), np.full ( (bs,1), 1.0, np.float32 ) ]
 
-        i_max = w-patch_size+1
-        j_max = h-patch_size+1
+        outs = np.empty ( (len(patches), out_patch_size, out_patch_size, 3), np.float32 )
+        for n in range(0, len(patches), bs):
+            batch = patches[n:n+bs]
+            outs[n:n+bs] = self.model.run( [ batch ] + [ param[:len(batch)] for param in params ] )
 
-        final_img = np.zeros ( (h*up_res,w*up_res,c), dtype=np.float32 )
-        final_img_div = np.zeros ( (h*up_res,w*up_res,1), dtype=np.float32 )
+        results = []
+        n = 0
+        for ih,iw,h,w,c, (t_padding,b_padding,l_padding,r_padding) in jobs:
+            ys, y_wins, xs, x_wins = self.get_tiling(h, w, patch_size, up_res)
 
-        x = np.concatenate ( [ np.linspace (0,1,patch_size_half*up_res), np.linspace (1,0,patch_size_half*up_res) ] )
-        x,y = np.meshgrid(x,x)
-        patch_mask = (x*y)[...,None]
+            # pixels and channels are merged into one axis, so numpy runs long inner loops
+            x = outs[n:n+len(ys)*len(xs)].reshape( (len(ys), len(xs), out_patch_size, out_patch_size*c) )
+            n += len(ys)*len(xs)
 
-        j=0
-        while j < j_max:
-            i = 0
-            while i < i_max:
-                patch_img = inp_img[j:j+patch_size, i:i+patch_size,:]
-                x = self.model.run( [ patch_img[None,...], [param], [param1] ] )[0]
-                final_img    [j*up_res:(j+patch_size)*up_res, i*up_res:(i+patch_size)*up_res,:] += x*patch_mask
-                final_img_div[j*up_res:(j+patch_size)*up_res, i*up_res:(i+patch_size)*up_res,:] += patch_mask
-                if i == i_max-1:
-                    break
-                i = min( i+patch_size_half, i_max-1)
-            if j == j_max-1:
-                break
-            j = min( j+patch_size_half, j_max-1)
+            # separable overlap-add, first along x for all rows of patches, then along y
+            x *= np.repeat(x_wins, c, axis=1)[None,:,None,:]
+            rows = np.zeros ( (len(ys), out_patch_size, w*up_res*c), np.float32 )
+            for i, pos in enumerate(xs):
+                rows[:,:,pos*up_res*c:(pos*up_res+out_patch_size)*c] += x[:,i]
+            rows *= y_wins[:,:,None]
 
-        final_img_div[final_img_div==0] = 1.0
-        final_img /= final_img_div
+            final_img = np.zeros ( (h*up_res, w*up_res*c), np.float32 )
+            for j, pos in enumerate(ys):
+                final_img[pos*up_res:pos*up_res+out_patch_size] += rows[j]
+            final_img = final_img.reshape( (h*up_res, w*up_res, c) )
 
-        if t_padding+b_padding+l_padding+r_padding != 0:
-            final_img = final_img [t_padding*up_res:(h-b_padding)*up_res, l_padding*up_res:(w-r_padding)*up_res,:]
+            if t_padding+b_padding+l_padding+r_padding != 0:
+                final_img = final_img [t_padding*up_res:(h-b_padding)*up_res, l_padding*up_res:(w-r_padding)*up_res,:]
 
-        if preserve_size:
-            final_img = cv2.resize (final_img, (iw,ih), interpolation=cv2.INTER_LANCZOS4)
+            if preserve_size:
+                final_img = cv2.resize (final_img, (iw,ih), interpolation=cv2.INTER_LANCZOS4)
 
-        if not is_tanh:
-            final_img = np.clip( final_img/2+0.5, 0, 1 )
+            if not is_tanh:
+                final_img = np.clip( final_img/2+0.5, 0, 1 )
 
-        return final_img
+            results.append(final_img)
+
+        return results
 
 
 """
@@ -1,5 +1,7 @@
+import collections
 import colorsys
 import math
+import threading
 from enum import IntEnum
 
 import cv2
@@ -385,11 +387,63 @@ def expand_eyebrows(lmrks, eyebrows_expand_mod=1.0):
 
     return lmrks
 
-def get_image_hull_mask (image_shape, image_landmarks, eyebrows_expand_mod=1.0 ):
-    hull_mask = np.zeros(image_shape[0:2]+(1,),dtype=np.float32)
+# per thread uint8 scratch buffers for mask rasterization, by (h,w)
+masks_scratch = threading.local()
 
-    lmrks = expand_eyebrows(image_landmarks, eyebrows_expand_mod)
+# memoized masks of static landmarks, key : (kind, h, w, eyebrows_expand_mod, landmarks bytes)
+masks_cache = collections.OrderedDict()
+masks_cache_lock = threading.Lock()
+masks_cache_max_size = 128*1024*1024
+masks_cache_size = 0
+
+def get_masks_scratch(h, w):
+    """
+    returns zeroed uint8 (h,w) buffer of the current thread
+    """
+    buffers = masks_scratch.__dict__.setdefault('buffers', {})
+    buf = buffers.get( (h,w), None)
+    if buf is None:
+        buf = buffers[(h,w)] = np.zeros( (h,w), np.uint8)
+    else:
+        buf.fill(0)
+    return buf
+
+def get_masks_nbytes(value):
+    return sum( x.nbytes for x in value if isinstance(x, np.ndarray) )
+
+def evict_memoized_masks():
+    global masks_cache_size
+    while masks_cache_size > masks_cache_max_size and len(masks_cache) > 1:
+        _, old_value = masks_cache.popitem(last=False)
+        masks_cache_size -= get_masks_nbytes(old_value)
 
+def set_masks_cache_max_size(max_size):
+    """
+    sets max size in bytes of memoized masks of the current process
+    """
+    global masks_cache_max_size
+    with masks_cache_lock:
+        masks_cache_max_size = max_size
+        evict_memoized_masks()
+
+def get_memoized_mask(key, rasterize_func):
+    global masks_cache_size
+    with masks_cache_lock:
+        value = masks_cache.get(key, None)
+        if value is not None:
+            masks_cache.move_to_end(key)
+            return value
+
+    value = rasterize_func()
+
+    with masks_cache_lock:
+        if key not in masks_cache:
+            masks_cache[key] = value
+            masks_cache_size += get_masks_nbytes(value)
+            evict_memoized_masks()
+    return value
+
+def get_hull_mask_parts(lmrks):
     r_jaw = (lmrks[0:9], lmrks[17:18])
     l_jaw = (lmrks[8:17], lmrks[26:27])
     r_cheek = (lmrks[17:20], lmrks[8:9])
@@ -398,59 +452,155 @@ def get_image_hull_mask (image_shape, image_landmarks, eyebrows_expand_mod=1.0 )
     r_eye = (lmrks[17:22], lmrks[27:28], lmrks[31:36], lmrks[8:9])
     l_eye = (lmrks[22:27], lmrks[27:28], lmrks[31:36], lmrks[8:9])
     nose = (lmrks[27:31], lmrks[31:36])
-    parts = [r_jaw, l_jaw, r_cheek, l_cheek, nose_ridge, r_eye, l_eye, nose]
+    return [ cv2.convexHull(np.concatenate(item)) for item in [r_jaw, l_jaw, r_cheek, l_cheek, nose_ridge, r_eye, l_eye, nose] ]
 
-    for item in parts:
-        merged = np.concatenate(item)
-        cv2.fillConvexPoly(hull_mask, cv2.convexHull(merged), (1,) )
+def get_blurred_mask_params(h):
+    """
+    returns dilate size, blur size and padding of box, beyond which dilated and blurred mask is zero
+    """
+    dilate = h // 32
+    blur = h // 16
+    blur = blur + (1-blur % 2)
+    return dilate, blur, dilate + blur + 1
 
-    return hull_mask
+def blur_mask(h, mask):
+    dilate, blur, _ = get_blurred_mask_params(h)
+    mask = cv2.dilate(mask, cv2.getStructuringElement(cv2.MORPH_ELLIPSE,(dilate,dilate)), iterations = 1 )
+    return cv2.GaussianBlur(mask.astype(np.float32), (blur, blur) , 0)
 
-def get_image_eye_mask (image_shape, image_landmarks):
-    if len(image_landmarks) != 68:
-        raise Exception('get_image_eye_mask works only with 68 landmarks')
+def rasterize_hull_mask (h, w, image_landmarks, eyebrows_expand_mod=1.0):
+    """
+    returns y, x and uint8 hull mask of the bounding box of the hull
+    """
+    lmrks = expand_eyebrows(image_landmarks, eyebrows_expand_mod).astype(np.int32)
 
-    h,w,c = image_shape
+    x0, y0 = np.maximum( lmrks.min(0), 0)
+    x1, y1 = np.minimum( lmrks.max(0) + 1, (w,h) )
+    if x1 <= x0 or y1 <= y0:
+        return 0, 0, np.zeros( (0,0), np.uint8)
 
-    hull_mask = np.zeros( (h,w,1),dtype=np.float32)
+    hull_mask = get_masks_scratch(h, w)[y0:y1,x0:x1]
+    for hull in get_hull_mask_parts(lmrks):
+        cv2.fillConvexPoly(hull_mask, hull - (x0,y0), (1,) )
 
-    image_landmarks = image_landmarks.astype(np.int)
+    return y0, x0, hull_mask.copy()
 
-    cv2.fillConvexPoly( hull_mask, cv2.convexHull( image_landmarks[36:42]), (1,) )
-    cv2.fillConvexPoly( hull_mask, cv2.convexHull( image_landmarks[42:48]), (1,) )
+def rasterize_blurred_mask (h, w, polys):
+    """
+    fills convex hulls of polys, dilates and blurs them only in their bounding box
 
-    dilate = h // 32
-    hull_mask = cv2.dilate(hull_mask, cv2.getStructuringElement(cv2.MORPH_ELLIPSE,(dilate,dilate)), iterations = 1 )
+    returns y, x and float32 blurred mask of the box
+    """
+    polys = [ cv2.convexHull(poly.astype(np.int32)) for poly in polys ]
+    pts = np.concatenate(polys)[:,0]
 
-    blur = h // 16
-    blur = blur + (1-blur % 2)
-    hull_mask = cv2.GaussianBlur(hull_mask, (blur, blur) , 0)
-    hull_mask = hull_mask[...,None]
+    pad = get_blurred_mask_params(h)[2]
+    x0, y0 = np.maximum( pts.min(0) - pad, 0)
+    x1, y1 = np.minimum( pts.max(0) + pad + 1, (w,h) )
+    if x1 <= x0 or y1 <= y0:
+        return 0, 0, np.zeros( (0,0), np.float32)
 
-    return hull_mask
+    mask = get_masks_scratch(h, w)[y0:y1,x0:x1]
+    for poly in polys:
+        cv2.fillConvexPoly( mask, poly - (x0,y0), (1,) )
+
+    return y0, x0, blur_mask(h, mask)
+
+def rasterize_face_masks (h, w, image_landmarks, eyebrows_expand_mod=1.0):
+    """
+    rasterizes hull, eye and mouth masks in one pass:
+    landmarks are converted once and all masks are drawn in one scratch buffer in one box, which bounds all of them
 
-def get_image_mouth_mask (image_shape, image_landmarks):
+    returns y, x, uint8 hull mask, float32 eye mask and float32 mouth mask of the box
+    """
     if len(image_landmarks) != 68:
-        raise Exception('get_image_eye_mask works only with 68 landmarks')
+        raise Exception('get_image_face_masks works only with 68 landmarks')
+
+    hull_lmrks = expand_eyebrows(image_landmarks, eyebrows_expand_mod).astype(np.int32)
+    lmrks = np.asarray(image_landmarks).astype(np.int32)
+
+    hulls = get_hull_mask_parts(hull_lmrks)
+    eye_polys = [ cv2.convexHull(lmrks[36:42]), cv2.convexHull(lmrks[42:48]) ]
+    mouth_polys = [ cv2.convexHull(lmrks[48:60]) ]
+
+    pad = get_blurred_mask_params(h)[2]
+    parts_pts = lmrks[36:60]
+    x0, y0 = np.maximum( np.minimum( hull_lmrks.min(0), parts_pts.min(0) - pad ), 0)
+    x1, y1 = np.minimum( np.maximum( hull_lmrks.max(0) + 1, parts_pts.max(0) + pad + 1 ), (w,h) )
+    if x1 <= x0 or y1 <= y0:
+        return 0, 0, np.zeros( (0,0), np.uint8), np.zeros( (0,0), np.float32), np.zeros( (0,0), np.float32)
+
+    mask = get_masks_scratch(h, w)[y0:y1,x0:x1]
+    for hull in hulls:
+        cv2.fillConvexPoly(mask, hull - (x0,y0), (1,) )
+    hull_mask = mask.copy()
+
+    result = [y0, x0, hull_mask]
+    for polys in [eye_polys, mouth_polys]:
+        mask.fill(0)
+        for poly in polys:
+            cv2.fillConvexPoly( mask, poly - (x0,y0), (1,) )
+        result.append ( blur_mask(h, mask) )
+    return tuple(result)
+
+def box_to_image_mask (h, w, box):
+    y, x, box_mask = box
+    mask = np.zeros( (h,w,1), dtype=np.float32)
+    bh, bw = box_mask.shape
+    mask[y:y+bh,x:x+bw,0] = box_mask
+    return mask
 
-    h,w,c = image_shape
+def get_image_hull_mask (image_shape, image_landmarks, eyebrows_expand_mod=1.0, memoize=False ):
+    """
+    memoize     cache rasterized mask by image size and landmarks, for landmarks which do not change, such as of samples
+    """
+    h, w = image_shape[0:2]
+    if memoize:
+        box = get_memoized_mask( ('hull', h, w, eyebrows_expand_mod, np.asarray(image_landmarks).tobytes()),
+                                 lambda: rasterize_hull_mask (h, w, image_landmarks, eyebrows_expand_mod) )
+    else:
+        box = rasterize_hull_mask (h, w, image_landmarks, eyebrows_expand_mod)
+    return box_to_image_mask(h, w, box)
 
-    hull_mask = np.zeros( (h,w,1),dtype=np.float32)
+def get_image_parts_mask (kind, image_shape, image_landmarks, memoize=False):
+    if len(image_landmarks) != 68:
+        raise Exception(f'get_image_{kind}_mask works only with 68 landmarks')
 
-    image_landmarks = image_landmarks.astype(np.int)
+    h, w = image_shape[0:2]
+    if kind == 'eye':
+        polys = [ image_landmarks[36:42], image_landmarks[42:48] ]
+    else:
+        polys = [ image_landmarks[48:60] ]
 
-    cv2.fillConvexPoly( hull_mask, cv2.convexHull( image_landmarks[48:60]), (1,) )
+    if memoize:
+        box = get_memoized_mask( (kind, h, w, None, np.asarray(image_landmarks).tobytes()),
+                                 lambda: rasterize_blurred_mask(h, w, polys) )
+    else:
+        box = rasterize_blurred_mask(h, w, polys)
+    return box_to_image_mask(h, w, box)
 
-    dilate = h // 32
-    hull_mask = cv2.dilate(hull_mask, cv2.getStructuringElement(cv2.MORPH_ELLIPSE,(dilate,dilate)), iterations = 1 )
+def get_image_eye_mask (image_shape, image_landmarks, memoize=False):
+    return get_image_parts_mask ('eye', image_shape, image_landmarks, memoize=memoize)
 
-    blur = h // 16
-    blur = blur + (1-blur % 2)
-    hull_mask = cv2.GaussianBlur(hull_mask, (blur, blur) , 0)
-    hull_mask = hull_mask[...,None]
+def get_image_mouth_mask (image_shape, image_landmarks, memoize=False):
+    return get_image_parts_mask ('mouth', image_shape, image_landmarks, memoize=memoize)
+
+def get_image_face_masks (image_shape, image_landmarks, eyebrows_expand_mod=1.0, memoize=False):
+    """
+    returns hull, eye and mouth masks, rasterized at once by rasterize_face_masks
+
+    memoize     cache rasterized masks by image size and landmarks, for landmarks which do not change, such as of samples
+    """
+    h, w = image_shape[0:2]
+    if memoize:
+        value = get_memoized_mask( ('face', h, w, eyebrows_expand_mod, np.asarray(image_landmarks).tobytes()),
+                                   lambda: rasterize_face_masks (h, w, image_landmarks, eyebrows_expand_mod) )
+    else:
+        value = rasterize_face_masks (h, w, image_landmarks, eyebrows_expand_mod)
+
+    y, x = value[0:2]
+    return tuple( box_to_image_mask(h, w, (y, x, box_mask)) for box_mask in value[2:] )
 
-    return hull_mask
-    
 def alpha_to_color (img_alpha, color):
     if len(img_alpha.shape) == 2:
         img_alpha = img_alpha[...,None]
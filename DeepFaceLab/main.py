@@ -69,7 +69,7 @@ if __name__ == "__main__":
     p.add_argument('--manual-fix', action="store_true", dest="manual_fix", default=False, help="Enables manual extract only frames where faces were not recognized.")
     p.add_argument('--manual-output-debug-fix', action="store_true", dest="manual_output_debug_fix", default=False, help="Performs manual reextract input-dir frames which were deleted from [output_dir]_debug\ dir.")
     p.add_argument('--manual-window-size', type=int, dest="manual_window_size", default=1368, help="Manual fix window size. Default: 1368.")
-    p.add_argument('--cpu-only', action="store_true", dest="cpu_only", default=False, help="Extract on CPU..")
+    p.add_argument('--cpu-only', nargs='?', const='default', choices=list(nn.cpu_profiles.keys()), dest="cpu_only", default=False, help="Extract on CPU. Optional CPU profile: %(choices)s.")
     p.add_argument('--force-gpu-idxs', dest="force_gpu_idxs", default=None, help="Force to choose GPU indexes separated by comma.")
 
     p.set_defaults (func=process_extract)
@@ -171,7 +171,7 @@ if __name__ == "__main__":
     p.add_argument('--saving-time', type=int, dest="saving_time", default=25, help="Model saving interval.")
     p.add_argument('--no-preview', action="store_true", dest="no_preview", default=False, help="Disable preview window.")
     p.add_argument('--force-model-name', dest="force_model_name", default=None, help="Forcing to choose model name from model/ folder.")
-    p.add_argument('--cpu-only', action="store_true", dest="cpu_only", default=False, help="Train on CPU.")
+    p.add_argument('--cpu-only', nargs='?', const='default', choices=list(nn.cpu_profiles.keys()), dest="cpu_only", default=False, help="Train on CPU. Optional CPU profile: %(choices)s.")
     p.add_argument('--force-gpu-idxs', dest="force_gpu_idxs", default=None, help="Force to choose GPU indexes separated by comma.")
     p.add_argument('--silent-start', action="store_true", dest="silent_start", default=False, help="Silent start. Automatically chooses Best GPU and last used model.")
     p.add_argument('--tensorboard-logdir', action=fixPathAction, dest="tensorboard_dir", help="Directory of the tensorboard output files")
@@ -190,11 +190,20 @@ if __name__ == "__main__":
     def process_exportdfm(arguments):
         osex.set_process_lowest_prio()
         from mainscripts import ExportDFM
-        ExportDFM.main(model_class_name = arguments.model_name, saved_models_path = Path(arguments.model_dir))
+        ExportDFM.main(model_class_name = arguments.model_name,
+                       saved_models_path = Path(arguments.model_dir),
+                       quantize = arguments.quantize,
+                       aligned_path = Path(arguments.aligned_dir) if arguments.aligned_dir is not None else None,
+                       samples_count = arguments.samples,
+                       min_psnr = arguments.min_psnr)
 
     p = subparsers.add_parser( "exportdfm", help="Export model to use in DeepFaceLive.")
     p.add_argument('--model-dir', required=True, action=fixPathAction, dest="model_dir", help="Saved models dir.")
     p.add_argument('--model', required=True, dest="model_name", choices=pathex.get_all_dir_names_startswith ( Path(__file__).parent / 'models' , 'Model_'), help="Model class name.")
+    p.add_argument('--quantize', action="store_true", dest="quantize", default=False, help="Also write fp16, int8 dynamic and int8 calibrated variants of the .dfm with a report of their quality against fp32 and latency on this CPU. Requires onnx, onnxconverter-common and onnxruntime packages.")
+    p.add_argument('--aligned-dir', action=fixPathAction, dest="aligned_dir", default=None, help="Aligned dst faces, which are used for calibration and evaluation of --quantize.")
+    p.add_argument('--samples', type=int, dest="samples", default=64, help="Number of faces used for calibration and for evaluation.")
+    p.add_argument('--min-psnr', type=float, dest="min_psnr", default=30.0, help="PSNR against fp32 output, which is required for the variant to be reported as the fastest.")
     p.set_defaults (func=process_exportdfm)
 
     def process_ampconverter(arguments):
@@ -209,7 +218,7 @@ if __name__ == "__main__":
         osex.set_process_lowest_prio()
         from mainscripts import Merger
         Merger.main ( model_class_name       = arguments.model_name,
-                      saved_models_path      = Path(arguments.model_dir),
+                      saved_models_path      = Path(arguments.model_dir) if arguments.model_dir is not None else None,
                       force_model_name       = arguments.force_model_name,
                       input_path             = Path(arguments.input_dir),
                       output_path            = Path(arguments.output_dir),
@@ -217,7 +226,15 @@ if __name__ == "__main__":
                       aligned_path           = Path(arguments.aligned_dir) if arguments.aligned_dir is not None else None,
                       pak_name               = arguments.pak_name,
                       force_gpu_idxs         = arguments.force_gpu_idxs,
-                      cpu_only               = arguments.cpu_only)
+                      cpu_only               = arguments.cpu_only,
+                      output_video_path      = Path(arguments.output_video) if arguments.output_video is not None else None,
+                      output_mask_video_path = Path(arguments.output_mask_video) if arguments.output_mask_video is not None else None,
+                      reference_file         = arguments.reference_file,
+                      dfm_path               = Path(arguments.dfm) if arguments.dfm is not None else None,
+                      dfm_threads_count      = arguments.dfm_threads,
+                      dfm_optimization_cache = arguments.dfm_cache,
+                      ensemble_dfm_paths     = [ Path(x) for x in arguments.ensemble_dfm ],
+                      force                  = arguments.force)
 
     p = subparsers.add_parser( "merge", help="Merger")
     p.add_argument('--input-dir', required=True, action=fixPathAction, dest="input_dir", help="Input directory. A directory containing the files you wish to process.")
@@ -225,12 +242,20 @@ if __name__ == "__main__":
     p.add_argument('--output-mask-dir', required=True, action=fixPathAction, dest="output_mask_dir", help="Output mask directory. This is where the mask files will be stored.")
     p.add_argument('--aligned-dir', action=fixPathAction, dest="aligned_dir", default=None, help="Aligned directory. This is where the extracted of dst faces stored.")
     p.add_argument('--pak-name', required=False, dest='pak_name', type=str, default=None, help='Name of the faceset pack to use')
-    p.add_argument('--model-dir', required=True, action=fixPathAction, dest="model_dir", help="Model dir.")
-    p.add_argument('--model', required=True, dest="model_name", choices=pathex.get_all_dir_names_startswith ( Path(__file__).parent / 'models' , 'Model_'), help="Model class name.")
+    p.add_argument('--model-dir', action=fixPathAction, dest="model_dir", default=None, help="Model dir. Required, if --dfm is not specified.")
+    p.add_argument('--model', dest="model_name", default=None, choices=pathex.get_all_dir_names_startswith ( Path(__file__).parent / 'models' , 'Model_'), help="Model class name. Required, if --dfm is not specified.")
     p.add_argument('--force-model-name', dest="force_model_name", default=None, help="Forcing to choose model name from model/ folder.")
-    p.add_argument('--cpu-only', action="store_true", dest="cpu_only", default=False, help="Merge on CPU.")
+    p.add_argument('--cpu-only', nargs='?', const='default', choices=list(nn.cpu_profiles.keys()), dest="cpu_only", default=False, help="Merge on CPU. Optional CPU profile: %(choices)s, 'shared' leaves cores for merging threads.")
     p.add_argument('--force-gpu-idxs', dest="force_gpu_idxs", default=None, help="Force to choose GPU indexes separated by comma.")
     p.add_argument('--reduce-clutter', action="store_true", dest="reduce_clutter", default=False, help='Remove options that are not used from printed summary')
+    p.add_argument('--output-video', action=fixPathAction, dest="output_video", default=None, help="Encode merged frames straight to this video file instead of output dir.")
+    p.add_argument('--output-mask-video', action=fixPathAction, dest="output_mask_video", default=None, help="Encode merged masks to this video file, used with --output-video.")
+    p.add_argument('--reference-file', action=fixPathAction, dest="reference_file", default=None, help="Reference file used to determine proper FPS and transfer audio from it, used with --output-video.")
+    p.add_argument('--dfm', action=fixPathAction, dest="dfm", default=None, help="Predict faces with exported .dfm in ONNX Runtime instead of the model. XSeg is taken from --model-dir or from the .dfm dir. Requires onnxruntime (or onnxruntime-gpu) package.")
+    p.add_argument('--dfm-threads', type=int, dest="dfm_threads", default=None, help="CPU threads of ONNX Runtime session, all cores by default.")
+    p.add_argument('--dfm-cache', action="store_true", dest="dfm_cache", default=False, help="Save graph optimized by ONNX Runtime next to the .dfm and reuse it on next runs.")
+    p.add_argument('--force', action="store_true", dest="force", default=False, help="Merge all frames, even those, which are unchanged since the last non-interactive merge.")
+    p.add_argument('--ensemble-dfm', action="append", dest="ensemble_dfm", default=[], help="Merge also with this .dfm in the same pass over the frames, can be repeated. Every model is merged with own settings to subdirectory of output dirs named by the model.")
     p.set_defaults(func=process_merge)
 
     videoed_parser = subparsers.add_parser( "videoed", help="Video processing.").add_subparsers()
@@ -265,10 +290,11 @@ if __name__ == "__main__":
     def process_videoed_denoise_image_sequence(arguments):
         osex.set_process_lowest_prio()
         from mainscripts import VideoEd
-        VideoEd.denoise_image_sequence (arguments.input_dir, arguments.factor)
+        VideoEd.denoise_image_sequence (arguments.input_dir, factor=arguments.factor, method=arguments.method)
     p = videoed_parser.add_parser( "denoise-image-sequence", help="Denoise sequence of images, keeping sharp edges. Helps to remove pixel shake from the predicted face.")
     p.add_argument('--input-dir', required=True, action=fixPathAction, dest="input_dir", help="Input directory to be processed.")
     p.add_argument('--factor', type=int, dest="factor", default=None, help="Denoise factor (1-20).")
+    p.add_argument('--method', dest="method", choices=['ffmpeg','nlmeans'], default=None, help="ffmpeg - hqdn3d filter, nlmeans - temporal non-local means over 5 frames on all CPU cores.")
     p.set_defaults(func=process_videoed_denoise_image_sequence)
 
     def process_videoed_video_from_sequence(arguments):
@@ -307,7 +333,7 @@ if __name__ == "__main__":
 
     p = facesettool_parser.add_parser ("enhance", help="Enhance details in DFL faceset.")
     p.add_argument('--input-dir', required=True, action=fixPathAction, dest="input_dir", help="Input directory of aligned faces.")
-    p.add_argument('--cpu-only', action="store_true", dest="cpu_only", default=False, help="Process on CPU.")
+    p.add_argument('--cpu-only', nargs='?', const='default', choices=list(nn.cpu_profiles.keys()), dest="cpu_only", default=False, help="Process on CPU. Optional CPU profile: %(choices)s.")
     p.add_argument('--force-gpu-idxs', dest="force_gpu_idxs", default=None, help="Force to choose GPU indexes separated by comma.")
 
     p.set_defaults(func=process_faceset_enhancer)
@@ -315,13 +341,31 @@ if __name__ == "__main__":
     
     p = facesettool_parser.add_parser ("resize", help="Resize DFL faceset.")
     p.add_argument('--input-dir', required=True, action=fixPathAction, dest="input_dir", help="Input directory of aligned faces.")
+    p.add_argument('--workers', type=int, dest="workers_count", default=None, help="Number of worker processes. Default is min(8, CPU count).")
+    p.add_argument('--chunk-size', type=int, dest="chunk_size", default=None, help="Number of faces sent to a worker at once.")
 
     def process_faceset_resizer(arguments):
         osex.set_process_lowest_prio()
         from mainscripts import FacesetResizer
-        FacesetResizer.process_folder ( Path(arguments.input_dir) )
+        FacesetResizer.process_folder ( Path(arguments.input_dir), workers_count=arguments.workers_count, chunk_size=arguments.chunk_size )
     p.set_defaults(func=process_faceset_resizer)
     
+    def process_benchmark(arguments):
+        from mainscripts import Benchmark
+        Benchmark.main ( cpu_profiles   = arguments.cpu_profiles,
+                         sessions_count = arguments.sessions_count,
+                         resolution     = arguments.resolution,
+                         batch_size     = arguments.batch_size,
+                         iterations     = arguments.iterations )
+
+    p = subparsers.add_parser( "benchmark", help="Measure training and merging speed of CPU profiles on this machine.")
+    p.add_argument('--cpu-profiles', nargs='+', choices=list(nn.cpu_profiles.keys()), dest="cpu_profiles", default=None, help="CPU profiles to measure. Default is all.")
+    p.add_argument('--sessions', type=int, dest="sessions_count", default=1, help="How many sessions share the host, like CPU extractor workers.")
+    p.add_argument('--resolution', type=int, dest="resolution", default=96, help="Face resolution.")
+    p.add_argument('--batch-size', type=int, dest="batch_size", default=8, help="Batch size.")
+    p.add_argument('--iterations', type=int, dest="iterations", default=20, help="Measured iterations.")
+    p.set_defaults (func=process_benchmark)
+
     def process_dev_test(arguments):
         osex.set_process_lowest_prio()
         from mainscripts import dev_misc
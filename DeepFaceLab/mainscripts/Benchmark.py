@@ -0,0 +1,136 @@
+import multiprocessing
+import queue
+import time
+import traceback
+
+import numpy as np
+
+from core.interact import interact as io
+from core.leras import nn
+
+
+def benchmark_proc(result_queue, start_event, cpu_profile, sessions_count, session_idx, resolution, batch_size, iterations):
+    """
+    runs Quick96 sized training step and merge prediction on random data in own CPU session
+    """
+    try:
+        nn.initialize( nn.DeviceConfig.CPU(cpu_profile, sessions_count, session_idx), data_format="NHWC" )
+        tf = nn.tf
+
+        bgr_shape = nn.get4Dshape(resolution,resolution,3)
+        mask_shape = nn.get4Dshape(resolution,resolution,1)
+        warped_t = tf.placeholder (nn.floatx, bgr_shape)
+        target_t = tf.placeholder (nn.floatx, bgr_shape)
+        targetm_t = tf.placeholder (nn.floatx, mask_shape)
+
+        model_archi = nn.DeepFakeArchi(resolution, opts='ud')
+        encoder = model_archi.Encoder(in_ch=3, e_ch=64, name='encoder')
+        inter = model_archi.Inter (in_ch=encoder.get_out_ch()*encoder.get_out_res(resolution)**2, ae_ch=128, ae_out_ch=128, name='inter')
+        decoder = model_archi.Decoder(in_ch=inter.get_out_ch(), d_ch=64, d_mask_ch=16, name='decoder')
+        weights = encoder.get_weights() + inter.get_weights() + decoder.get_weights()
+
+        opt = nn.RMSprop(lr=2e-4, name='opt')
+        opt.initialize_variables(weights)
+
+        pred_t, predm_t = decoder(inter(encoder(warped_t)))
+        loss_t = tf.reduce_mean ( 10*nn.dssim(target_t*targetm_t, pred_t*targetm_t, max_val=1.0, filter_size=int(resolution/11.6)), axis=[1])
+        loss_t += tf.reduce_mean ( 10*tf.square(target_t*targetm_t - pred_t*targetm_t), axis=[1,2,3])
+        loss_t += tf.reduce_mean ( 10*tf.square(targetm_t - predm_t), axis=[1,2,3])
+        train_op = opt.get_update_op ( nn.gradients(loss_t, weights) )
+
+        for model in [encoder, inter, decoder, opt]:
+            model.init_weights()
+
+        rnd = np.random.RandomState(session_idx)
+        feed_dict = { warped_t  : rnd.rand(batch_size, *bgr_shape[1:]).astype(np.float32),
+                      target_t  : rnd.rand(batch_size, *bgr_shape[1:]).astype(np.float32),
+                      targetm_t : (rnd.rand(batch_size, *mask_shape[1:]) > 0.5).astype(np.float32) }
+
+        # warm up, graph optimizations and XLA compilation are not measured
+        for _ in range(2):
+            nn.tf_sess.run ([loss_t, train_op], feed_dict=feed_dict)
+            nn.tf_sess.run ([pred_t, predm_t], feed_dict={warped_t : feed_dict[warped_t]})
+
+        # sessions sharing the host are measured at the same time
+        result_queue.put ( ('ready', None) )
+        start_event.wait()
+
+        t = time.time()
+        for _ in range(iterations):
+            nn.tf_sess.run ([loss_t, train_op], feed_dict=feed_dict)
+        train_time = time.time() - t
+
+        t = time.time()
+        for _ in range(iterations):
+            nn.tf_sess.run ([pred_t, predm_t], feed_dict={warped_t : feed_dict[warped_t]})
+        predict_time = time.time() - t
+
+        result_queue.put ( ('result', (iterations/train_time, iterations*batch_size/predict_time) ) )
+    except:
+        result_queue.put ( ('error', traceback.format_exc()) )
+
+
+def main(cpu_profiles=None, sessions_count=1, resolution=96, batch_size=8, iterations=20):
+    """
+    reports training iterations/s and predicted faces/s of every CPU profile,
+    when sessions_count sessions share the host
+    """
+    if cpu_profiles is None:
+        cpu_profiles = list(nn.cpu_profiles.keys())
+    sessions_count = max(1, sessions_count)
+
+    io.log_info (f"CPU cores: {multiprocessing.cpu_count()}, sessions: {sessions_count}, resolution: {resolution}, batch size: {batch_size}, iterations: {iterations}\n")
+
+    results = {}
+    for cpu_profile in cpu_profiles:
+        io.log_info (f"Running '{cpu_profile}' profile...")
+
+        # every profile runs in fresh processes, because session config and env are applied once per process
+        result_queue = multiprocessing.Queue()
+        start_event = multiprocessing.Event()
+        procs = [ multiprocessing.Process(target=benchmark_proc, args=(result_queue, start_event, cpu_profile, sessions_count, i, resolution, batch_size, iterations), daemon=True)
+                  for i in range(sessions_count) ]
+        for proc in procs:
+            proc.start()
+
+        session_results = []
+        ready_count = 0
+        err = None
+        while len(session_results) < sessions_count and err is None:
+            try:
+                op, data = result_queue.get(timeout=1.0)
+            except queue.Empty:
+                # session died without reporting, e.g. crashed in native code or killed by out of memory
+                dead_procs = [ proc for proc in procs if not proc.is_alive() ]
+                failed_procs = [ proc for proc in dead_procs if proc.exitcode != 0 ]
+                if len(failed_procs) != 0:
+                    err = f"session exited with code {failed_procs[0].exitcode}"
+                elif len(dead_procs) == len(procs):
+                    err = "sessions exited without result"
+                continue
+
+            if op == 'ready':
+                ready_count += 1
+                if ready_count == sessions_count:
+                    start_event.set()
+            elif op == 'error':
+                err = data
+            elif op == 'result':
+                session_results.append(data)
+
+        for proc in procs:
+            if err is not None:
+                proc.terminate()
+            proc.join()
+
+        if err is not None:
+            io.log_err (f"'{cpu_profile}' profile failed: {err}")
+            continue
+
+        train_its, predict_fps = [ np.array(x) for x in zip(*session_results) ]
+        results[cpu_profile] = (train_its.sum(), predict_fps.sum())
+        io.log_info (f"{cpu_profile:>10}: train {train_its.sum():.2f} it/s ({train_its.mean():.2f} per session), predict {predict_fps.sum():.2f} faces/s ({predict_fps.mean():.2f} per session)")
+
+    if len(results) != 0:
+        io.log_info ("")
+        io.log_info (f"Best for training: '{max(results, key=lambda x: results[x][0])}', best for merging: '{max(results, key=lambda x: results[x][1])}'")
@@ -11,12 +11,177 @@ from core import pathex
 from core import imagelib
 import cv2
 import models
+from core.cv2ex import *
 from core.interact import interact as io
+from DFLIMG import DFLIMG
+from facelib import LandmarksProcessor
 
 
-def main(model_class_name, saved_models_path):
+def main(model_class_name, saved_models_path, quantize=False, aligned_path=None, samples_count=64, min_psnr=30.0):
     model = models.import_model(model_class_name)(
                         is_exporting=True,
                         saved_models_path=saved_models_path,
                         cpu_only=True)
-    model.export_dfm () 
+    model.export_dfm ()
+
+    if quantize:
+        dfm_path = Path(model.get_strpath_storage_for_file('model.dfm'))
+        model.finalize()
+        export_quantized (dfm_path, aligned_path, samples_count=samples_count, min_psnr=min_psnr)
+
+
+class CalibrationDataReader():
+    """
+    feeds calibration faces to onnxruntime.quantization.quantize_static
+    """
+    def __init__(self, feeds):
+        self.feeds = iter(feeds)
+
+    def get_next(self):
+        return next(self.feeds, None)
+
+
+def load_faces(aligned_path, face_type, resolution, count):
+    """
+    returns random aligned faces warped to face type and resolution of the model, as merger does
+    """
+    filepaths = pathex.get_image_paths(aligned_path)
+    np.random.shuffle(filepaths)
+
+    faces = []
+    for filepath in filepaths:
+        dflimg = DFLIMG.load (Path(filepath))
+        if dflimg is None or not dflimg.has_data():
+            continue
+        img = imagelib.normalize_channels( cv2_imread(filepath), 3)
+        mat = LandmarksProcessor.get_transform_mat (dflimg.get_landmarks(), resolution, face_type=face_type)
+        faces.append ( np.clip( cv2.warpAffine(img, mat, (resolution, resolution), flags=cv2.INTER_CUBIC).astype(np.float32) / 255.0, 0, 1) )
+        if len(faces) == count:
+            break
+    return faces
+
+
+def psnr(a, b):
+    mse = np.mean( np.square(a-b) )
+    return 100.0 if mse == 0 else 10*np.log10(1.0 / mse)
+
+
+def ssim(a, b):
+    """
+    mean SSIM of float images in 0..1 range, gaussian window 11, sigma 1.5
+    """
+    c1, c2 = 0.01**2, 0.03**2
+    blur = lambda x: cv2.GaussianBlur(x, (11,11), 1.5)
+    mu_a, mu_b = blur(a), blur(b)
+    var_a = blur(a*a) - mu_a*mu_a
+    var_b = blur(b*b) - mu_b*mu_b
+    cov = blur(a*b) - mu_a*mu_b
+    return np.mean( ((2*mu_a*mu_b + c1)*(2*cov + c2)) / ((mu_a*mu_a + mu_b*mu_b + c1)*(var_a + var_b + c2)) )
+
+
+def export_quantized(dfm_path, aligned_path, samples_count=64, min_psnr=30.0):
+    """
+    writes fp16, int8 dynamic and int8 static variants of the .dfm next to it,
+    int8 static is calibrated on faces of aligned_path.
+
+    Report of face PSNR/SSIM and mask PSNR against fp32 .dfm on other faces of aligned_path
+    and latency of single face on the local CPU is written to <dfm>_quantization_report.txt
+    """
+    try:
+        import onnx
+        from onnxconverter_common import float16
+        from onnxruntime.quantization import QuantFormat, QuantType, quantize_dynamic, quantize_static
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+    except ImportError as e:
+        io.log_err(f'Unable to quantize {dfm_path.name}: {e}. onnx, onnxconverter-common and onnxruntime packages are required.')
+        return
+    from merger import DFMPredictor
+
+    if aligned_path is None or not aligned_path.exists():
+        io.log_err('Aligned directory of dst faces is required for calibration.')
+        return
+
+    predictor = DFMPredictor(dfm_path, cpu_only=True)
+    face_type, resolution, is_morphable = predictor.face_type, predictor.resolution, predictor.is_morphable
+
+    faces = load_faces(aligned_path, face_type, resolution, samples_count*2)
+    if len(faces) == 0:
+        io.log_err(f'No faces found in {aligned_path}.')
+        return
+    # faces are evaluated on other ones than calibrated on, if there are enough of them
+    calib_faces = faces[:samples_count]
+    eval_faces = faces[samples_count:] if len(faces) > samples_count else calib_faces
+
+    def get_feed(face):
+        feed = {'in_face:0' : face[None,...]}
+        if is_morphable:
+            feed['morph_value:0'] = np.float32([1.0])
+        return feed
+
+    variant_paths = { name : dfm_path.parent / f'{dfm_path.stem}_{name}.dfm' for name in ['fp16', 'int8_dynamic', 'int8'] }
+    preprocessed_path = dfm_path.parent / f'{dfm_path.stem}_preprocessed.onnx'
+
+    io.log_info ('Simplifying graph before quantization.')
+    # shape inference and graph optimizations, which are recommended before quantization
+    quant_pre_process (str(dfm_path), str(preprocessed_path), skip_symbolic_shape=True)
+
+    try:
+        io.log_info (f"Writing {variant_paths['fp16'].name}")
+        model_proto = float16.convert_float_to_float16 (onnx.load(str(dfm_path)), keep_io_types=True)
+        onnx.save(model_proto, str(variant_paths['fp16']))
+
+        io.log_info (f"Writing {variant_paths['int8_dynamic'].name}")
+        quantize_dynamic (str(preprocessed_path), str(variant_paths['int8_dynamic']), weight_type=QuantType.QUInt8)
+
+        io.log_info (f"Writing {variant_paths['int8'].name}, calibrating on {len(calib_faces)} faces")
+        quantize_static (str(preprocessed_path), str(variant_paths['int8']), CalibrationDataReader( [get_feed(face) for face in calib_faces] ),
+                         quant_format=QuantFormat.QDQ, activation_type=QuantType.QInt8, weight_type=QuantType.QInt8)
+    finally:
+        preprocessed_path.unlink()
+
+    # quantizers do not keep metadata of the model, face type and iteration are used by the merger
+    metadata_props = onnx.load(str(dfm_path), load_external_data=False).metadata_props
+    for name in ['int8_dynamic', 'int8']:
+        model_proto = onnx.load(str(variant_paths[name]))
+        del model_proto.metadata_props[:]
+        model_proto.metadata_props.extend(metadata_props)
+        onnx.save(model_proto, str(variant_paths[name]))
+
+    io.log_info (f'Evaluating on {len(eval_faces)} faces.')
+    reference = [ predictor.predictor_func(face) for face in eval_faces ]
+
+    results = {}
+    for name, path in [('fp32', dfm_path)] + list(variant_paths.items()):
+        variant_predictor = predictor if name == 'fp32' else DFMPredictor(path, cpu_only=True)
+        # warm up
+        variant_predictor.predictor_func(eval_faces[0])
+
+        face_psnr, face_ssim, mask_psnr, times = [], [], [], []
+        for face, (ref_bgr, ref_src_mask, _) in zip(eval_faces, reference):
+            t = time.time()
+            bgr, src_mask, _ = variant_predictor.predictor_func(face)
+            times.append(time.time() - t)
+
+            face_psnr.append ( psnr(ref_bgr, bgr) )
+            face_ssim.append ( ssim(ref_bgr, bgr) )
+            mask_psnr.append ( psnr(ref_src_mask, src_mask) )
+        results[name] = (np.mean(face_psnr), np.mean(face_ssim), np.mean(mask_psnr), np.median(times)*1000, path.stat().st_size / 1024**2)
+
+    lines = [f'{dfm_path.name}, face type: {face_type.name}, resolution: {resolution}, evaluated on {len(eval_faces)} faces of {aligned_path}',
+             f'PSNR and SSIM are against fp32 output, latency is median of single face on the local CPU',
+             '',
+             f"{'variant':>12} {'face PSNR':>10} {'face SSIM':>10} {'mask PSNR':>10} {'latency ms':>11} {'size MB':>8}" ]
+    for name, (face_psnr, face_ssim, mask_psnr, latency, size) in results.items():
+        lines.append (f"{name:>12} {face_psnr:>10.2f} {face_ssim:>10.4f} {mask_psnr:>10.2f} {latency:>11.2f} {size:>8.1f}")
+
+    passed = [ name for name in results if results[name][0] >= min_psnr and results[name][2] >= min_psnr ]
+    lines.append ('')
+    lines.append (f"Fastest with face and mask PSNR >= {min_psnr}: {min(passed, key=lambda name: results[name][3])}")
+
+    report_path = dfm_path.parent / f'{dfm_path.stem}_quantization_report.txt'
+    report_path.write_text ('\n'.join(lines) + '\n', encoding='utf-8')
+
+    io.log_info ('')
+    for line in lines:
+        io.log_info (line)
+    io.log_info (f'\nReport is written to {report_path}')
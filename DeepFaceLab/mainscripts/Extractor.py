@@ -127,7 +127,7 @@ class ExtractSubprocessor(Subprocessor):
                 sys.stdin = os.fdopen(stdin_fd)
 
             if self.cpu_only:
-                device_config = nn.DeviceConfig.CPU()
+                device_config = nn.DeviceConfig.CPU(client_dict['cpu_profile'], client_dict['cpu_sessions_count'], self.device_idx)
                 place_model_on_cpu = True
             else:
                 device_config = nn.DeviceConfig.GPUIndexes ([self.device_idx])
@@ -475,6 +475,7 @@ class ExtractSubprocessor(Subprocessor):
         self.result = []
 
         self.devices = ExtractSubprocessor.get_devices_for_config(self.type, device_config)
+        self.cpu_profile = device_config.cpu_profile
         self.cli = ExtractSubprocessor.Cli
 
         super().__init__('Extractor', self.cli,
@@ -526,6 +527,8 @@ class ExtractSubprocessor(Subprocessor):
                      'video_path': self.video_path,
                      'fps':self.fps,
                      'chunk_size':self.chunk_size,
+                     'cpu_profile':self.cpu_profile,
+                     'cpu_sessions_count':len(self.devices),
                      'stdin_fd': sys.stdin.fileno() }
 
 
@@ -931,7 +934,7 @@ def main(detector=None,
                         Path(filename).unlink()
 
     device_config = nn.DeviceConfig.GPUIndexes( force_gpu_idxs or nn.ask_choose_device_idxs(choose_only_one=detector=='manual', suggest_all_gpu=True) ) \
-                    if not cpu_only else nn.DeviceConfig.CPU()
+                    if not cpu_only else nn.DeviceConfig.CPU(cpu_only)
 
     if face_type is None:
         face_type = io.input_str ("Face type", 'wf', ['f','wf','head'], help_message="Full face / whole face / head. 'Whole face' covers full area of face include forehead. 'head' covers full head, but requires XSeg for src and dst faceset.").lower()
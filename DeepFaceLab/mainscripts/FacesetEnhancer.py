@@ -3,7 +3,7 @@ import shutil
 
 from DFLIMG import *
 from core.interact import interact as io
-from core.joblib import Subprocessor
+from core.joblib import Subprocessor, ThreadPoolMap
 from core.leras import nn
 from core import pathex
 from core.cv2ex import *
@@ -13,14 +13,23 @@ from samplelib import PackedFaceset
 class FacesetEnhancerSubprocessor(Subprocessor):
 
     #override
-    def __init__(self, image_paths, output_dirpath, device_config):
+    def __init__(self, image_paths, output_dirpath, device_config, batch_size=8, batches_per_chunk=4):
+        """
+        batch_size          number of faces, which patches are enhanced together in batched forward passes
+
+        batches_per_chunk   number of batches given to every device at once, files of the next batch are read
+                            and files of the previous batch are written, while the current batch is enhanced
+        """
         self.image_paths = image_paths
         self.output_dirpath = output_dirpath
+        self.batch_size = batch_size
+        self.chunk_size = batch_size*batches_per_chunk
         self.result = []
         self.nn_initialize_mp_lock = multiprocessing.Lock()
         self.devices = FacesetEnhancerSubprocessor.get_devices_for_config(device_config)
+        self.cpu_profile = device_config.cpu_profile
 
-        super().__init__('FacesetEnhancer', FacesetEnhancerSubprocessor.Cli, 600)
+        super().__init__('FacesetEnhancer', FacesetEnhancerSubprocessor.Cli, 600, items_in_flight=2)
 
     #override
     def on_clients_initialized(self):
@@ -33,7 +42,10 @@ class FacesetEnhancerSubprocessor(Subprocessor):
     #override
     def process_info_generator(self):
         base_dict = {'output_dirpath':self.output_dirpath,
-                     'nn_initialize_mp_lock': self.nn_initialize_mp_lock,}
+                     'batch_size':self.batch_size,
+                     'nn_initialize_mp_lock': self.nn_initialize_mp_lock,
+                     'cpu_profile':self.cpu_profile,
+                     'cpu_sessions_count':len(self.devices),}
 
         for (device_idx, device_type, device_name, device_total_vram_gb) in self.devices:
             client_dict = base_dict.copy()
@@ -45,17 +57,17 @@ class FacesetEnhancerSubprocessor(Subprocessor):
     #override
     def get_data(self, host_dict):
         if len (self.image_paths) > 0:
-            return self.image_paths.pop(0)
+            data, self.image_paths = self.image_paths[:self.chunk_size], self.image_paths[self.chunk_size:]
+            return data
 
     #override
     def on_data_return (self, host_dict, data):
-        self.image_paths.insert(0, data)
+        self.image_paths = data + self.image_paths
 
     #override
     def on_result (self, host_dict, data, result):
-        io.progress_bar_inc(1)
-        if result[0] == 1:
-            self.result +=[ (result[1], result[2]) ]
+        io.progress_bar_inc(len(data))
+        self.result += [ (filepath, output_filepath) for ret, filepath, output_filepath in result if ret == 1 ]
 
     #override
     def get_result(self):
@@ -69,7 +81,8 @@ class FacesetEnhancerSubprocessor(Subprocessor):
         if not cpu_only:
             return [ (device.index, 'GPU', device.name, device.total_mem_gb) for device in devices ]
         else:
-            return [ (i, 'CPU', 'CPU%d' % (i), 0 ) for i in range( min(8, multiprocessing.cpu_count() // 2) ) ]
+            # single model on CPU, its ops use all cores via intra-op threads of the session
+            return [ (0, 'CPU', 'CPU', 0 ) ]
 
     class Cli(Subprocessor.Cli):
 
@@ -78,10 +91,11 @@ class FacesetEnhancerSubprocessor(Subprocessor):
             device_idx   = client_dict['device_idx']
             cpu_only     = client_dict['device_type'] == 'CPU'
             self.output_dirpath = client_dict['output_dirpath']
+            self.batch_size = client_dict['batch_size']
             nn_initialize_mp_lock = client_dict['nn_initialize_mp_lock']
 
             if cpu_only:
-                device_config = nn.DeviceConfig.CPU()
+                device_config = nn.DeviceConfig.CPU(client_dict['cpu_profile'], client_dict['cpu_sessions_count'], device_idx)
                 device_vram = 99
             else:
                 device_config = nn.DeviceConfig.GPUIndexes ([device_idx])
@@ -96,32 +110,66 @@ class FacesetEnhancerSubprocessor(Subprocessor):
             from facelib import FaceEnhancer
             self.fe = FaceEnhancer( place_model_on_cpu=(device_vram<=2 or cpu_only), run_on_cpu=cpu_only )
 
-        #override
-        def process_data(self, filepath):
-            try:
-                dflimg = DFLIMG.load (filepath)
-                if dflimg is None or not dflimg.has_data():
-                    self.log_err (f"{filepath.name} is not a dfl image file")
-                else:
-                    dfl_dict = dflimg.get_dict()
-
-                    img = cv2_imread(filepath).astype(np.float32) / 255.0
-                    img = self.fe.enhance(img)
-                    img = np.clip (img*255, 0, 255).astype(np.uint8)
-
-                    output_filepath = self.output_dirpath / filepath.name
+            # enough items in flight to read the next batch and write the previous one during the forward pass
+            self.reader = ThreadPoolMap(self.read_file, threads_count=4, prefetch=self.batch_size*2)
+            self.writer = ThreadPoolMap(self.write_file, threads_count=4, prefetch=self.batch_size*2)
 
-                    cv2_imwrite ( str(output_filepath), img, [int(cv2.IMWRITE_JPEG_QUALITY), 100] )
+        # read_file and write_file run in threads of ThreadPoolMap,
+        # they return error message, which is logged by the thread of process_data
 
-                    dflimg = DFLIMG.load (output_filepath)
-                    dflimg.set_dict(dfl_dict)
-                    dflimg.save()
+        def read_file(self, filepath):
+            try:
+                data = filepath.read_bytes()
+                dflimg = DFLIMG.load_meta (filepath, loader_func=lambda _: data)
+                if dflimg is None or not dflimg.has_data():
+                    return None, f"{filepath.name} is not a dfl image file"
+                img = cv2_imread(filepath, loader_func=lambda _: data)
+                return (img.astype(np.float32) / 255.0, dflimg.get_dict()), None
+            except:
+                return None, f"Exception occured while reading file {filepath}. Error: {traceback.format_exc()}"
 
-                    return (1, filepath, output_filepath)
+        def write_file(self, job):
+            filepath, img, dfl_dict = job
+            try:
+                img = np.clip (img*255, 0, 255).astype(np.uint8)
+                output_filepath = self.output_dirpath / filepath.name
+                output_filepath.write_bytes ( DFLJPG.dump_image(img, dfl_dict, jpeg_quality=100) )
+                return (1, filepath, output_filepath), None
             except:
-                self.log_err (f"Exception occured while processing file {filepath}. Error: {traceback.format_exc()}")
+                return (0, filepath, None), f"Exception occured while writing file {filepath}. Error: {traceback.format_exc()}"
+
+        def get_batches(self, filepaths):
+            batch = []
+            for filepath, (x, err_msg) in zip(filepaths, self.reader(filepaths)):
+                if err_msg is not None:
+                    self.log_err (err_msg)
+                    continue
+                batch.append ( (filepath, x) )
+                if len(batch) == self.batch_size:
+                    yield batch
+                    batch = []
+            if len(batch) != 0:
+                yield batch
+
+        def enhance_batches(self, filepaths):
+            for batch in self.get_batches(filepaths):
+                try:
+                    imgs = self.fe.enhance_batch( [ img for _, (img, _) in batch ] )
+                except:
+                    self.log_err (f"Exception occured while enhancing files {[ filepath.name for filepath, _ in batch ]}. Error: {traceback.format_exc()}")
+                    continue
+
+                for (filepath, (_, dfl_dict)), img in zip(batch, imgs):
+                    yield filepath, img, dfl_dict
 
-            return (0, filepath, None)
+        #override
+        def process_data(self, filepaths):
+            results = {}
+            for result, err_msg in self.writer( self.enhance_batches(filepaths) ):
+                if err_msg is not None:
+                    self.log_err (err_msg)
+                results[result[1]] = result
+            return [ results.get(filepath, (0, filepath, None)) for filepath in filepaths ]
 
 def process_folder ( dirpath, cpu_only=False, force_gpu_idxs=None ):
 
@@ -130,7 +178,7 @@ def process_folder ( dirpath, cpu_only=False, force_gpu_idxs=None ):
         return
 
     device_config = nn.DeviceConfig.GPUIndexes( force_gpu_idxs or nn.ask_choose_device_idxs(suggest_all_gpu=True) ) \
-                    if not cpu_only else nn.DeviceConfig.CPU()
+                    if not cpu_only else nn.DeviceConfig.CPU(cpu_only)
 
     output_dirpath = dirpath.parent / (dirpath.name + '_enhanced')
     output_dirpath.mkdir (exist_ok=True, parents=True)
@@ -14,14 +14,20 @@ from samplelib import PackedFaceset
 class FacesetResizerSubprocessor(Subprocessor):
 
     #override
-    def __init__(self, image_paths, output_dirpath, image_size, face_type=None):
+    def __init__(self, image_paths, output_dirpath, image_size, face_type=None, workers_count=None, chunk_size=None):
+        """
+        workers_count   number of subprocesses, default min(8, cpu_count)
+        chunk_size      number of images sent to subprocess in one message, default 4
+        """
         self.image_paths = image_paths
         self.output_dirpath = output_dirpath
         self.image_size = image_size
         self.face_type = face_type
+        self.workers_count = workers_count if workers_count is not None else min(8, multiprocessing.cpu_count())
         self.result = []
 
-        super().__init__('FacesetResizer', FacesetResizerSubprocessor.Cli, 600)
+        super().__init__('FacesetResizer', FacesetResizerSubprocessor.Cli, 600,
+                         items_in_flight=2, data_chunk_size=chunk_size if chunk_size is not None else 4)
 
     #override
     def on_clients_initialized(self):
@@ -35,7 +41,7 @@ class FacesetResizerSubprocessor(Subprocessor):
     def process_info_generator(self):
         base_dict = {'output_dirpath':self.output_dirpath, 'image_size':self.image_size, 'face_type':self.face_type}
 
-        for device_idx in range( min(8, multiprocessing.cpu_count()) ):
+        for device_idx in range( max(1, self.workers_count) ):
             client_dict = base_dict.copy()
             device_name = f'CPU #{device_idx}'
             client_dict['device_name'] = device_name
@@ -72,11 +78,13 @@ class FacesetResizerSubprocessor(Subprocessor):
         #override
         def process_data(self, filepath):
             try:
-                dflimg = DFLIMG.load (filepath)
+                # read once, metadata is parsed from the headers only
+                data = filepath.read_bytes()
+                dflimg = DFLIMG.load_meta (filepath, loader_func=lambda _: data)
                 if dflimg is None or not dflimg.has_data():
                     self.log_err (f"{filepath.name} is not a dfl image file")
                 else:
-                    img = cv2_imread(filepath)
+                    img = cv2_imread(filepath, loader_func=lambda _: data)
                     h,w = img.shape[:2]
                     if h != w:
                         raise Exception(f'w != h in {filepath}')
@@ -92,12 +100,6 @@ class FacesetResizerSubprocessor(Subprocessor):
                         img = cv2.warpAffine(img, mat, (image_size, image_size), flags=cv2.INTER_LANCZOS4 )
                         img = np.clip(img, 0, 255).astype(np.uint8)
                         
-                        cv2_imwrite ( str(output_filepath), img, [int(cv2.IMWRITE_JPEG_QUALITY), 100] )
-
-                        dfl_dict = dflimg.get_dict()
-                        dflimg = DFLIMG.load (output_filepath)
-                        dflimg.set_dict(dfl_dict)
-                        
                         xseg_mask = dflimg.get_xseg_mask()
                         if xseg_mask is not None:
                             xseg_res = 256
@@ -129,20 +131,12 @@ class FacesetResizerSubprocessor(Subprocessor):
                             image_to_face_mat = LandmarksProcessor.get_transform_mat ( dflimg.get_source_landmarks(), image_size, face_type )
                             dflimg.set_image_to_face_mat(image_to_face_mat)
                         dflimg.set_face_type( FaceType.toString(face_type) )
-                        dflimg.save()
                         
                     else:
-                        dfl_dict = dflimg.get_dict()
-                         
                         scale = w / image_size
                         
                         img = cv2.resize(img, (image_size, image_size), interpolation=cv2.INTER_LANCZOS4)                    
                         
-                        cv2_imwrite ( str(output_filepath), img, [int(cv2.IMWRITE_JPEG_QUALITY), 100] )
-
-                        dflimg = DFLIMG.load (output_filepath)
-                        dflimg.set_dict(dfl_dict)
-                        
                         lmrks = dflimg.get_landmarks()                    
                         lmrks /= scale
                         dflimg.set_landmarks(lmrks)
@@ -157,7 +151,9 @@ class FacesetResizerSubprocessor(Subprocessor):
                             face_type = FaceType.fromString ( dflimg.get_face_type() )
                             image_to_face_mat = LandmarksProcessor.get_transform_mat ( dflimg.get_source_landmarks(), image_size, face_type )
                             dflimg.set_image_to_face_mat(image_to_face_mat)
-                        dflimg.save()
+
+                    # encoded once, metadata is embedded in memory
+                    output_filepath.write_bytes ( DFLJPG.dump_image(img, dflimg.get_dict(), jpeg_quality=100) )
 
                     return (1, filepath, output_filepath)
             except:
@@ -165,7 +161,7 @@ class FacesetResizerSubprocessor(Subprocessor):
 
             return (0, filepath, None)
 
-def process_folder (dirpath):
+def process_folder (dirpath, workers_count=None, chunk_size=None):
 
     if PackedFaceset.path_contains(dirpath):
         io.log_info (f'\n{dirpath} contains packed faceset! Unpack it first.\n')
@@ -198,7 +194,8 @@ def process_folder (dirpath):
             Path(filename).unlink()
 
     image_paths = [Path(x) for x in pathex.get_image_paths( dirpath )]
-    result = FacesetResizerSubprocessor ( image_paths, output_dirpath, image_size, face_type).run()
+    result = FacesetResizerSubprocessor ( image_paths, output_dirpath, image_size, face_type,
+                                          workers_count=workers_count, chunk_size=chunk_size).run()
 
     is_merge = io.input_bool (f"\r\nMerge {output_dirpath_parts} to {dirpath_parts} ?", True)
     if is_merge:
@@ -1,12 +1,10 @@
-﻿import math
-import multiprocessing
+﻿import multiprocessing
 import traceback
 from pathlib import Path
 
 import numpy as np
 import numpy.linalg as npla
 
-import samplelib
 from core import pathex
 from core.cv2ex import *
 from core.interact import interact as io
@@ -14,7 +12,7 @@ from core.joblib import MPClassFuncOnDemand, MPFunc
 from core.leras import nn
 from DFLIMG import DFLIMG
 from facelib import FaceEnhancer, FaceType, LandmarksProcessor, XSegNet
-from merger import FrameInfo, InteractiveMergerSubprocessor, MergerConfig
+from merger import DFMPredictor, FrameInfo, InteractiveMergerSubprocessor, MergerAlignments, MergerConfig, MergerVideoWriter, OfflineMerger
 
 
 def main (model_class_name=None,
@@ -28,7 +26,15 @@ def main (model_class_name=None,
           pak_name=None,
           force_gpu_idxs=None,
           cpu_only=None,
-          reduce_clutter=False):
+          reduce_clutter=False,
+          output_video_path=None,
+          output_mask_video_path=None,
+          reference_file=None,
+          dfm_path=None,
+          dfm_threads_count=None,
+          dfm_optimization_cache=False,
+          ensemble_dfm_paths=None,
+          force=False):
     io.log_info ("Running merger.\r\n")
 
     try:
@@ -42,25 +48,45 @@ def main (model_class_name=None,
         if not output_mask_path.exists():
             output_mask_path.mkdir(parents=True, exist_ok=True)
 
-        if not saved_models_path.exists():
-            io.log_err('Model directory not found. Please ensure it exists.')
-            return
+        if dfm_path is not None:
+            # predicting with exported .dfm in ONNX Runtime, model and TensorFlow are not loaded
+            model = DFMPredictor(dfm_path, threads_count=dfm_threads_count, cpu_only=cpu_only, use_optimization_cache=dfm_optimization_cache)
+            run_on_cpu = model.run_on_cpu
+            if saved_models_path is None:
+                saved_models_path = dfm_path.parent
+        else:
+            if model_class_name is None or saved_models_path is None:
+                io.log_err('Model and model directory should be specified, if .dfm is not used.')
+                return
+
+            if not saved_models_path.exists():
+                io.log_err('Model directory not found. Please ensure it exists.')
+                return
 
-        # Initialize model
-        import models
-        model = models.import_model(model_class_name)(is_training=False,
-                                                      saved_models_path=saved_models_path,
-                                                      force_gpu_idxs=force_gpu_idxs,
-                                                      force_model_name=force_model_name,
-                                                      cpu_only=cpu_only,
-                                                      reduce_clutter=reduce_clutter)
+            # Initialize model
+            import models
+            model = models.import_model(model_class_name)(is_training=False,
+                                                          saved_models_path=saved_models_path,
+                                                          force_gpu_idxs=force_gpu_idxs,
+                                                          force_model_name=force_model_name,
+                                                          cpu_only=cpu_only,
+                                                          reduce_clutter=reduce_clutter)
+            run_on_cpu = len(nn.getCurrentDeviceConfig().devices) == 0
 
         predictor_func, predictor_input_shape, cfg = model.get_MergerConfig()
 
+        # models merged in the same pass over the frames, each to own subdirectory of output dirs
+        ensemble_models = [ DFMPredictor(path, threads_count=dfm_threads_count, cpu_only=cpu_only, use_optimization_cache=dfm_optimization_cache)
+                            for path in ensemble_dfm_paths ] if ensemble_dfm_paths is not None else []
+        if len(ensemble_models) != 0:
+            ensemble_names = [ x.get_model_name() for x in [model] + ensemble_models ]
+            if len(set(ensemble_names)) != len(ensemble_names):
+                io.log_err('Names of ensemble models should be different, they are used as output subdirectories.')
+                return
+
         # Preparing MP functions
         predictor_func = MPFunc(predictor_func)
 
-        run_on_cpu = len(nn.getCurrentDeviceConfig().devices) == 0
         xseg_256_extract_func = MPClassFuncOnDemand(XSegNet, 'extract',
                                                     name='XSeg',
                                                     resolution=256,
@@ -72,14 +98,53 @@ def main (model_class_name=None,
                                                     place_model_on_cpu=True,
                                                     run_on_cpu=run_on_cpu)
 
-        is_interactive = io.input_bool ("Use interactive merger?", True) if not io.is_colab() else False
+        if output_video_path is not None:
+            io.log_info ("Merging to video, interactive merger is not used.")
+            is_interactive = False
+        elif len(ensemble_models) != 0:
+            io.log_info ("Merging ensemble, interactive merger is not used.")
+            is_interactive = False
+        else:
+            is_interactive = io.input_bool ("Use interactive merger?", True) if not io.is_colab() else False
 
         if not is_interactive:
             cfg.ask_settings()
+
+        ensemble_cfgs = []
+        for ensemble_model in ensemble_models:
+            io.log_info (f"\nMerger settings of {ensemble_model.get_model_name()}:")
+            ensemble_cfg = ensemble_model.get_MergerConfig()[2]
+            ensemble_cfg.ask_settings()
+            ensemble_cfgs.append(ensemble_cfg)
             
         subprocess_count = io.input_int("Number of workers?", max(8, multiprocessing.cpu_count()), 
                                         valid_range=[1, multiprocessing.cpu_count()], help_message="Specify the number of threads to process. A low value may affect performance. A high value may result in memory error. The value may not be greater than CPU cores." )
 
+        is_offline = not is_interactive and cfg.type == MergerConfig.TYPE_MASKED
+        if is_offline:
+            batch_size = io.input_int("Predictor batch size?", 8, valid_range=[1,64], help_message="Number of faces predicted at once. A high value may result in out of memory error.")
+
+        if len(ensemble_models) != 0 and not is_offline:
+            io.log_err('Ensemble is supported only for masked merger.')
+            return
+
+        video_writer = None
+        if output_video_path is not None:
+            if not is_offline:
+                io.log_err('Merging to video is supported only for masked merger.')
+                return
+
+            if len(ensemble_models) != 0:
+                io.log_err('Merging ensemble to video is not supported.')
+                return
+
+            fps = max (1, io.input_int ("Enter FPS", 25) ) if reference_file is None else None
+            lossless = io.input_bool ("Use lossless codec", False)
+            bitrate = max (1, io.input_int ("Bitrate of output file in MB/s", 16) ) if not lossless else None
+
+            video_writer = MergerVideoWriter(output_video_path, output_mask_file=output_mask_video_path, reference_file=reference_file,
+                                             fps=fps, bitrate=bitrate, lossless=lossless, buffer_size=subprocess_count*4)
+
         input_path_image_paths = pathex.get_image_paths(input_path)
 
         if cfg.type == MergerConfig.TYPE_MASKED:
@@ -87,36 +152,16 @@ def main (model_class_name=None,
                 io.log_err('Aligned directory not found. Please ensure it exists.')
                 return
 
-            packed_samples = None
-            try:
-                packed_samples = samplelib.PackedFaceset.load(aligned_path, pak_name=pak_name)
-            except:
-                io.log_err(f"Error occured while loading samplelib.PackedFaceset.load {str(aligned_path)}, {traceback.format_exc()}")
-
-
-            if packed_samples is not None:
-                io.log_info ("Using packed faceset.")
-                def generator():
-                    for sample in io.progress_bar_generator( packed_samples, "Collecting alignments"):
-                        filepath = Path(sample.filename)
-                        yield filepath, DFLIMG.load(filepath, loader_func=lambda x: sample.read_raw_file()  )
-            else:
-                def generator():
-                    for filepath in io.progress_bar_generator( pathex.get_image_paths(aligned_path), "Collecting alignments"):
-                        filepath = Path(filepath)
-                        yield filepath, DFLIMG.load(filepath)
+            aligned_data = MergerAlignments(aligned_path, pak_name=pak_name,
+                                            cache_path=model.get_strpath_storage_for_file('merger_alignments.dat'),
+                                            workers_count=subprocess_count).run()
 
             alignments = {}
             multiple_faces_detected = False
 
-            for filepath, dflimg in generator():
-                if dflimg is None or not dflimg.has_data():
-                    io.log_err (f"{filepath.name} is not a dfl image file")
-                    continue
-
-                source_filename = dflimg.get_source_filename()
-                if source_filename is None:
-                    continue
+            for filename, source_filename, source_landmarks, shape, image_to_face_mat in zip(*aligned_data):
+                filepath = Path(filename)
+                dflimg = MergerAlignments.get_dfl_image(filename, source_filename, source_landmarks, shape, image_to_face_mat)
 
                 source_filepath = Path(source_filename)
                 source_filename_stem = source_filepath.stem
@@ -125,7 +170,7 @@ def main (model_class_name=None,
                     alignments[ source_filename_stem ] = []
 
                 alignments_ar = alignments[ source_filename_stem ]
-                alignments_ar.append ( (dflimg.get_source_landmarks(), filepath, source_filepath, dflimg ) )
+                alignments_ar.append ( (source_landmarks, filepath, source_filepath, dflimg ) )
 
                 if len(alignments_ar) > 1:
                     multiple_faces_detected = True
@@ -178,41 +223,66 @@ def main (model_class_name=None,
                 io.log_info ("")
             else:
                 s = 256
-                local_pts = [ (s//2-1, s//2-1), (s//2-1,0) ] #center+up
+                local_center = np.float64( [s//2-1, s//2-1] )
                 frames_len = len(frames)
-                for i in io.progress_bar_generator( range(len(frames)) , "Computing motion vectors"):
-                    fi_prev = frames[max(0, i-1)].frame_info
-                    fi      = frames[i].frame_info
-                    fi_next = frames[min(i+1, frames_len-1)].frame_info
-                    if len(fi_prev.landmarks_list) == 0 or \
-                       len(fi.landmarks_list) == 0 or \
-                       len(fi_next.landmarks_list) == 0:
-                            continue
-
-                    mat_prev = LandmarksProcessor.get_transform_mat ( fi_prev.landmarks_list[0], s, face_type=FaceType.FULL)
-                    mat      = LandmarksProcessor.get_transform_mat ( fi.landmarks_list[0]     , s, face_type=FaceType.FULL)
-                    mat_next = LandmarksProcessor.get_transform_mat ( fi_next.landmarks_list[0], s, face_type=FaceType.FULL)
-
-                    pts_prev = LandmarksProcessor.transform_points (local_pts, mat_prev, True)
-                    pts      = LandmarksProcessor.transform_points (local_pts, mat, True)
-                    pts_next = LandmarksProcessor.transform_points (local_pts, mat_next, True)
 
-                    prev_vector = pts[0]-pts_prev[0]
-                    next_vector = pts_next[0]-pts[0]
+                # transform of every frame is computed once
+                has_face = np.array( [ len(frame.frame_info.landmarks_list) != 0 for frame in frames ] )
+                face_idxs = np.nonzero(has_face)[0]
+                mats = np.zeros( (frames_len, 2, 3), dtype=np.float64 )
+                for i in io.progress_bar_generator( face_idxs, "Computing motion vectors"):
+                    mats[i] = LandmarksProcessor.get_transform_mat ( frames[i].frame_info.landmarks_list[0], s, face_type=FaceType.FULL)
 
-                    motion_vector = pts_next[0] - pts_prev[0]
-                    fi.motion_power = npla.norm(motion_vector)
+                # face centers in the frame by inverted transforms, rounded as integer points are by transform_points
+                centers = np.zeros( (frames_len, 2), dtype=np.float64 )
+                centers[face_idxs] = np.round( np.einsum('nij,nj->ni', npla.inv(mats[face_idxs,:,:2]), local_center - mats[face_idxs,:,2]) )
 
-                    motion_vector = motion_vector / fi.motion_power if fi.motion_power != 0 else np.array([0,0],dtype=np.float32)
+                prev_idxs = np.maximum( np.arange(frames_len)-1, 0 )
+                next_idxs = np.minimum( np.arange(frames_len)+1, frames_len-1 )
+                motion_vectors = centers[next_idxs] - centers[prev_idxs]
+                motion_powers = npla.norm(motion_vectors, axis=1)
+                motion_degs = -np.degrees( np.arctan2(motion_vectors[:,1], motion_vectors[:,0]) )
 
-                    fi.motion_deg = -math.atan2(motion_vector[1],motion_vector[0])*180 / math.pi
+                for i in np.nonzero( has_face & has_face[prev_idxs] & has_face[next_idxs] )[0]:
+                    fi = frames[i].frame_info
+                    fi.motion_power = motion_powers[i]
+                    fi.motion_deg = float(motion_degs[i])
 
 
         if len(frames) == 0:
             io.log_info ("No frames to merge in input_dir.")
         else:
-            if False:
-                pass
+            if is_offline:
+                ensemble = None
+                if len(ensemble_models) != 0:
+                    ensemble = []
+                    for ensemble_model, ensemble_cfg, ensemble_name in zip(ensemble_models, ensemble_cfgs, ensemble_names[1:]):
+                        ensemble_predictor_func, ensemble_predictor_input_shape, _ = ensemble_model.get_MergerConfig()
+                        ensemble.append ( OfflineMerger.Member(ensemble_predictor_func, ensemble_predictor_input_shape, ensemble_cfg,
+                                                               output_path / ensemble_name, output_mask_path / ensemble_name, ensemble_model.get_weights_fingerprint(),
+                                                               predictor_batch_func=ensemble_model.get_MergerBatchPredictor()) )
+                    output_path, output_mask_path = output_path / ensemble_names[0], output_mask_path / ensemble_names[0]
+
+                    for member_output_path in [output_path, output_mask_path] + [ x for member in ensemble for x in [member.output_path, member.output_mask_path] ]:
+                        member_output_path.mkdir(parents=True, exist_ok=True)
+
+                OfflineMerger (
+                            predictor_func         = predictor_func,
+                            predictor_input_shape  = predictor_input_shape,
+                            face_enhancer_func     = face_enhancer_func,
+                            xseg_256_extract_func  = xseg_256_extract_func,
+                            merger_config          = cfg,
+                            frames                 = frames,
+                            output_path            = output_path,
+                            output_mask_path       = output_mask_path,
+                            model_fingerprint      = model.get_weights_fingerprint(),
+                            predictor_batch_func   = model.get_MergerBatchPredictor(),
+                            batch_size             = batch_size,
+                            threads_count          = subprocess_count,
+                            video_writer           = video_writer,
+                            ensemble               = ensemble,
+                            force                  = force,
+                        ).run()
             else:
                 InteractiveMergerSubprocessor (
                             is_interactive         = is_interactive,
@@ -231,6 +301,8 @@ def main (model_class_name=None,
                         ).run()
 
         model.finalize()
+        for ensemble_model in ensemble_models:
+            ensemble_model.finalize()
 
     except Exception as e:
         print ( traceback.format_exc() )
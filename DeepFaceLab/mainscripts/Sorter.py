@@ -16,7 +16,7 @@ from core.interact import interact as io
 from core.joblib import Subprocessor
 from DFLIMG import *
 from facelib import LandmarksProcessor
-from samplelib import PackedFaceset
+from samplelib import FacesetIndex, PackedFaceset
 
 
 class BlurEstimatorSubprocessor(Subprocessor):
@@ -27,7 +27,7 @@ class BlurEstimatorSubprocessor(Subprocessor):
         #override
         def process_data(self, data):
             filepath = Path( data[0] )
-            dflimg = DFLIMG.load (filepath)
+            dflimg = DFLIMG.load_meta (filepath)
 
             if dflimg is None or not dflimg.has_data():
                 self.log_err (f"{filepath.name} is not a dfl image file")
@@ -58,7 +58,7 @@ class BlurEstimatorSubprocessor(Subprocessor):
         self.estimate_motion_blur = estimate_motion_blur
         self.img_list = []
         self.trash_img_list = []
-        super().__init__('BlurEstimator', BlurEstimatorSubprocessor.Cli, 60)
+        super().__init__('BlurEstimator', BlurEstimatorSubprocessor.Cli, 60, items_in_flight=2)
 
     #override
     def on_clients_initialized(self):
@@ -745,25 +745,14 @@ def final_process(input_path, img_list, trash_img_list):
             except:
                 io.log_info ('fail to rename %s' % (src.name) )
 
-def process_by_face_yaw(filepath):
-    path = Path(filepath)
-    dflimg = DFLIMG.load(path)
-    if dflimg is None or not dflimg.has_data():
-        print(f"{path.name} is not a DFL image file. Trashing it...")
-        return str(path), False
-        
-    _, yaw, _ = LandmarksProcessor.estimate_pitch_yaw_roll ( dflimg.get_landmarks(), size=dflimg.get_shape()[1] )
-    return str(path), yaw
+def index_by_face_yaw(index):
+    return [ LandmarksProcessor.estimate_pitch_yaw_roll ( landmarks, size=shape[1] )[1] for landmarks, shape in zip(index['landmarks'], index['shapes']) ]
 
-def process_by_face_pitch(filepath):
-    path = Path(filepath)
-    dflimg = DFLIMG.load(path)
-    if dflimg is None or not dflimg.has_data():
-        print(f"{path.name} is not a DFL image file. Trashing it...")
-        return str(path), False
-        
-    pitch, _, _ = LandmarksProcessor.estimate_pitch_yaw_roll ( dflimg.get_landmarks(), size=dflimg.get_shape()[1] )
-    return str(path), pitch
+def index_by_face_pitch(index):
+    return [ LandmarksProcessor.estimate_pitch_yaw_roll ( landmarks, size=shape[1] )[0] for landmarks, shape in zip(index['landmarks'], index['shapes']) ]
+
+def index_by_origname(index):
+    return index['source_filenames']
 
 def process_by_brightness(filepath):
     return filepath, np.mean( cv2.cvtColor(cv2_imread(filepath), cv2.COLOR_BGR2HSV)[..., 2].flatten() )
@@ -773,7 +762,7 @@ def process_by_hue(filepath):
 
 def process_by_face_source_rect_size(filepath):
     path = Path(filepath)
-    dflimg = DFLIMG.load(path)
+    dflimg = DFLIMG.load_meta(path)
     if dflimg is None or not dflimg.has_data():
         print(f"{path.name} is not a DFL image file. Trashing it...")
         return str(path), False
@@ -787,15 +776,6 @@ def process_by_black(filepath):
     img = cv2_imread(path)
     return path, img[(img == 0)].size
 
-def process_by_origname(filepath):
-    path = Path(filepath)
-    dflimg = DFLIMG.load(path)
-    if dflimg is None or not dflimg.has_data():
-        print(f"{path.name} is not a DFL image file. Trashing it...")
-        return str(path), False
-    
-    return str(path), dflimg.get_source_filename()
-
 def sort_by_oneface_in_image(input_path, arg):
     io.log_info (f"Sorting by {arg[Arguments.DESC.value]}...")
     image_paths = pathex.get_image_paths(input_path)
@@ -821,6 +801,24 @@ def sort_starter(input_path, arg):
     trash_img_list = []
     dataset = [filename for filename in pathex.get_image_paths(input_path)]
 
+    if arg[Arguments.KEY.value] in index_processors:
+        # landmarks and source filenames are served from faceset index, only changed files are read
+        func, reverse = index_processors[arg[Arguments.KEY.value]]
+        index = FacesetIndex.update(input_path)
+        values = dict( zip(index['filenames'], func(index)) )
+
+        for filepath in dataset:
+            value = values.get(Path(filepath).name, None)
+            if value is None:
+                print(f"{Path(filepath).name} is not a DFL image file. Trashing it...")
+                trash_img_list.append( [filepath] )
+            else:
+                img_list.append( [filepath, value] )
+
+        io.log_info ("Sorting...")
+        img_list = sorted(img_list, key=operator.itemgetter(1), reverse=reverse)
+        return img_list, trash_img_list
+
     cpus = io.input_int('Insert number of CPUs to use', 
                     help_message='If the default option is selected it will use all cpu cores and it will slow down pc',
                     default_value=multiprocessing.cpu_count())
@@ -846,14 +844,17 @@ class ProcessorKeys(Enum):
     FUNC = 0
     REVERSE = 1
 
+index_processors = {
+    'face-yaw':    (index_by_face_yaw, True),
+    'face-pitch':  (index_by_face_pitch, True),
+    'origname':    (index_by_origname, False)
+}
+
 processors = {
-    'face-yaw':    (process_by_face_yaw, True),
-    'face-pitch':  (process_by_face_pitch, True),
     'face-source-rect-size' : (process_by_face_source_rect_size, True),
     'brightness':  (process_by_brightness, True),
     'hue':         (process_by_hue, True),
     'black':       (process_by_black, True),
-    'origname':    (process_by_origname, False)
 }
 
 sort_func_methods = {
@@ -244,7 +244,7 @@ def trainerThread (s2c, c2s, e,
                         if shared_state['after_save']:
                             shared_state['after_save'] = False
 
-                            mean_loss = np.mean(loss_history[save_iter:iter], axis=0)
+                            mean_loss = loss_history.get_mean(save_iter, iter)
 
                             for loss_value in mean_loss:
                                 loss_string += "[%.4f]" % (loss_value)
@@ -467,12 +467,9 @@ def create_preview_pane_image(previews, selected_preview, loss_history,
     final = head
 
     if loss_history is not None:
-        if show_last_history_iters_count == 0:
-            loss_history_to_show = loss_history
-        else:
-            loss_history_to_show = loss_history[-show_last_history_iters_count:]
         lh_height = int(100 * zoom.scale)
-        lh_img = models.ModelBase.get_loss_history_preview(loss_history_to_show, iteration, w, c, lh_height)
+        lh_img = models.ModelBase.get_loss_history_preview(loss_history, iteration, w, c, lh_height,
+                                                           last_count=show_last_history_iters_count)
         final = np.concatenate([final, lh_img], axis=0)
 
     final = np.concatenate([final, selected_preview_rgb], axis=0)
@@ -573,7 +570,7 @@ def main(**kwargs):
                 preview_file = str(model_path / filename)
                 cv2.imwrite(preview_file, preview_pane_image)
                 s2flask.put({'op': 'show'})
-                socketio.emit('preview', {'iter': iteration, 'loss': loss_history[-1]})
+                socketio.emit('preview', {'iter': iteration, 'loss': loss_history[-1].tolist()})
             try:
                 io.process_messages(0.01)
             except KeyboardInterrupt:
@@ -671,12 +668,8 @@ def main(**kwargs):
                 final = head
 
                 if loss_history is not None:
-                    if show_last_history_iters_count == 0:
-                        loss_history_to_show = loss_history
-                    else:
-                        loss_history_to_show = loss_history[-show_last_history_iters_count:]
-
-                    lh_img = models.ModelBase.get_loss_history_preview(loss_history_to_show, iter, w, c)
+                    lh_img = models.ModelBase.get_loss_history_preview(loss_history, iter, w, c,
+                                                                       last_count=show_last_history_iters_count)
                     final = np.concatenate([final, lh_img], axis=0)
 
                 final = np.concatenate([final, selected_preview_rgb], axis=0)
@@ -1,9 +1,17 @@
+import multiprocessing
+import os
+import shutil
 import subprocess
+import threading
+import traceback
+import cv2
 import numpy as np
 import ffmpeg
 from pathlib import Path
 from core import pathex
+from core.cv2ex import *
 from core.interact import interact as io
+from core.joblib import ThreadPoolMap
 
 def extract_video(input_file, output_dir, output_ext=None, fps=None):
     input_file_path = Path(input_file)
@@ -85,7 +93,15 @@ def cut_video ( input_file, from_time=None, to_time=None, audio_track_id=None, b
     except:
         io.log_err ("ffmpeg fail, job commandline:" + str(job.compile()) )
 
-def denoise_image_sequence( input_dir, ext=None, factor=None ):
+def denoise_image_sequence( input_dir, ext=None, factor=None, method=None, threads_count=None ):
+    """
+    Denoises images of input_dir in sorted order.
+
+    method  'ffmpeg'  - hqdn3d filter, images are piped to ffmpeg and raw frames are read back
+            'nlmeans' - cv2.fastNlMeansDenoisingColoredMulti over sliding window of frames, in threads_count threads
+
+    Denoised images are written to temporary directory, which replaces input_dir at the end.
+    """
     input_path = Path(input_dir)
 
     if not input_path.exists():
@@ -93,6 +109,9 @@ def denoise_image_sequence( input_dir, ext=None, factor=None ):
         return
 
     image_paths = [ Path(filepath) for filepath in pathex.get_image_paths(input_path) ]
+    if len(image_paths) == 0:
+        io.log_err(f"No images in {input_path.name}.")
+        return
 
     # Check extension of all images
     image_paths_suffix = None
@@ -107,63 +126,122 @@ def denoise_image_sequence( input_dir, ext=None, factor=None ):
     if factor is None:
         factor = np.clip ( io.input_int ("Denoise factor?", 7, add_info="1-20"), 1, 20 )
 
-    # Rename to temporary filenames
-    for i,filepath in io.progress_bar_generator( enumerate(image_paths), "Renaming", leave=False):
-        src = filepath
-        dst = filepath.parent / ( f'{i+1:06}_{filepath.name}' )
-        try:
-            src.rename (dst)
-        except:
-            io.log_error ('fail to rename %s' % (src.name) )
-            return
+    if method is None:
+        method = io.input_str ("Denoise method", "ffmpeg", ["ffmpeg","nlmeans"], help_message="ffmpeg - fast hqdn3d filter. nlmeans - temporal non-local means denoising over 5 frames, slower, uses all CPU cores.")
 
-    # Rename to sequental filenames
-    for i,filepath in io.progress_bar_generator( enumerate(image_paths), "Renaming", leave=False):
+    if threads_count is None:
+        threads_count = multiprocessing.cpu_count()
 
-        src = filepath.parent / ( f'{i+1:06}_{filepath.name}' )
-        dst = filepath.parent / ( f'{i+1:06}{filepath.suffix}' )
-        try:
-            src.rename (dst)
-        except:
-            io.log_error ('fail to rename %s' % (src.name) )
-            return
+    output_path = input_path.parent / (input_path.name + '_denoising')
+    if output_path.exists():
+        shutil.rmtree(output_path)
+    output_path.mkdir(parents=True)
+
+    imwrite_args = [ [int(cv2.IMWRITE_JPEG_QUALITY), 95] ] if image_paths_suffix == '.jpg' else []
+    def write(x):
+        filepath, img = x
+        cv2_imwrite (output_path / filepath.name, img, *imwrite_args)
 
-    # Process image sequence in ffmpeg
-    kwargs = {}
-    if image_paths_suffix == '.jpg':
-        kwargs.update ({'q:v':'2'})
+    io.progress_bar ("Denoising", len(image_paths))
+    try:
+        if method == 'nlmeans':
+            denoised = _denoise_nlmeans(image_paths, factor, threads_count)
+        else:
+            denoised = _denoise_ffmpeg(image_paths, factor)
+
+        for _ in ThreadPoolMap(write, max(1, threads_count // 2))(denoised):
+            io.progress_bar_inc(1)
+    except:
+        io.progress_bar_close()
+        io.log_err (f"Denoise fail: {traceback.format_exc()}")
+        shutil.rmtree(output_path)
+        return
+    io.progress_bar_close()
+
+    # move other files, then swap directories
+    image_names = set( filepath.name for filepath in image_paths )
+    for entry in os.scandir(str(input_path)):
+        if entry.name not in image_names:
+            os.replace(entry.path, str(output_path / entry.name))
+
+    old_path = input_path.parent / (input_path.name + '_denoise_old')
+    input_path.rename(old_path)
+    output_path.rename(input_path)
+    shutil.rmtree(old_path)
+
+def _denoise_ffmpeg(image_paths, factor):
+    """
+    yields (filepath, denoised img) in order of image_paths
+    """
+    img = cv2_imread(image_paths[0])
+    h, w = img.shape[:2]
+    c = img.shape[2] if img.ndim == 3 else 1
+    pix_fmt = {1:'gray', 3:'bgr24', 4:'bgra'}[c]
 
     job = ( ffmpeg
-            .input(str ( input_path / ('%6d'+image_paths_suffix) ) )
+            .input('pipe:', format='image2pipe')
             .filter("hqdn3d", factor, factor, 5,5)
-            .output(str ( input_path / ('%6d'+image_paths_suffix) ), **kwargs )
+            .output('pipe:', format='rawvideo', pix_fmt=pix_fmt)
            )
+    job_run = job.run_async(pipe_stdin=True, pipe_stdout=True)
 
-    try:
-        job = job.run()
-    except:
-        io.log_err ("ffmpeg fail, job commandline:" + str(job.compile()) )
-
-    # Rename to temporary filenames
-    for i,filepath in io.progress_bar_generator( enumerate(image_paths), "Renaming", leave=False):
-        src = filepath.parent / ( f'{i+1:06}{filepath.suffix}' )
-        dst = filepath.parent / ( f'{i+1:06}_{filepath.name}' )
+    def feed():
         try:
-            src.rename (dst)
+            for filepath in image_paths:
+                job_run.stdin.write (filepath.read_bytes())
         except:
-            io.log_error ('fail to rename %s' % (src.name) )
-            return
+            pass
+        job_run.stdin.close()
 
-    # Rename to initial filenames
-    for i,filepath in io.progress_bar_generator( enumerate(image_paths), "Renaming", leave=False):
-        src = filepath.parent / ( f'{i+1:06}_{filepath.name}' )
-        dst = filepath
+    threading.Thread(target=feed, daemon=True).start()
 
-        try:
-            src.rename (dst)
-        except:
-            io.log_error ('fail to rename %s' % (src.name) )
-            return
+    frame_size = h*w*c
+    try:
+        for filepath in image_paths:
+            b = job_run.stdout.read(frame_size)
+            if len(b) != frame_size:
+                raise Exception ("ffmpeg fail, job commandline:" + str(job.compile()) )
+            img = np.frombuffer(b, np.uint8).reshape( (h,w,c) )
+            yield filepath, img if c != 1 else img[...,0]
+    finally:
+        job_run.stdout.close()
+        job_run.wait()
+
+def _denoise_nlmeans(image_paths, factor, threads_count, window_size=5):
+    """
+    yields (filepath, denoised img) in order of image_paths
+    """
+    n = len(image_paths)
+    half = window_size // 2
+
+    def get_windows(imgs):
+        # frames around center c, edge frames are repeated at both ends of the sequence
+        cache = {}
+        def get_window(c):
+            return c, [ cache[ min(max(c+i, 0), n-1) ] for i in range(-half, half+1) ]
+
+        for i, img in enumerate(imgs):
+            cache[i] = img
+            c = i - half
+            if c >= 0:
+                yield get_window(c)
+                cache.pop(c-half, None)
+
+        for c in range( max(0, n-half), n):
+            yield get_window(c)
+
+    def denoise(x):
+        c, window = x
+        img = window[half]
+        if img.ndim == 2:
+            img = cv2.fastNlMeansDenoisingMulti(window, half, window_size, None, float(factor), 7, 21)
+        else:
+            bgr = cv2.fastNlMeansDenoisingColoredMulti([ x[...,0:3] for x in window ], half, window_size, None, float(factor), float(factor), 7, 21)
+            img = np.concatenate([bgr, img[...,3:]], -1) if img.shape[2] > 3 else bgr
+        return image_paths[c], img
+
+    imgs = ThreadPoolMap(cv2_imread, max(1, threads_count // 2))(image_paths)
+    yield from ThreadPoolMap(denoise, threads_count)(get_windows(imgs))
 
 def video_from_sequence( input_dir, output_file, reference_file=None, ext=None, fps=None, bitrate=None, include_audio=False, lossless=None ):
     input_path = Path(input_dir)
@@ -7,11 +7,12 @@ import numpy as np
 
 from core import pathex
 from core.cv2ex import *
+from core.imagelib import SegIEPolys
 from core.interact import interact as io
 from core.leras import nn
 from DFLIMG import *
 from facelib import XSegNet, LandmarksProcessor, FaceType
-from samplelib import PackedFaceset
+from samplelib import FacesetIndex, PackedFaceset
 import pickle
 
 
@@ -20,6 +21,17 @@ def is_packed(input_path):
         io.log_info (f'\n{input_path} contains packed faceset! Unpack it first.\n')
         return True
 
+def load_faceset_index(input_path):
+    """
+    returns FacesetIndex of input_path, metadata is read only from files changed since the last use
+    """
+    index = FacesetIndex.update(input_path)
+    indexed_names = set(index['filenames'])
+    for filepath in pathex.get_image_paths(input_path, return_Path_class=True):
+        if filepath.name not in indexed_names:
+            io.log_info(f'{filepath} is not a DFLIMG')
+    return index
+
 def apply_xseg(input_path, model_path):
     if not input_path.exists():
         raise ValueError(f'{input_path} not found. Please ensure it exists.')
@@ -121,19 +133,12 @@ def fetch_xseg(input_path):
     
     io.log_info(f'Copying faces containing XSeg polygons to {output_path.name}/ folder.')
     
-    images_paths = pathex.get_image_paths(input_path, return_Path_class=True)
-    
-    
-    files_copied = []
-    for filepath in io.progress_bar_generator(images_paths, "Processing"):
-        dflimg = DFLIMG.load(filepath)
-        if dflimg is None or not dflimg.has_data():
-            io.log_info(f'{filepath} is not a DFLIMG')
-            continue
-        
-        ie_polys = dflimg.get_seg_ie_polys()
+    index = load_faceset_index(input_path)
 
-        if ie_polys.has_polys():
+    files_copied = []
+    for name, seg_ie_polys in io.progress_bar_generator( list(zip(index['filenames'], index['seg_ie_polys'])), "Processing"):
+        if SegIEPolys.load(seg_ie_polys).has_polys():
+            filepath = input_path / name
             files_copied.append(filepath)
             shutil.copy ( str(filepath), str(output_path / filepath.name) )
     
@@ -156,19 +161,20 @@ def remove_xseg(input_path):
     io.log_info('!!! WARNING : APPLIED XSEG MASKS WILL BE REMOVED FROM THE FRAMES !!!')
     io.input_str('Press enter to continue.')
                                
-    images_paths = pathex.get_image_paths(input_path, return_Path_class=True)
-    
+    index = load_faceset_index(input_path)
+    # only files with masks are rewritten
+    images_paths = [ input_path / name for name, xseg_mask in zip(index['filenames'], index['xseg_masks_compressed']) if xseg_mask is not None ]
+
     files_processed = 0
     for filepath in io.progress_bar_generator(images_paths, "Processing"):
         dflimg = DFLIMG.load(filepath)
         if dflimg is None or not dflimg.has_data():
             io.log_info(f'{filepath} is not a DFLIMG')
             continue
-        
-        if dflimg.has_xseg_mask():
-            dflimg.set_xseg_mask(None)
-            dflimg.save()
-            files_processed += 1
+
+        dflimg.set_xseg_mask(None)
+        dflimg.save()
+        files_processed += 1
     io.log_info(f'Files processed: {files_processed}')
     
 def remove_xseg_labels(input_path):
@@ -183,8 +189,10 @@ def remove_xseg_labels(input_path):
     io.log_info('!!! WARNING : LABELED XSEG POLYGONS WILL BE REMOVED FROM THE FRAMES !!!')
     io.input_str('Press enter to continue.')
     
-    images_paths = pathex.get_image_paths(input_path, return_Path_class=True)
-    
+    index = load_faceset_index(input_path)
+    # only files with polygons are rewritten
+    images_paths = [ input_path / name for name, seg_ie_polys in zip(index['filenames'], index['seg_ie_polys']) if seg_ie_polys is not None ]
+
     files_processed = 0
     for filepath in io.progress_bar_generator(images_paths, "Processing"):
         dflimg = DFLIMG.load(filepath)
@@ -192,9 +200,8 @@ def remove_xseg_labels(input_path):
             io.log_info(f'{filepath} is not a DFLIMG')
             continue
 
-        if dflimg.has_seg_ie_polys():
-            dflimg.set_seg_ie_polys(None)
-            dflimg.save()            
-            files_processed += 1
+        dflimg.set_seg_ie_polys(None)
+        dflimg.save()
+        files_processed += 1
             
     io.log_info(f'Files processed: {files_processed}')
\ No newline at end of file
@@ -0,0 +1,107 @@
+from pathlib import Path
+
+import numpy as np
+
+from core.interact import interact as io
+from facelib import FaceType
+
+from .MergerConfig import MergerConfigMasked
+
+
+class DFMPredictor():
+    """
+    Predicts faces with .dfm exported by export_dfm() of the model in ONNX Runtime session,
+    so the merger does not load the model and does not import TensorFlow for prediction.
+
+    Provides the part of model interface, which is used by the merger.
+
+    threads_count           intra op threads of the session, None - all cores
+
+    cpu_only                do not use CUDA provider of ONNX Runtime, even if it is available
+
+    use_optimization_cache  graph optimized by ONNX Runtime is saved next to the .dfm on first load
+                            and is loaded instead of optimizing again, while the .dfm is not changed.
+                            Optimized graph is specific to the hardware of the host, which saved it.
+    """
+    output_names = ['out_face_mask:0', 'out_celeb_face:0', 'out_celeb_face_mask:0']
+
+    def __init__(self, dfm_path, threads_count=None, cpu_only=False, use_optimization_cache=False):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise Exception('onnxruntime package is required to predict with .dfm, install onnxruntime or onnxruntime-gpu.')
+
+        self.dfm_path = Path(dfm_path)
+        if not self.dfm_path.exists():
+            raise Exception(f'{self.dfm_path} not found.')
+
+        sess_options = ort.SessionOptions()
+        if threads_count is not None:
+            sess_options.intra_op_num_threads = max(1, threads_count)
+        sess_options.inter_op_num_threads = 1
+        sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        model_path = self.dfm_path
+        if use_optimization_cache:
+            cache_path = self.dfm_path.parent / f'{self.dfm_path.stem}_optimized.onnx'
+            if cache_path.exists() and cache_path.stat().st_mtime >= self.dfm_path.stat().st_mtime:
+                model_path = cache_path
+                sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            else:
+                sess_options.optimized_model_filepath = str(cache_path)
+
+        providers = ['CPUExecutionProvider']
+        if not cpu_only and 'CUDAExecutionProvider' in ort.get_available_providers():
+            providers.insert(0, 'CUDAExecutionProvider')
+
+        io.log_info (f'Loading {model_path.name} with {providers[0]}')
+        self.sess = ort.InferenceSession(str(model_path), sess_options=sess_options, providers=providers)
+        self.run_on_cpu = self.sess.get_providers()[0] == 'CPUExecutionProvider'
+
+        input_names = [ x.name for x in self.sess.get_inputs() ]
+        self.is_morphable = 'morph_value:0' in input_names
+        self.resolution = self.sess.get_inputs()[input_names.index('in_face:0')].shape[1]
+
+        metadata = self.sess.get_modelmeta().custom_metadata_map
+        if 'face_type' in metadata:
+            self.face_type = FaceType.fromString(metadata['face_type'])
+        else:
+            # .dfm exported before face type was saved in it
+            face_types = [ FaceType.toString(x) for x in [FaceType.HALF, FaceType.MID_FULL, FaceType.FULL, FaceType.WHOLE_FACE, FaceType.HEAD] ]
+            self.face_type = FaceType.fromString( io.input_str ("Face type of the .dfm", 'whole_face', face_types) )
+        self.iter = int(metadata.get('iter', 0))
+
+    def predictor_batch_func(self, faces, func_morph_factor=1.0):
+        feed_dict = {'in_face:0' : np.ascontiguousarray(faces, dtype=np.float32)}
+        if self.is_morphable:
+            feed_dict['morph_value:0'] = np.float32([func_morph_factor])
+
+        mask_dst_dstm, bgr, mask_src_dstm = self.sess.run(self.output_names, feed_dict)
+        return bgr, mask_src_dstm[...,0], mask_dst_dstm[...,0]
+
+    def predictor_func(self, face, func_morph_factor=1.0):
+        bgr, mask_src_dstm, mask_dst_dstm = self.predictor_batch_func(face[None,...], func_morph_factor)
+        return bgr[0], mask_src_dstm[0], mask_dst_dstm[0]
+
+    def get_MergerBatchPredictor(self):
+        return self.predictor_batch_func
+
+    def get_MergerConfig(self):
+        return self.predictor_func, (self.resolution, self.resolution, 3), MergerConfigMasked(face_type=self.face_type, default_mode='overlay', is_morphable=self.is_morphable)
+
+    def get_iter(self):
+        return self.iter
+
+    def get_model_name(self):
+        return self.dfm_path.stem
+
+    def get_weights_fingerprint(self):
+        stat = self.dfm_path.stat()
+        return f'{self.dfm_path.name}:{stat.st_size}:{stat.st_mtime_ns}'
+
+    def get_strpath_storage_for_file(self, filename):
+        return str( self.dfm_path.parent / f'{self.dfm_path.stem}_{filename}' )
+
+    def finalize(self):
+        self.sess = None
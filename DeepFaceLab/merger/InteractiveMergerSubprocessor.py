@@ -1,3 +1,4 @@
+import hashlib
 import multiprocessing
 import os
 import pickle
@@ -14,6 +15,7 @@ from core.joblib import Subprocessor
 from merger import MergeFaceAvatar, MergeMasked, MergerConfig
 
 from .MergerScreen import Screen, ScreenManager
+from .OfflineMerger import OfflineMerger
 
 MERGER_DEBUG = False
 class InteractiveMergerSubprocessor(Subprocessor):
@@ -138,6 +140,7 @@ class InteractiveMergerSubprocessor(Subprocessor):
 
 
 
+    SESSION_VERSION = 2
 
     #override
     def __init__(self, is_interactive, merger_session_filepath, predictor_func, predictor_input_shape, face_enhancer_func, xseg_256_extract_func, merger_config, frames, frames_root_path, output_path, output_mask_path, model_iter, subprocess_count=4):
@@ -163,74 +166,64 @@ class InteractiveMergerSubprocessor(Subprocessor):
 
         self.prefetch_frame_count = self.process_count = subprocess_count
 
-        session_data = None
-        if self.is_interactive and self.merger_session_filepath.exists():
-            io.input_skip_pending()
-            if io.input_bool ("Use saved session?", True):
-                try:
-                    with open( str(self.merger_session_filepath), "rb") as f:
-                        session_data = pickle.loads(f.read())
-
-                except Exception as e:
-                    pass
-
         rewind_to_frame_idx = None
         self.frames = frames
         self.frames_idxs = [ *range(len(self.frames)) ]
         self.frames_done_idxs = []
 
-        if self.is_interactive and session_data is not None:
-            # Loaded session data, check it
-            s_frames = session_data.get('frames', None)
-            s_frames_idxs = session_data.get('frames_idxs', None)
-            s_frames_done_idxs = session_data.get('frames_done_idxs', None)
-            s_model_iter = session_data.get('model_iter', None)
-
-            frames_equal = (s_frames is not None) and \
-                           (s_frames_idxs is not None) and \
-                           (s_frames_done_idxs is not None) and \
-                           (s_model_iter is not None) and \
-                           (len(frames) == len(s_frames)) # frames count must match
-
-            if frames_equal:
-                for i in range(len(frames)):
-                    frame = frames[i]
-                    s_frame = s_frames[i]
-                    # frames filenames must match
-                    if frame.frame_info.filepath.name != s_frame.frame_info.filepath.name:
-                        frames_equal = False
-                    if not frames_equal:
-                        break
-
-            if frames_equal:
-                io.log_info ('Using saved session from ' + '/'.join (self.merger_session_filepath.parts[-2:]) )
-
-                for frame in s_frames:
-                    if frame.cfg is not None:
-                        # recreate MergerConfig class using constructor with get_config() as dict params
-                        # so if any new param will be added, old merger session will work properly
-                        frame.cfg = frame.cfg.__class__( **frame.cfg.get_config() )
+        frames_names_hash = hashlib.sha1( '\n'.join( frame.frame_info.filepath.name for frame in frames ).encode('utf-8') ).hexdigest()
+        self.session_header = {'version' : InteractiveMergerSubprocessor.SESSION_VERSION,
+                               'frames_names_hash' : frames_names_hash,
+                               'cfg_type' : merger_config.type,
+                               'cfg' : merger_config.get_config(),
+                               'model_iter' : model_iter }
+        self.session_file = None
 
-                self.frames = s_frames
-                self.frames_idxs = s_frames_idxs
-                self.frames_done_idxs = s_frames_done_idxs
+        session_data = None
+        if self.is_interactive and self.merger_session_filepath.exists():
+            io.input_skip_pending()
+            if io.input_bool ("Use saved session?", True):
+                session_data = self.load_session()
 
-                if self.model_iter != s_model_iter:
-                    # model was more trained, recompute all frames
-                    rewind_to_frame_idx = -1
-                    for frame in self.frames:
-                        frame.is_done = False
-                elif len(self.frames_idxs) == 0:
-                    # all frames are done?
-                    rewind_to_frame_idx = -1
+        if session_data is not None:
+            s_header, s_frames, s_cursor = session_data
 
-                if len(self.frames_idxs) != 0:
-                    cur_frame = self.frames[self.frames_idxs[0]]
-                    cur_frame.is_shown = False
-
-            if not frames_equal:
+            # frames filenames and merger type must match
+            if s_header['frames_names_hash'] != frames_names_hash or \
+               s_header['cfg_type'] != merger_config.type:
                 session_data = None
 
+        if session_data is not None:
+            io.log_info ('Using saved session from ' + '/'.join (self.merger_session_filepath.parts[-2:]) )
+
+            # deltas are applied to the config, which the session was started with
+            self.session_header['cfg'] = s_header['cfg']
+            for idx, (is_done, cfg_delta) in s_frames.items():
+                frame = frames[idx]
+                frame.is_done = is_done
+                if cfg_delta is not None:
+                    # recreate MergerConfig class using constructor with config as dict params
+                    # so if any new param will be added, old merger session will work properly
+                    frame.cfg = merger_config.__class__( **{**s_header['cfg'], **cfg_delta} )
+
+            # frames are merged in order, so done frames are always the first ones
+            self.frames_done_idxs = [ *range(s_cursor) ]
+            self.frames_idxs = [ *range(s_cursor, len(frames)) ]
+
+            if self.model_iter != s_header['model_iter']:
+                # model was more trained, recompute all frames
+                rewind_to_frame_idx = -1
+                for frame in self.frames:
+                    frame.is_done = False
+            elif len(self.frames_idxs) == 0:
+                # all frames are done?
+                rewind_to_frame_idx = -1
+
+        # output images are cleared or rewritten, so keys of OfflineMerger manifest do not match them anymore
+        manifest_path = self.output_path / OfflineMerger.manifest_filename
+        if manifest_path.exists():
+            manifest_path.unlink()
+
         if session_data is None:
             for filename in pathex.get_image_paths(self.output_path): #remove all images in output_path
                 Path(filename).unlink()
@@ -265,6 +258,79 @@ class InteractiveMergerSubprocessor(Subprocessor):
                     self.frames_idxs.insert(0, prev_frame.idx)
                 else:
                     break
+
+        if self.is_interactive:
+            self.save_session()
+
+    def load_session(self):
+        """
+        merger_session.dat is a stream of pickled records, appended during the session:
+            header dict
+            ('frame', idx, is_done, cfg_delta)  cfg_delta is dict of config params different from header['cfg'], None - config is not set
+            ('cfg_reset', start_idx, end_idx)   configs of frames in range are not set
+            ('cursor', done_frames_count)
+
+        returns (header, dict of idx : (is_done, cfg_delta), cursor), None if session is not readable or of another version
+        """
+        frames_records = {}
+        cursor = 0
+        try:
+            with open( str(self.merger_session_filepath), "rb") as f:
+                header = pickle.load(f)
+                if not isinstance(header, dict) or header.get('version', None) != InteractiveMergerSubprocessor.SESSION_VERSION:
+                    io.log_info ("Saved session is of older version and is not used.")
+                    return None
+
+                while True:
+                    try:
+                        record = pickle.load(f)
+                    except:
+                        # end of file or the last record is not completely written
+                        break
+
+                    if record[0] == 'frame':
+                        _, idx, is_done, cfg_delta = record
+                        frames_records[idx] = (is_done, cfg_delta)
+                    elif record[0] == 'cfg_reset':
+                        _, start_idx, end_idx = record
+                        for idx in range(start_idx, end_idx):
+                            if idx in frames_records:
+                                frames_records[idx] = (frames_records[idx][0], None)
+                    elif record[0] == 'cursor':
+                        cursor = record[1]
+        except:
+            io.log_err(f"Unable to read {self.merger_session_filepath} : {traceback.format_exc()}")
+            return None
+
+        return header, frames_records, cursor
+
+    def save_session(self):
+        """
+        rewrites merger_session.dat with current state of frames, following changes are appended by write_session_record()
+        """
+        records = [ self.session_header ]
+        for frame in self.frames:
+            if frame.cfg is not None or frame.is_done:
+                records.append ( ('frame', frame.idx, frame.is_done, self.get_cfg_delta(frame.cfg)) )
+        records.append ( ('cursor', len(self.frames_done_idxs)) )
+
+        pathex.write_bytes_safe ( self.merger_session_filepath, b''.join( pickle.dumps(record, 4) for record in records ) )
+
+    def get_cfg_delta(self, cfg):
+        if cfg is None:
+            return None
+        base_cfg = self.session_header['cfg']
+        return { key : value for key, value in cfg.get_config().items() if key not in base_cfg or base_cfg[key] != value }
+
+    def write_session_record(self, record):
+        if self.session_file is not None:
+            pickle.dump(record, self.session_file, 4)
+            # flushed, so a crash of the merger does not lose the session
+            self.session_file.flush()
+
+    def write_session_frame(self, frame):
+        self.write_session_record ( ('frame', frame.idx, frame.is_done, self.get_cfg_delta(frame.cfg)) )
+
     #override
     def process_info_generator(self):
         r = [0] if MERGER_DEBUG else range(self.process_count)
@@ -298,6 +364,8 @@ class InteractiveMergerSubprocessor(Subprocessor):
             self.screen_manager.set_current (self.help_screen)
             self.screen_manager.show_current()
 
+            self.session_file = open( str(self.merger_session_filepath), "ab")
+
             self.masked_keys_funcs = {
                     '`' : lambda cfg,shift_pressed: cfg.set_mode(0),
                     '1' : lambda cfg,shift_pressed: cfg.set_mode(1),
@@ -347,18 +415,8 @@ class InteractiveMergerSubprocessor(Subprocessor):
         if self.is_interactive:
             self.screen_manager.finalize()
 
-            for frame in self.frames:
-                frame.output_filepath = None
-                frame.output_mask_filepath = None
-                frame.image = None
-
-            session_data = {
-                'frames': self.frames,
-                'frames_idxs': self.frames_idxs,
-                'frames_done_idxs': self.frames_done_idxs,
-                'model_iter' : self.model_iter,
-            }
-            self.merger_session_filepath.write_bytes( pickle.dumps(session_data) )
+            self.session_file.close()
+            self.session_file = None
 
             io.log_info ("Session is saved to " + '/'.join (self.merger_session_filepath.parts[-2:]) )
 
@@ -437,6 +495,7 @@ class InteractiveMergerSubprocessor(Subprocessor):
                                 io.log_info ( cfg.to_string(cur_frame.frame_info.filepath.name) )
                                 cur_frame.is_done = False
                                 cur_frame.is_shown = False
+                                self.write_session_frame(cur_frame)
                     else:
 
                         if chr_key == ',' or chr_key == 'm':
@@ -490,6 +549,7 @@ class InteractiveMergerSubprocessor(Subprocessor):
                             if prev_frame.cfg != cur_frame.cfg:
                                 prev_frame.cfg = cur_frame.cfg.copy()
                                 prev_frame.is_done = False
+                                self.write_session_frame(prev_frame)
 
                         cur_frame = prev_frame
 
@@ -498,6 +558,8 @@ class InteractiveMergerSubprocessor(Subprocessor):
                             continue
                     break
 
+                self.write_session_record ( ('cursor', len(self.frames_done_idxs)) )
+
         elif go_next_frame:
             if cur_frame is not None and cur_frame.is_done:
                 cur_frame.image = None
@@ -521,6 +583,7 @@ class InteractiveMergerSubprocessor(Subprocessor):
 
                         for i in range( next_frame.idx, to_frames ):
                             f[i].cfg = None
+                        self.write_session_record ( ('cfg_reset', next_frame.idx, to_frames) )
 
                     for i in range( min(len(self.frames_idxs), self.prefetch_frame_count) ):
                         frame = f[ self.frames_idxs[i] ]
@@ -532,6 +595,9 @@ class InteractiveMergerSubprocessor(Subprocessor):
 
                             frame.is_done = False #initiate solve again
                             frame.is_shown = False
+                            self.write_session_frame(frame)
+
+                self.write_session_record ( ('cursor', len(self.frames_done_idxs)) )
 
             if len(self.frames_idxs) == 0:
                 self.process_remain_frames = False
@@ -553,6 +619,7 @@ class InteractiveMergerSubprocessor(Subprocessor):
         if frame.cfg == pf_result.cfg:
             frame.is_done = True
             frame.image = pf_result.image
+            self.write_session_frame(frame)
 
     #override
     def get_data(self, host_dict):
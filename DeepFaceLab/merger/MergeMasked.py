@@ -13,14 +13,12 @@ is_windows = sys.platform[0:3] == 'win'
 xseg_input_size = 256
 
 
-def MergeMaskedFace (predictor_func, predictor_input_shape,
-                     face_enhancer_func,
-                     xseg_256_extract_func,
-                     cfg, frame_info, img_bgr_uint8, img_bgr, img_face_landmarks, dfl_img):
-                     
-    img_size = img_bgr.shape[1], img_bgr.shape[0]
-    img_face_mask_a = LandmarksProcessor.get_image_hull_mask (img_bgr.shape, img_face_landmarks)
+def MergeMaskedFaceInput (predictor_input_shape, cfg, img_bgr, img_face_landmarks, dfl_img):
+    """
+    warps the face of the frame to the predictor input
 
+    returns face_mat, face_output_mat, face_mask_output_mat, dst_face_bgr, predictor_input_bgr
+    """
     input_size = predictor_input_shape[0]
     mask_subres_size = input_size*4
     output_size = input_size
@@ -59,22 +57,45 @@ def MergeMaskedFace (predictor_func, predictor_input_shape,
     dst_face_bgr      = cv2.warpAffine( img_bgr        , face_mat, (output_size, output_size), flags=cv2.INTER_CUBIC )
     dst_face_bgr      = np.clip(dst_face_bgr, 0, 1)
 
-    dst_face_mask_a_0 = cv2.warpAffine( img_face_mask_a, face_mat, (output_size, output_size), flags=cv2.INTER_CUBIC )
-    dst_face_mask_a_0 = np.clip(dst_face_mask_a_0, 0, 1)
-    
-    
     if cfg.pre_sharpen_mode > 0 and cfg.pre_sharpen_power != 0:
         if cfg.pre_sharpen_mode==1:
             dst_face_bgr = imagelib.gaussian_sharpen(dst_face_bgr, amount=cfg.pre_sharpen_power)
         elif cfg.pre_sharpen_mode==2:
             dst_face_bgr = imagelib.unsharpen_mask(dst_face_bgr, amount=cfg.pre_sharpen_power)
-        
+
         dst_face_bgr = np.clip(dst_face_bgr, 0, 1, out=dst_face_bgr)
 
     predictor_input_bgr      = cv2.resize (dst_face_bgr, (input_size,input_size) )
 
-    
-    predicted = predictor_func (predictor_input_bgr, func_morph_factor = cfg.morph_power/100.0) if cfg.is_morphable else predictor_func (predictor_input_bgr)
+    return face_mat, face_output_mat, face_mask_output_mat, dst_face_bgr, predictor_input_bgr
+
+
+def MergeMaskedFace (predictor_func, predictor_input_shape,
+                     face_enhancer_func,
+                     xseg_256_extract_func,
+                     cfg, frame_info, img_bgr_uint8, img_bgr, img_face_landmarks, dfl_img, face_input=None, predicted=None):
+    """
+    face_input  result of MergeMaskedFaceInput, computed if None
+    predicted   (bgr, src_mask, dst_mask) of predictor_func for the face input, computed if None
+    """
+    img_size = img_bgr.shape[1], img_bgr.shape[0]
+    img_face_mask_a = LandmarksProcessor.get_image_hull_mask (img_bgr.shape, img_face_landmarks)
+
+    input_size = predictor_input_shape[0]
+    mask_subres_size = input_size*4
+    output_size = input_size
+    if cfg.super_resolution_power != 0:
+        output_size *= 4
+
+    if face_input is None:
+        face_input = MergeMaskedFaceInput (predictor_input_shape, cfg, img_bgr, img_face_landmarks, dfl_img)
+    face_mat, face_output_mat, face_mask_output_mat, dst_face_bgr, predictor_input_bgr = face_input
+
+    dst_face_mask_a_0 = cv2.warpAffine( img_face_mask_a, face_mat, (output_size, output_size), flags=cv2.INTER_CUBIC )
+    dst_face_mask_a_0 = np.clip(dst_face_mask_a_0, 0, 1)
+
+    if predicted is None:
+        predicted = predictor_func (predictor_input_bgr, func_morph_factor = cfg.morph_power/100.0) if cfg.is_morphable else predictor_func (predictor_input_bgr)
 
     
     prd_face_bgr          = np.clip (predicted[0], 0, 1.0)
@@ -379,14 +400,25 @@ def MergeMasked (predictor_func,
                  face_enhancer_func,
                  xseg_256_extract_func,
                  cfg,
-                 frame_info):
-    img_bgr_uint8 = cv2_imread(frame_info.filepath)
-    img_bgr_uint8 = imagelib.normalize_channels (img_bgr_uint8, 3)
+                 frame_info,
+                 img_bgr_uint8=None,
+                 faces_input=None,
+                 faces_predicted=None):
+    """
+    img_bgr_uint8       already decoded frame, read from frame_info.filepath if None
+    faces_input         list of MergeMaskedFaceInput per face, or None
+    faces_predicted     list of predictions per face, or None
+    """
+    if img_bgr_uint8 is None:
+        img_bgr_uint8 = cv2_imread(frame_info.filepath)
+        img_bgr_uint8 = imagelib.normalize_channels (img_bgr_uint8, 3)
     img_bgr = img_bgr_uint8.astype(np.float32) / 255.0
 
     outs = []
     for face_num, img_landmarks in enumerate( frame_info.landmarks_list ):
-        out_img, out_img_merging_mask = MergeMaskedFace (predictor_func, predictor_input_shape, face_enhancer_func, xseg_256_extract_func, cfg, frame_info, img_bgr_uint8, img_bgr, img_landmarks, frame_info.dfl_images_list[face_num])
+        out_img, out_img_merging_mask = MergeMaskedFace (predictor_func, predictor_input_shape, face_enhancer_func, xseg_256_extract_func, cfg, frame_info, img_bgr_uint8, img_bgr, img_landmarks, frame_info.dfl_images_list[face_num],
+                                                         face_input=faces_input[face_num] if faces_input is not None else None,
+                                                         predicted=faces_predicted[face_num] if faces_predicted is not None else None)
         outs += [ (out_img, out_img_merging_mask) ]
 
     #Combining multiple face outputs
@@ -0,0 +1,191 @@
+import hashlib
+import multiprocessing
+import os
+import pickle
+import traceback
+from pathlib import Path
+
+import numpy as np
+
+import samplelib.PackedFaceset
+from core import pathex
+from core.interact import interact as io
+from DFLIMG import DFLIMG, DFLJPG
+from samplelib import Sample
+
+
+def _load_alignments_chunk(entries):
+    """
+    MergerAlignments pool worker.
+    Reads alignments of chunk of (filename, filename_offset_size) entries via fast DFLJPG path
+    and returns them as compact arrays. filename_offset_size is None for unpacked files.
+    """
+    valid_idxs = []
+    source_filenames = []
+    source_landmarks = []
+    shapes = []
+    image_to_face_mats = []
+    errors = []
+
+    for i, (filename, filename_offset_size) in enumerate(entries):
+        loader_func = None
+        if filename_offset_size is not None:
+            sample = Sample(filename=filename)
+            sample.set_filename_offset_size(*filename_offset_size)
+            loader_func = sample.read_raw_file
+
+        dflimg = DFLIMG.load_meta (Path(filename), loader_func=loader_func)
+        if dflimg is None or not dflimg.has_data():
+            errors.append (f"{Path(filename).name} is not a dfl image file")
+            continue
+
+        source_filename = dflimg.get_source_filename()
+        if source_filename is None or dflimg.get_dict().get('source_landmarks', None) is None:
+            continue
+
+        mat = dflimg.get_image_to_face_mat()
+        valid_idxs.append(i)
+        source_filenames.append(source_filename)
+        source_landmarks.append( dflimg.get_source_landmarks() )
+        shapes.append( dflimg.get_shape() )
+        image_to_face_mats.append( mat if mat is not None else np.full( (2,3), np.nan ) )
+
+    n = len(valid_idxs)
+    return ( np.array(valid_idxs, np.int64),
+             source_filenames,
+             np.array(source_landmarks, np.float32).reshape( (n,68,2) ),
+             np.array(shapes, np.int32).reshape( (n,3) ),
+             np.array(image_to_face_mats, np.float64).reshape( (n,2,3) ),
+             errors )
+
+
+class MergerAlignments():
+    """
+    Collects alignments of aligned faceset for the merger.
+
+    Entries are dispatched to multiprocessing.Pool in large chunks, as FaceSamplesLoader does,
+    and the result is cached to cache_path, keyed by fingerprint of the aligned directory,
+    so repeated runs on the same faceset do not read the faces at all.
+
+    run() returns ( filenames,
+                    source_filenames        list,
+                    source_landmarks        np.float32 (N,68,2),
+                    shapes                  np.int32   (N,3),
+                    image_to_face_mats      np.float64 (N,2,3), nan if face has no mat )
+
+    faces without source filename or source landmarks are skipped.
+    """
+    VERSION = 1
+
+    def __init__(self, aligned_path, pak_name=None, cache_path=None, workers_count=None):
+        self.aligned_path = Path(aligned_path)
+        self.pak_name = pak_name
+        self.cache_path = Path(cache_path) if cache_path is not None else None
+
+        if workers_count is None:
+            workers_count = multiprocessing.cpu_count()
+        self.workers_count = max(1, workers_count)
+
+    def get_fingerprint(self):
+        """
+        names, mtimes and sizes of every file of the aligned directory, including packed faceset
+        """
+        entries = []
+        with os.scandir(str(self.aligned_path)) as it:
+            for entry in it:
+                if entry.is_file():
+                    st = entry.stat()
+                    entries.append ( (entry.name, st.st_mtime_ns, st.st_size) )
+        entries.sort()
+        return hashlib.sha1( pickle.dumps( (self.pak_name, entries), 4) ).hexdigest()
+
+    def run(self):
+        fingerprint = self.get_fingerprint()
+
+        if self.cache_path is not None and self.cache_path.exists():
+            try:
+                d = pickle.loads(self.cache_path.read_bytes())
+                if d.get('version', None) == MergerAlignments.VERSION and d.get('fingerprint', None) == fingerprint:
+                    io.log_info ("Using cached alignments.")
+                    return d['alignments']
+            except:
+                io.log_info(f"Unable to read {self.cache_path}, it will be rebuilt.")
+
+        packed_samples = None
+        try:
+            packed_samples = samplelib.PackedFaceset.load(self.aligned_path, pak_name=self.pak_name)
+        except:
+            io.log_err(f"Error occured while loading samplelib.PackedFaceset.load {str(self.aligned_path)}, {traceback.format_exc()}")
+
+        if packed_samples is not None:
+            io.log_info ("Using packed faceset.")
+            entries = [ (sample.filename, sample._filename_offset_size) for sample in packed_samples ]
+        else:
+            entries = [ (filepath, None) for filepath in pathex.get_image_paths(self.aligned_path) ]
+
+        alignments = self.load(entries)
+
+        if self.cache_path is not None:
+            try:
+                pathex.write_bytes_safe ( self.cache_path, pickle.dumps( {'version' : MergerAlignments.VERSION, 'fingerprint' : fingerprint, 'alignments' : alignments }, 4) )
+            except:
+                io.log_err(f"Unable to save {self.cache_path} : {traceback.format_exc()}")
+        return alignments
+
+    def load(self, entries):
+        entries_len = len(entries)
+        #enough chunks to balance the pool, but large enough to amortize the round-trips
+        chunk_size = min(1024, max(16, entries_len // (self.workers_count*4) ))
+        chunks = [ entries[i:i+chunk_size] for i in range(0, entries_len, chunk_size) ]
+
+        results = [None]*len(chunks)
+
+        io.progress_bar ("Collecting alignments", entries_len)
+        if self.workers_count == 1 or len(chunks) <= 1:
+            for chunk_idx, chunk in enumerate(chunks):
+                results[chunk_idx] = _load_alignments_chunk(chunk)
+                io.progress_bar_inc(len(chunk))
+        else:
+            with multiprocessing.Pool( min(self.workers_count, len(chunks)) ) as pool:
+                for chunk_idx, result in pool.imap_unordered(MergerAlignments._process_chunk, enumerate(chunks) ):
+                    results[chunk_idx] = result
+                    io.progress_bar_inc(len(chunks[chunk_idx]))
+        io.progress_bar_close()
+
+        filenames = []
+        source_filenames = []
+        for chunk, result in zip(chunks, results):
+            valid_idxs, chunk_source_filenames, _, _, _, errors = result
+            for err in errors:
+                io.log_err(err)
+            filenames += [ chunk[i][0] for i in valid_idxs ]
+            source_filenames += chunk_source_filenames
+
+        def concat(column_id, empty_shape, dtype):
+            if len(results) == 0:
+                return np.zeros(empty_shape, dtype)
+            return np.concatenate([ result[column_id] for result in results ], 0)
+
+        return ( filenames,
+                 source_filenames,
+                 concat(2, (0,68,2), np.float32),
+                 concat(3, (0,3), np.int32),
+                 concat(4, (0,2,3), np.float64) )
+
+    @staticmethod
+    def get_dfl_image(filename, source_filename, source_landmarks, shape, image_to_face_mat):
+        """
+        returns DFLJPG with only the data used by the merger, as load_meta does
+        """
+        dflimg = DFLJPG(str(filename))
+        dflimg.chunks = None
+        dflimg.shape = tuple(shape.tolist())
+        dflimg.dfl_dict = {'source_filename' : source_filename,
+                           'source_landmarks' : source_landmarks,
+                           'image_to_face_mat' : None if np.isnan(image_to_face_mat).any() else image_to_face_mat }
+        return dflimg
+
+    @staticmethod
+    def _process_chunk(param):
+        chunk_idx, entries = param
+        return chunk_idx, _load_alignments_chunk(entries)
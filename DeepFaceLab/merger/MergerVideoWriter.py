@@ -0,0 +1,144 @@
+import threading
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from core import pathex
+from core.interact import interact as io
+
+
+class MergerVideoWriter():
+    """
+    Encodes merged frames straight to video file by piping raw frames to ffmpeg,
+    so no image sequence is written to disk.
+    Mask is encoded by another ffmpeg to separate grayscale video, if output_mask_file is specified.
+
+    Frames are put with their index from any thread in any order,
+    and are held in bounded reorder buffer until all previous frames are written.
+
+    Audio and fps are taken from reference_file, if specified.
+    """
+    def __init__(self, output_file, output_mask_file=None, reference_file=None, fps=None, bitrate=16, lossless=False, buffer_size=32):
+        self.output_file_path = Path(output_file)
+        self.output_mask_file_path = Path(output_mask_file) if output_mask_file is not None else None
+        self.bitrate = bitrate
+        self.lossless = lossless
+        self.buffer_size = max(1, buffer_size)
+
+        self.reference_file_path = None
+        self.audio_id = None
+        if reference_file is not None:
+            reference_file_path = Path(reference_file)
+            if reference_file_path.suffix == '.*':
+                reference_file_path = pathex.get_first_file_by_stem (reference_file_path.parent, reference_file_path.stem)
+            elif not reference_file_path.exists():
+                reference_file_path = None
+
+            if reference_file_path is None:
+                raise Exception(f"reference_file {reference_file} not found.")
+
+            import ffmpeg
+            probe = ffmpeg.probe (str(reference_file_path))
+
+            #getting first video and audio streams id with fps
+            video_found = False
+            for stream in probe['streams']:
+                if not video_found and stream['codec_type'] == 'video':
+                    video_found = True
+                    fps = stream['r_frame_rate']
+
+                if self.audio_id is None and stream['codec_type'] == 'audio':
+                    self.audio_id = stream['index']
+            self.reference_file_path = reference_file_path
+
+        if fps is None:
+            raise ValueError("fps should be specified, if there is no reference_file.")
+        self.fps = fps
+
+        for path in [self.output_file_path, self.output_mask_file_path]:
+            if path is not None:
+                path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.size = None
+        self.jobs = []
+        self.procs = []
+        self.next_idx = 0
+        self.buffer = {}
+        self.cond = threading.Condition()
+
+    def run_ffmpeg(self, output_file_path, pix_fmt, include_audio):
+        import ffmpeg
+        w, h = self.size
+        output_args = [ ffmpeg.input('pipe:', format='rawvideo', pix_fmt=pix_fmt, s=f'{w}x{h}', r=self.fps) ]
+
+        if include_audio and self.audio_id is not None:
+            output_args += [ ffmpeg.input (str(self.reference_file_path))[str(self.audio_id)] ]
+
+        output_args += [str (output_file_path)]
+
+        output_kwargs = {"c:v": "libx264",
+                         "pix_fmt": "yuv420p",
+                        }
+        if self.lossless:
+            output_kwargs.update ({"crf": "0"})
+        else:
+            output_kwargs.update ({"b:v": "%dM" %(self.bitrate)})
+
+        if include_audio and self.audio_id is not None:
+            output_kwargs.update ({"c:a": "aac",
+                                   "b:a": "192k",
+                                   "ar" : "48000",
+                                   "strict": "experimental"
+                                   })
+
+        job = ffmpeg.output(*output_args, **output_kwargs).overwrite_output()
+        self.jobs.append(job)
+        self.procs.append( job.run_async(pipe_stdin=True) )
+
+    def write(self, img):
+        """
+        img     uint8 (h,w,4) merged frame with mask in last channel
+        """
+        h, w = img.shape[:2]
+        if self.size is None:
+            # encoders are started with the size of the first frame
+            self.size = (w, h)
+            self.run_ffmpeg(self.output_file_path, 'bgr24', include_audio=True)
+            if self.output_mask_file_path is not None:
+                self.run_ffmpeg(self.output_mask_file_path, 'gray', include_audio=False)
+        elif self.size != (w, h):
+            img = cv2.resize(img, self.size, interpolation=cv2.INTER_CUBIC)
+
+        try:
+            self.procs[0].stdin.write( np.ascontiguousarray(img[...,0:3]).tobytes() )
+            if self.output_mask_file_path is not None:
+                self.procs[1].stdin.write( np.ascontiguousarray(img[...,3]).tobytes() )
+        except:
+            raise Exception ("ffmpeg fail, job commandline:" + ' '.join( str(job.compile()) for job in self.jobs ) )
+
+    def put(self, idx, img):
+        """
+        puts frame idx, blocks while idx is out of the reorder buffer
+        """
+        with self.cond:
+            while idx - self.next_idx >= self.buffer_size:
+                self.cond.wait()
+
+            self.buffer[idx] = img
+            while self.next_idx in self.buffer:
+                self.write( self.buffer.pop(self.next_idx) )
+                self.next_idx += 1
+            self.cond.notify_all()
+
+    def close(self):
+        if len(self.buffer) != 0:
+            io.log_err (f"{len(self.buffer)} frames after frame {self.next_idx} are not written, because frame {self.next_idx} is missing.")
+            self.buffer = {}
+
+        for proc, job in zip(self.procs, self.jobs):
+            proc.stdin.close()
+            if proc.wait() != 0:
+                io.log_err ("ffmpeg fail, job commandline:" + str(job.compile()) )
+        self.procs = []
+        self.jobs = []
@@ -0,0 +1,355 @@
+import hashlib
+import json
+import multiprocessing
+import threading
+import time
+import traceback
+from pathlib import Path
+
+import numpy as np
+
+from core import imagelib, pathex
+from core.cv2ex import *
+from core.interact import interact as io
+from core.joblib import ThreadPoolMap
+
+from .MergeMasked import MergeMasked, MergeMaskedFaceInput
+from .MergerConfig import MergerConfig
+
+
+class OfflineMerger():
+    """
+    Non-interactive merge engine, graph of bounded stages running in the host process:
+
+        decode (threads) -> predict (batched, one thread) -> composite (threads) -> write (threads)
+
+    Every stage keeps limited number of frames in flight, so memory does not grow with sequence length,
+    and frames leave every stage in order.
+
+    Done frames are appended to manifest in output_path with the key of their content:
+    source frame fingerprint, landmarks, motion blur, merger config and model weights fingerprint.
+    Frames with unchanged key are not merged again, so interrupted or repeated merge
+    processes only the frames, which are affected by the changes. force merges all frames.
+    Output images and manifest lines of frames, which are not in frames anymore, are removed.
+
+    If video_writer is specified, frames are encoded by MergerVideoWriter instead of writing images,
+    all frames are merged then.
+
+    Ensemble members are merged in the same pass: frames are decoded once,
+    faces are warped once for members with the same predictor input,
+    and every member predicts, composites and writes to own output with own merger config.
+    """
+    manifest_filename = 'merger_manifest.txt'
+
+    class Member(object):
+        """
+        model merged by OfflineMerger, arguments are the same as of OfflineMerger
+        """
+        def __init__(self, predictor_func, predictor_input_shape, merger_config, output_path, output_mask_path, model_fingerprint,
+                           predictor_batch_func=None, video_writer=None):
+            if merger_config.type != MergerConfig.TYPE_MASKED:
+                raise ValueError("OfflineMerger supports only masked merger config.")
+
+            self.predictor_func = predictor_func
+            self.predictor_input_shape = predictor_input_shape
+            self.predictor_batch_func = predictor_batch_func
+            self.cfg = merger_config.copy()
+            self.output_path = Path(output_path)
+            self.output_mask_path = Path(output_mask_path)
+            self.model_fingerprint = model_fingerprint
+            self.video_writer = video_writer
+
+        def get_input_key(self):
+            """
+            members with the same key share the faces warped by MergeMaskedFaceInput
+            """
+            cfg = self.cfg
+            return (tuple(self.predictor_input_shape), cfg.face_type, cfg.super_resolution_power != 0, cfg.output_face_scale, cfg.pre_sharpen_mode, cfg.pre_sharpen_power)
+
+    class Job(object):
+        def __init__(self, idx=None, frame_info=None, member_keys=None):
+            self.idx = idx
+            self.frame_info = frame_info
+            # member idx : manifest key of the frame, for members, which merge the frame
+            self.member_keys = member_keys
+            self.img_bgr_uint8 = None
+            # input key : list of MergeMaskedFaceInput per face
+            self.faces_input = None
+            # member idx : list of predictions per face
+            self.faces_predicted = {}
+            # member idx : merged frame
+            self.final_imgs = {}
+
+    def __init__(self, predictor_func, predictor_input_shape, face_enhancer_func, xseg_256_extract_func, merger_config, frames, output_path, output_mask_path, model_fingerprint,
+                       predictor_batch_func=None, batch_size=8, threads_count=None, video_writer=None, ensemble=None, force=False):
+        """
+        model_fingerprint       str, which changes with the weights of the model
+
+        predictor_batch_func    func(faces, **kwargs) -> (bgr, src_mask, dst_mask) batches,
+                                if None, faces of batch are predicted one by one with predictor_func
+
+        threads_count           threads of composite stage, decode and write stages use half of it
+
+        video_writer            MergerVideoWriter, closed at the end of run()
+
+        ensemble                list of OfflineMerger.Member, which are merged along with the model
+
+        force                   merge all frames, even if they are done with the same key
+        """
+        if threads_count is None:
+            threads_count = multiprocessing.cpu_count()
+
+        self.members = [ OfflineMerger.Member(predictor_func, predictor_input_shape, merger_config, output_path, output_mask_path, model_fingerprint,
+                                              predictor_batch_func=predictor_batch_func, video_writer=video_writer) ]
+        if ensemble is not None:
+            self.members += ensemble
+        self.input_keys = [ member.get_input_key() for member in self.members ]
+
+        self.face_enhancer_func = face_enhancer_func
+        self.xseg_256_extract_func = xseg_256_extract_func
+        self.frames = frames
+        self.batch_size = max(1, batch_size)
+        self.threads_count = max(1, threads_count)
+        self.force = force
+
+        # stage name : [items count, busy seconds]
+        self.stats = { name : [0, 0.0] for name in ['decode', 'predict', 'composite', 'write'] }
+        self.stats_lock = threading.Lock()
+
+    def timed(self, name, func):
+        def wrapper(*args, **kwargs):
+            t = time.time()
+            result = func(*args, **kwargs)
+            with self.stats_lock:
+                stat = self.stats[name]
+                stat[0] += len(result) if isinstance(result, list) else 1
+                stat[1] += time.time() - t
+            return result
+        return wrapper
+
+    @staticmethod
+    def get_source_fingerprint(filepath):
+        stat = filepath.stat()
+        return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+    def get_frame_key(self, member_header, source_fingerprint, frame_info):
+        """
+        returns hash of everything, which the merged frame depends on
+        """
+        h = hashlib.sha1(member_header)
+        h.update(source_fingerprint.encode('utf-8'))
+        for landmarks in frame_info.landmarks_list:
+            h.update(np.ascontiguousarray(landmarks, dtype=np.float32).tobytes())
+        # motion blur depends on landmarks of the neighbouring frames
+        h.update(f'{frame_info.motion_power}:{frame_info.motion_deg}'.encode('utf-8'))
+        return h.hexdigest()
+
+    def load_manifest(self, member, stems):
+        """
+        returns dict of done frame stem : key of the member,
+        manifest is rewritten without stale, incomplete lines and lines of frames not in stems
+        """
+        manifest_path = member.output_path / OfflineMerger.manifest_filename
+
+        done_keys = {}
+        if manifest_path.exists():
+            try:
+                # last item is empty or not completely written line, lines of older format have no key
+                for line in manifest_path.read_text(encoding='utf-8').split('\n')[:-1]:
+                    line = line.split('\t')
+                    if len(line) == 2 and line[0] in stems:
+                        done_keys[line[0]] = line[1]
+            except:
+                io.log_err(f"Unable to read {manifest_path} : {traceback.format_exc()}")
+
+        # frames can be repeatedly merged, only the last key is kept
+        manifest_path.write_text(''.join(f'{stem}\t{key}\n' for stem, key in done_keys.items()), encoding='utf-8')
+        return done_keys
+
+    def remove_stale_outputs(self, member, stems):
+        """
+        removes output images of the member, which are not of frames in stems,
+        so they are not encoded to the video along with the merged frames
+        """
+        removed_count = 0
+        for dir_path in [member.output_path, member.output_mask_path]:
+            for filename in pathex.get_image_paths(dir_path):
+                filepath = Path(filename)
+                if filepath.stem not in stems:
+                    filepath.unlink()
+                    removed_count += 1
+
+        if removed_count != 0:
+            io.log_info (f"Removed {removed_count} output images of frames, which are not merged anymore.")
+
+    def decode(self, job):
+        img_bgr_uint8 = imagelib.normalize_channels( cv2_imread(job.frame_info.filepath), 3)
+        job.img_bgr_uint8 = img_bgr_uint8
+
+        landmarks_list = job.frame_info.landmarks_list
+        if len(landmarks_list) != 0:
+            img_bgr = img_bgr_uint8.astype(np.float32) / 255.0
+            job.faces_input = {}
+            for member_idx in job.member_keys:
+                member, key = self.members[member_idx], self.input_keys[member_idx]
+                if key not in job.faces_input:
+                    job.faces_input[key] = [ MergeMaskedFaceInput(member.predictor_input_shape, member.cfg, img_bgr, landmarks, dfl_img)
+                                             for landmarks, dfl_img in zip(landmarks_list, job.frame_info.dfl_images_list) ]
+        return job
+
+    def get_batches(self, jobs):
+        """
+        groups jobs by batch_size faces, batch has no more than batch_size frames,
+        so frames without faces do not pile up in it
+        """
+        batch = []
+        faces_count = 0
+        for job in jobs:
+            batch.append(job)
+            faces_count += len(job.frame_info.landmarks_list)
+            if faces_count >= self.batch_size or len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+                faces_count = 0
+        if len(batch) != 0:
+            yield batch
+
+    def predict(self, batch):
+        for member_idx, member in enumerate(self.members):
+            key = self.input_keys[member_idx]
+            member_jobs = [ job for job in batch if job.faces_input is not None and member_idx in job.member_keys ]
+            if len(member_jobs) == 0:
+                continue
+
+            cfg = member.cfg
+            kwargs = {'func_morph_factor' : cfg.morph_power/100.0} if cfg.is_morphable else {}
+
+            faces = np.stack([ face_input[4] for job in member_jobs for face_input in job.faces_input[key] ])
+            if member.predictor_batch_func is not None:
+                outs = [ member.predictor_batch_func(faces[i:i+self.batch_size], **kwargs) for i in range(0, len(faces), self.batch_size) ]
+                predicted = [ np.concatenate(x, 0) for x in zip(*outs) ]
+            else:
+                predicted = [ np.stack(x) for x in zip(*[ member.predictor_func(face, **kwargs) for face in faces ]) ]
+
+            i = 0
+            for job in member_jobs:
+                n = len(job.faces_input[key])
+                job.faces_predicted[member_idx] = [ [ x[j] for x in predicted ] for j in range(i, i+n) ]
+                i += n
+        return batch
+
+    def composite_member(self, job, member_idx):
+        member = self.members[member_idx]
+        frame_info = job.frame_info
+        if len(frame_info.landmarks_list) == 0:
+            if member.cfg.mode == 'raw-predict':
+                h,w,c = member.predictor_input_shape
+                img_bgr = np.zeros( (h,w,3), dtype=np.uint8)
+                img_mask = np.zeros( (h,w,1), dtype=np.uint8)
+            else:
+                img_bgr = job.img_bgr_uint8
+                h,w,c = img_bgr.shape
+                img_mask = np.zeros( (h,w,1), dtype=img_bgr.dtype)
+            return np.concatenate ([img_bgr, img_mask], axis=-1)
+
+        try:
+            return MergeMasked (member.predictor_func, member.predictor_input_shape,
+                                face_enhancer_func=self.face_enhancer_func,
+                                xseg_256_extract_func=self.xseg_256_extract_func,
+                                cfg=member.cfg,
+                                frame_info=frame_info,
+                                img_bgr_uint8=job.img_bgr_uint8,
+                                faces_input=job.faces_input[self.input_keys[member_idx]],
+                                faces_predicted=job.faces_predicted[member_idx])
+        except Exception as e:
+            raise Exception( f'Error while merging file [{frame_info.filepath}]: {traceback.format_exc()}' )
+
+    def composite(self, job):
+        for member_idx in job.member_keys:
+            job.final_imgs[member_idx] = self.composite_member(job, member_idx)
+
+        job.img_bgr_uint8 = job.faces_input = job.faces_predicted = None
+        return job
+
+    def write(self, job):
+        filename = job.frame_info.filepath.stem + '.png'
+        for member_idx in job.member_keys:
+            member, final_img = self.members[member_idx], job.final_imgs[member_idx]
+            if member.video_writer is not None:
+                member.video_writer.put(job.idx, final_img)
+            else:
+                cv2_imwrite (member.output_path      / filename, final_img[...,0:3] )
+                cv2_imwrite (member.output_mask_path / filename, final_img[...,3:4] )
+        job.final_imgs = None
+        return job
+
+    def run(self):
+        try:
+            self.run_stages()
+        finally:
+            for member in self.members:
+                if member.video_writer is not None:
+                    member.video_writer.close()
+
+    def run_stages(self):
+        stems = set( frame.frame_info.filepath.stem for frame in self.frames )
+        done_keys = []
+        for member in self.members:
+            if member.video_writer is None:
+                self.remove_stale_outputs(member, stems)
+                done_keys.append ( self.load_manifest(member, stems) )
+            else:
+                done_keys.append ( {} )
+
+        member_headers = [ json.dumps( {'model' : member.model_fingerprint, 'cfg' : member.cfg.get_config() }, sort_keys=True, default=str ).encode('utf-8')
+                           for member in self.members ]
+
+        jobs = []
+        for frame in self.frames:
+            frame_info = frame.frame_info
+            stem = frame_info.filepath.stem
+            source_fingerprint = OfflineMerger.get_source_fingerprint(frame_info.filepath)
+
+            member_keys = {}
+            for member_idx, member in enumerate(self.members):
+                key = self.get_frame_key(member_headers[member_idx], source_fingerprint, frame_info)
+                if not self.force and member.video_writer is None and done_keys[member_idx].get(stem, None) == key and \
+                   (member.output_path / f'{stem}.png').exists() and (member.output_mask_path / f'{stem}.png').exists():
+                    continue
+                member_keys[member_idx] = key
+
+            if len(member_keys) != 0:
+                jobs.append( OfflineMerger.Job(len(jobs), frame_info, member_keys) )
+
+        if len(jobs) != len(self.frames):
+            io.log_info (f"{len(self.frames)-len(jobs)} frames are unchanged since the last merge, skipping them.")
+
+        io_threads_count = max(1, self.threads_count // 2)
+
+        decoded    = ThreadPoolMap(self.timed('decode', self.decode), io_threads_count)(jobs)
+        predicted  = ThreadPoolMap(self.timed('predict', self.predict), 1, prefetch=2)( self.get_batches(decoded) )
+        composited = ThreadPoolMap(self.timed('composite', self.composite), self.threads_count)( job for batch in predicted for job in batch )
+        written    = ThreadPoolMap(self.timed('write', self.write), io_threads_count)(composited)
+
+        t = time.time()
+        files = [ open(member.output_path / OfflineMerger.manifest_filename, 'a', encoding='utf-8') if member.video_writer is None else None for member in self.members ]
+        io.progress_bar ("Merging", len(self.frames), initial=len(self.frames)-len(jobs) )
+        try:
+            for job in written:
+                for member_idx, key in job.member_keys.items():
+                    f = files[member_idx]
+                    if f is not None:
+                        f.write(f'{job.frame_info.filepath.stem}\t{key}\n')
+                        f.flush()
+                io.progress_bar_inc(1)
+        finally:
+            io.progress_bar_close()
+            for f in files:
+                if f is not None:
+                    f.close()
+        t = time.time() - t
+
+        if len(jobs) != 0:
+            io.log_info (f"Merged {len(jobs)} frames in {t:.1f}s, {len(jobs)/max(t,1e-6):.2f} frames/s")
+            for name, (count, busy_time) in self.stats.items():
+                io.log_info (f"{name:>10}: {count} items, busy {busy_time:.1f}s, {count/max(busy_time,1e-6):.2f} items/s per thread")
@@ -2,4 +2,8 @@ from .FrameInfo import FrameInfo
 from .MergerConfig import MergerConfig, MergerConfigMasked, MergerConfigFaceAvatar
 from .MergeMasked import MergeMasked
 from .MergeAvatar import MergeFaceAvatar
-from .InteractiveMergerSubprocessor import InteractiveMergerSubprocessor
\ No newline at end of file
+from .InteractiveMergerSubprocessor import InteractiveMergerSubprocessor
+from .MergerVideoWriter import MergerVideoWriter
+from .OfflineMerger import OfflineMerger
+from .DFMPredictor import DFMPredictor
+from .MergerAlignments import MergerAlignments
@@ -0,0 +1,243 @@
+import traceback
+from pathlib import Path
+
+import numpy as np
+
+from core import pathex
+from core.interact import interact as io
+
+
+class LossHistory():
+    """
+    Per-iteration losses stored in growable float32 array of shape (N, losses_count).
+
+    Keeps min/max pyramids with block sizes 2,4,8...  and running sum,
+    so preview columns and windowed means are computed in O(width) and O(1) regardless of N.
+
+    Persisted as raw side file:
+        int64 VERSION, int64 losses_count, float32 (N,losses_count) rows
+
+    Rows are only appended on save, if the file is in sync with the history.
+    """
+    VERSION = 1
+    header_size = 16
+    levels_count = 24
+
+    def __init__(self, losses_count=0):
+        self.losses_count = losses_count
+        self.count = 0
+        self.saved_count = 0
+        self._alloc(0)
+
+    def _alloc(self, capacity):
+        self.capacity = capacity
+        self.data = np.zeros( (capacity, self.losses_count), np.float32)
+        self.cumsum = np.zeros( (capacity+1, self.losses_count), np.float64)
+        # level 0 is data itself, level k is min/max of blocks of 2**k rows
+        self.mins = [self.data] + [ np.zeros( (capacity >> k, self.losses_count), np.float32) for k in range(1, self.levels_count) ]
+        self.maxs = [self.data] + [ np.zeros( (capacity >> k, self.losses_count), np.float32) for k in range(1, self.levels_count) ]
+
+    def _grow(self, capacity):
+        """
+        reallocates instead of resizing in place, so snapshots returned by copy() stay valid
+        """
+        data, cumsum, mins, maxs = self.data, self.cumsum, self.mins, self.maxs
+        self._alloc(capacity)
+        n = self.count
+        self.data[:n] = data[:n]
+        self.cumsum[:n+1] = cumsum[:n+1]
+        for k in range(1, self.levels_count):
+            self.mins[k][:n >> k] = mins[k][:n >> k]
+            self.maxs[k][:n >> k] = maxs[k][:n >> k]
+
+    def _build_levels(self, start=0):
+        """
+        builds the blocks of the levels, which cover rows from start
+        """
+        n = self.count
+        for k in range(1, self.levels_count):
+            b0, b1 = start >> k, n >> k
+            self.mins[k][b0:b1] = self.mins[k-1][b0*2:b1*2].reshape( (b1-b0, 2, self.losses_count) ).min(1)
+            self.maxs[k][b0:b1] = self.maxs[k-1][b0*2:b1*2].reshape( (b1-b0, 2, self.losses_count) ).max(1)
+
+    @staticmethod
+    def from_array(ar):
+        """
+        creates LossHistory from list of lists or (N,losses_count) array
+        """
+        ar = np.array(ar, np.float32)
+        if ar.size == 0:
+            return LossHistory()
+        if ar.ndim == 1:
+            ar = ar[:,None]
+
+        lh = LossHistory(ar.shape[1])
+        lh._alloc(ar.shape[0])
+        lh.extend(ar)
+        return lh
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, key):
+        return self.data[:self.count][key]
+
+    def get_array(self):
+        return self.data[:self.count]
+
+    def append(self, losses):
+        losses = np.array(losses, np.float32).reshape( (-1,) )
+        if self.count == 0 and self.losses_count != len(losses):
+            self.losses_count = len(losses)
+            self._alloc(0)
+
+        if self.count == self.capacity:
+            self._grow( max(1024, self.capacity*2) )
+
+        i = self.count
+        self.data[i] = losses
+        self.cumsum[i+1] = self.cumsum[i] + losses
+        self.count = n = i+1
+
+        for k in range(1, self.levels_count):
+            if n % (1 << k) != 0:
+                break
+            b = (n >> k) - 1
+            self.mins[k][b] = np.minimum(self.mins[k-1][b*2], self.mins[k-1][b*2+1])
+            self.maxs[k][b] = np.maximum(self.maxs[k-1][b*2], self.maxs[k-1][b*2+1])
+
+    def extend(self, rows):
+        """
+        appends (N,losses_count) rows at once
+        """
+        rows = np.array(rows, np.float32)
+        if rows.size == 0:
+            return
+        rows = rows.reshape( (len(rows), -1) )
+        if self.count == 0 and self.losses_count != rows.shape[1]:
+            self.losses_count = rows.shape[1]
+            self._alloc(0)
+
+        start = self.count
+        n = start + len(rows)
+        if n > self.capacity:
+            self._grow( max(1024, self.capacity*2, n) )
+
+        self.data[start:n] = rows
+        np.cumsum(rows, axis=0, dtype=np.float64, out=self.cumsum[start+1:n+1])
+        self.cumsum[start+1:n+1] += self.cumsum[start]
+        self.count = n
+        self._build_levels(start)
+
+    def truncate(self, count):
+        if count < self.count:
+            # new arrays, because snapshots may still refer to the rows being dropped
+            self.count = count
+            self._grow(self.capacity)
+            self.saved_count = min(self.saved_count, count)
+
+    def copy(self):
+        """
+        returns cheap read-only snapshot, sharing the arrays with this history
+        """
+        lh = LossHistory.__new__(LossHistory)
+        lh.__dict__.update(self.__dict__)
+        lh.mins = list(self.mins)
+        lh.maxs = list(self.maxs)
+        return lh
+
+    def _range(self, start, end):
+        if start is None:
+            start = 0
+        if end is None:
+            end = self.count
+        if start < 0:
+            start = max(0, self.count+start)
+        end = min(end, self.count)
+        return start, max(start, end)
+
+    def get_mean(self, start=None, end=None):
+        """
+        returns mean of losses in [start,end) as (losses_count,) array
+        """
+        start, end = self._range(start, end)
+        if start == end:
+            return np.zeros( (self.losses_count,), np.float32)
+        return ( (self.cumsum[end] - self.cumsum[start]) / (end-start) ).astype(np.float32)
+
+    def get_min_max(self, w, start=None, end=None):
+        """
+        splits [start,end) into w columns and returns
+        min, max of every column as (w,losses_count) arrays
+
+        column bounds are snapped to the blocks of the pyramid level, which is not larger than the column
+        """
+        start, end = self._range(start, end)
+        count = end-start
+        if count == 0:
+            return np.zeros( (w,self.losses_count), np.float32), np.zeros( (w,self.losses_count), np.float32)
+
+        per_col = count / w
+        k = min( int(np.log2(per_col)) if per_col >= 2 else 0, self.levels_count-1 )
+
+        blocks = self.count >> k
+        level_min, level_max = self.mins[k][:blocks], self.maxs[k][:blocks]
+        if self.count % (1 << k) != 0:
+            # partial block at the end
+            tail = self.data[blocks << k:self.count]
+            level_min = np.concatenate( [level_min, tail.min(0, keepdims=True)], 0)
+            level_max = np.concatenate( [level_max, tail.max(0, keepdims=True)], 0)
+
+        cols = np.arange(w+1)
+        col_starts = (start + (cols[:-1]*per_col).astype(np.int64)) >> k
+        col_end = min( max( (start + int(w*per_col) + (1 << k) - 1) >> k, col_starts[-1]+1 ), len(level_min) )
+
+        b0 = col_starts[0]
+        mins = np.minimum.reduceat(level_min[b0:col_end], col_starts-b0, axis=0)
+        maxs = np.maximum.reduceat(level_max[b0:col_end], col_starts-b0, axis=0)
+        return mins, maxs
+
+    # pickled as plain rows, levels are rebuilt on load
+    def __getstate__(self):
+        return {'losses_count' : self.losses_count, 'data' : self.get_array() }
+
+    def __setstate__(self, d):
+        lh = LossHistory.from_array(d['data'])
+        self.__dict__.update(lh.__dict__)
+        self.losses_count = d['losses_count']
+
+    @staticmethod
+    def load(filepath):
+        """
+        returns LossHistory, empty one if file does not exist or is corrupted
+        """
+        filepath = Path(filepath)
+        if not filepath.exists():
+            return LossHistory()
+        try:
+            b = filepath.read_bytes()
+            version, losses_count = np.frombuffer(b, np.int64, 2)
+            if version != LossHistory.VERSION:
+                raise Exception(f'unsupported version {version}')
+            row_size = int(losses_count)*4
+            n = (len(b)-LossHistory.header_size) // row_size if row_size != 0 else 0
+            ar = np.frombuffer(b, np.float32, n*int(losses_count), LossHistory.header_size).reshape( (n, int(losses_count)) )
+            lh = LossHistory.from_array(ar)
+            lh.losses_count = int(losses_count)
+            lh.saved_count = lh.count
+            return lh
+        except:
+            io.log_err(f"Unable to read {filepath}, loss history is reset : {traceback.format_exc()}")
+            return LossHistory()
+
+    def save(self, filepath):
+        filepath = Path(filepath)
+        row_size = self.losses_count*4
+
+        if self.saved_count != 0 and filepath.exists() and filepath.stat().st_size == self.header_size + self.saved_count*row_size:
+            with open(filepath, 'ab') as f:
+                f.write( self.data[self.saved_count:self.count].tobytes() )
+        else:
+            header = np.array([LossHistory.VERSION, self.losses_count], np.int64)
+            pathex.write_bytes_safe(filepath, header.tobytes() + self.data[:self.count].tobytes() )
+        self.saved_count = self.count
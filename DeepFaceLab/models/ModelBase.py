@@ -1,12 +1,16 @@
+import collections
 import colorsys
 import inspect
 import multiprocessing
 import operator
 import os
 import pickle
+import queue
 import shutil
+import threading
 import time
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import yaml
 from jsonschema import validate, ValidationError
@@ -17,7 +21,9 @@ from core import imagelib, pathex
 from core.cv2ex import *
 from core.interact import interact as io
 from core.leras import nn
+from facelib import FaceType
 from samplelib import SampleGeneratorBase
+from .LossHistory import LossHistory
 
 
 class ModelBase(object):
@@ -148,9 +154,10 @@ class ModelBase(object):
         self.options = {}
         self.formatted_dictionary = {}
         self.options_show_override = {}
-        self.loss_history = []
+        self.loss_history = LossHistory()
         self.sample_for_preview = None
         self.choosed_gpu_indexes = None
+        self.input_staging = None
 
         model_data = {}
         # True if yaml conf file exists 
@@ -190,6 +197,7 @@ class ModelBase(object):
                     self.config_file_exists = True
 
         self.model_data_path = Path( self.get_strpath_storage_for_file('data.dat') )
+        self.loss_history_path = Path( self.get_strpath_storage_for_file('loss_history.dat') )
         if self.model_data_path.exists():
             io.log_info (f"Loading {self.model_name} model...")
             model_data = pickle.loads ( self.model_data_path.read_bytes() )
@@ -198,9 +206,18 @@ class ModelBase(object):
                 # read options from the .dat file only if the user chooses not to read options from the yaml file
                 if not self.config_file_exists:
                     self.options = model_data['options']
-                self.loss_history = model_data.get('loss_history', [])
-                self.sample_for_preview = model_data.get('sample_for_preview', None)
+                # loss history and preview are used only in training
+                if self.is_training:
+                    if 'loss_history' in model_data:
+                        # migrate list of lists of the older data.dat
+                        self.loss_history = LossHistory.from_array(model_data['loss_history'])
+                    else:
+                        self.loss_history = LossHistory.load(self.loss_history_path)
+                    self.loss_history.truncate(self.iter)
+                    self.sample_for_preview = model_data.get('sample_for_preview', None)
                 self.choosed_gpu_indexes = model_data.get('choosed_gpu_indexes', None)
+            # not held while the weights are loaded
+            model_data = None
 
         if self.is_first_run():
             io.log_info ("\nModel first run.")
@@ -216,15 +233,15 @@ class ModelBase(object):
                         self.set_iter(0)
 
         if silent_start:
-            if force_gpu_idxs is not None:
-                self.device_config = nn.DeviceConfig.GPUIndexes(force_gpu_idxs) if not cpu_only else nn.DeviceConfig.CPU()
-                io.log_info (f"Silent start: choosed device{'s' if len(force_gpu_idxs) > 0 else ''} {'CPU' if self.device_config.cpu_only else [device.name for device in self.device_config.devices]}")
+            if force_gpu_idxs is not None or cpu_only:
+                self.device_config = nn.DeviceConfig.GPUIndexes(force_gpu_idxs) if not cpu_only else nn.DeviceConfig.CPU(cpu_only)
+                io.log_info (f"Silent start: choosed device{'s' if len(self.device_config.devices) > 1 else ''} {'CPU' if self.device_config.cpu_only else [device.name for device in self.device_config.devices]}")
             else:
                 self.device_config = nn.DeviceConfig.BestGPU()
                 io.log_info (f"Silent start: choosed device {'CPU' if self.device_config.cpu_only else self.device_config.devices[0].name}")
         else:
             self.device_config = nn.DeviceConfig.GPUIndexes( force_gpu_idxs or nn.ask_choose_device_idxs(suggest_best_multi_gpu=True)) \
-                                if not cpu_only else nn.DeviceConfig.CPU()
+                                if not cpu_only else nn.DeviceConfig.CPU(cpu_only)
 
         nn.initialize(self.device_config)
 
@@ -454,6 +471,14 @@ class ModelBase(object):
     def get_model_name(self):
         return self.model_name
 
+    def get_weights_fingerprint(self):
+        """
+        returns str, which changes when the weights of the model are saved
+        """
+        stats = [ Path(self.get_strpath_storage_for_file(filename)).stat() for _, filename in self.get_model_filename_list()
+                  if Path(self.get_strpath_storage_for_file(filename)).exists() ]
+        return f'{self.model_name}:{self.iter}:' + ','.join(f'{stat.st_size}:{stat.st_mtime_ns}' for stat in stats)
+
     #overridable , return [ [model, filename],... ]  list
     def get_model_filename_list(self):
         return []
@@ -463,6 +488,21 @@ class ModelBase(object):
         #return predictor_func, predictor_input_shape, MergerConfig() for the model
         raise NotImplementedError
 
+    def save_dfm(self, model_proto, output_path):
+        """
+        writes .dfm converted by tf2onnx, with face type and iteration of the model in metadata,
+        which are read by merger.DFMPredictor
+        """
+        for key, value in [ ('face_type', FaceType.toString(self.face_type)), ('iter', str(self.iter)) ]:
+            prop = model_proto.metadata_props.add()
+            prop.key, prop.value = key, value
+        pathex.write_bytes_safe ( Path(output_path), model_proto.SerializeToString() )
+
+    #overridable
+    def get_MergerBatchPredictor(self):
+        #return func(faces, func_morph_factor=...) -> (bgr, src_mask, dst_mask) batches, or None if model predicts face by face
+        return None
+
     #overridable
     def get_config_schema_path(self):
         raise NotImplementedError
@@ -504,10 +544,11 @@ class ModelBase(object):
             path = Path(self.get_model_conf_path())
             self.save_config_file(path)
 
+        self.loss_history.save(self.loss_history_path)
+
         model_data = {
             'iter': self.iter,
             'options': self.options,
-            'loss_history': self.loss_history,
             'sample_for_preview' : self.sample_for_preview,
             'choosed_gpu_indexes' : self.choosed_gpu_indexes,
         }
@@ -601,7 +642,7 @@ class ModelBase(object):
             self.autobackups_path.mkdir(exist_ok=True)
 
         bckp_filename_list = [ self.get_strpath_storage_for_file(filename) for _, filename in self.get_model_filename_list() ]
-        bckp_filename_list += [ str(self.get_summary_path()), str(self.model_data_path) ]
+        bckp_filename_list += [ str(self.get_summary_path()), str(self.model_data_path), str(self.loss_history_path) ]
 
         # Create new backup
         session_suffix = f'_{self.session_name}' if self.session_name else ''
@@ -640,6 +681,12 @@ class ModelBase(object):
         return imagelib.equalize_and_stack_square (images)
 
     def generate_next_samples(self):
+        sample, sample_filenames = self.get_next_samples()
+        self.last_sample = sample
+        self.last_sample_filenames = sample_filenames
+        return sample
+
+    def get_next_samples(self):
         sample = []
         sample_filenames = []
         for generator in self.generator_list:
@@ -652,6 +699,24 @@ class ModelBase(object):
                     sample.append ( batch )
             else:
                 sample.append ( [] )
+        return sample, sample_filenames
+
+    def start_input_staging(self, feed_func):
+        """
+        starts feeding self.input_staging with the next samples in background
+
+        feed_func(sample)   returns arrays for the placeholders of self.input_staging
+        """
+        self.input_staging.start(self.get_next_samples, lambda x: feed_func(x[0]) )
+
+    def generate_next_staged_samples(self):
+        """
+        same as generate_next_samples(), but the sample is already staged,
+        and it is taken by the next session run, which does not feed the staged inputs
+        """
+        if self.input_staging.thread is None:
+            raise Exception('start_input_staging() should be called first.')
+        sample, sample_filenames = self.input_staging.get()
         self.last_sample = sample
         self.last_sample_filenames = sample_filenames
         return sample
@@ -694,9 +759,15 @@ class ModelBase(object):
         return self.iter, iter_time
 
     def pass_one_iter(self):
-        self.generate_next_samples()
+        if self.input_staging is not None and self.input_staging.thread is not None:
+            self.generate_next_staged_samples()
+            self.input_staging.drop()
+        else:
+            self.generate_next_samples()
 
     def finalize(self):
+        if self.input_staging is not None:
+            self.input_staging.stop()
         nn.close_session()
 
     def is_first_run(self):
@@ -716,7 +787,7 @@ class ModelBase(object):
 
     def set_iter(self, iter):
         self.iter = iter
-        self.loss_history = self.loss_history[:iter]
+        self.loss_history.truncate(iter)
 
     def get_loss_history(self):
         return self.loss_history
@@ -808,51 +879,36 @@ class ModelBase(object):
         return summary_text
 
     @staticmethod
-    def get_loss_history_preview(loss_history, iter, w, c, lh_height=100):
-        loss_history = np.array (loss_history.copy())
+    def get_loss_history_preview(loss_history, iter, w, c, lh_height=100, last_count=0):
+        """
+        loss_history    LossHistory or list of lists of losses
+        last_count      show only last iterations, 0 - all
+        """
+        if not isinstance(loss_history, LossHistory):
+            loss_history = LossHistory.from_array(loss_history)
 
         lh_img = np.ones ( (lh_height,w,c) ) * 0.1
 
-        if len(loss_history) != 0:
-            loss_count = len(loss_history[0])
-            lh_len = len(loss_history)
-
-            l_per_col = lh_len / w
-            plist_max = [   [   max (0.0, loss_history[int(col*l_per_col)][p],
-                                                *[  loss_history[i_ab][p]
-                                                    for i_ab in range( int(col*l_per_col), int((col+1)*l_per_col) )
-                                                ]
-                                    )
-                                for p in range(loss_count)
-                            ]
-                            for col in range(w)
-                        ]
-
-            plist_min = [   [   min (plist_max[col][p], loss_history[int(col*l_per_col)][p],
-                                                *[  loss_history[i_ab][p]
-                                                    for i_ab in range( int(col*l_per_col), int((col+1)*l_per_col) )
-                                                ]
-                                    )
-                                for p in range(loss_count)
-                            ]
-                            for col in range(w)
-                        ]
-
-            plist_abs_max = np.mean(loss_history[ len(loss_history) // 5 : ]) * 2
-
-            for col in range(0, w):
-                for p in range(0,loss_count):
-                    point_color = [1.0]*c
-                    point_color[0:3] = colorsys.hsv_to_rgb ( p * (1.0/loss_count), 1.0, 1.0 )
-
-                    ph_max = int ( (plist_max[col][p] / plist_abs_max) * (lh_height-1) )
-                    ph_max = np.clip( ph_max, 0, lh_height-1 )
-
-                    ph_min = int ( (plist_min[col][p] / plist_abs_max) * (lh_height-1) )
-                    ph_min = np.clip( ph_min, 0, lh_height-1 )
-
-                    for ph in range(ph_min, ph_max+1):
-                        lh_img[ (lh_height-ph-1), col ] = point_color
+        start = max(0, len(loss_history)-last_count) if last_count != 0 else 0
+        lh_len = len(loss_history) - start
+        if lh_len != 0:
+            loss_count = loss_history.losses_count
+
+            plist_max, plist_min = loss_history.get_min_max(w, start)[::-1]
+            plist_max = np.maximum(plist_max, 0.0)
+            plist_min = np.minimum(plist_min, plist_max)
+
+            plist_abs_max = np.mean(loss_history.get_mean(start + lh_len // 5)) * 2
+
+            ph_max = np.clip( ( (plist_max / plist_abs_max) * (lh_height-1) ).astype(np.int32), 0, lh_height-1 )
+            ph_min = np.clip( ( (plist_min / plist_abs_max) * (lh_height-1) ).astype(np.int32), 0, lh_height-1 )
+
+            ph = np.arange(lh_height)[::-1,None]
+            for p in range(0,loss_count):
+                point_color = [1.0]*c
+                point_color[0:3] = colorsys.hsv_to_rgb ( p * (1.0/loss_count), 1.0, 1.0 )
+
+                lh_img[ (ph >= ph_min[None,:,p]) & (ph <= ph_max[None,:,p]) ] = point_color
 
         lh_lines = 5
         lh_line_height = (lh_height-1)/lh_lines
@@ -868,36 +924,76 @@ class ModelBase(object):
         return lh_img
 
 class PreviewHistoryWriter():
+    """
+    Writes preview images with loss graph in separate process.
+
+    Only new rows of loss history are sent with every post,
+    previews are sent as uint8 and encoded by a small pool of threads.
+    If the writer falls behind, the oldest pending previews are dropped, but never the losses.
+    """
+    max_pending = 4
+    encode_threads_count = 2
+
     def __init__(self):
-        self.sq = multiprocessing.Queue()
-        self.p = multiprocessing.Process(target=self.process, args=( self.sq, ))
+        self.sq = multiprocessing.Queue(self.max_pending)
+        self.sent_count = 0
+        self.p = multiprocessing.Process(target=PreviewHistoryWriter.process, args=( self.sq, self.max_pending, self.encode_threads_count ))
         self.p.daemon = True
         self.p.start()
 
-    def process(self, sq):
-        while True:
-            while not sq.empty():
-                plist, loss_history, iter = sq.get()
+    @staticmethod
+    def process(sq, max_pending, encode_threads_count):
+        loss_history = LossHistory()
+        pending = collections.deque(maxlen=max_pending)
+        cond = threading.Condition()
+
+        def reader():
+            while True:
+                plist, loss_start, loss_rows, iter = sq.get()
+                with cond:
+                    loss_history.truncate(loss_start)
+                    loss_history.extend(loss_rows)
+                    # deque with maxlen drops the oldest one
+                    pending.append( (plist, loss_history.copy(), iter) )
+                    cond.notify()
+
+        threading.Thread(target=reader, daemon=True).start()
+
+        def write(x):
+            filepath, img = x
+            filepath.parent.mkdir(parents=True, exist_ok=True)
+            cv2_imwrite (filepath, img )
+
+        with ThreadPoolExecutor(encode_threads_count) as executor:
+            while True:
+                with cond:
+                    while len(pending) == 0:
+                        cond.wait()
+                    plist, lh, iter = pending.popleft()
 
                 preview_lh_cache = {}
+                jobs = []
                 for preview, filepath in plist:
-                    filepath = Path(filepath)
                     i = (preview.shape[1], preview.shape[2])
 
                     preview_lh = preview_lh_cache.get(i, None)
                     if preview_lh is None:
-                        preview_lh = ModelBase.get_loss_history_preview(loss_history, iter, preview.shape[1], preview.shape[2])
+                        preview_lh = (ModelBase.get_loss_history_preview(lh, iter, preview.shape[1], preview.shape[2]) * 255).astype(np.uint8)
                         preview_lh_cache[i] = preview_lh
 
-                    img = (np.concatenate ( [preview_lh, preview], axis=0 ) * 255).astype(np.uint8)
+                    jobs.append( (Path(filepath), np.concatenate ( [preview_lh, preview], axis=0 )) )
 
-                    filepath.parent.mkdir(parents=True, exist_ok=True)
-                    cv2_imwrite (filepath, img )
-
-            time.sleep(0.01)
+                list(executor.map(write, jobs))
 
     def post(self, plist, loss_history, iter):
-        self.sq.put ( (plist, loss_history, iter) )
+        loss_start = min(self.sent_count, len(loss_history))
+        plist = [ ( (preview * 255).astype(np.uint8), filepath) for preview, filepath in plist ]
+        try:
+            self.sq.put_nowait ( (plist, loss_start, loss_history[loss_start:].copy(), iter) )
+            self.sent_count = len(loss_history)
+        except queue.Full:
+            # writer process is stalled, losses will be sent with the next post
+            pass
 
     # disable pickling
     def __getstate__(self):
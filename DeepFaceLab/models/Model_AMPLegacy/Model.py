@@ -412,6 +412,14 @@ class AMPLegacyModel(ModelBase):
             self.target_dstm    = tf.placeholder (nn.floatx, mask_shape, name='target_dstm')
             self.target_dstm_em = tf.placeholder (nn.floatx, mask_shape, name='target_dstm_em')
 
+            if self.is_training:
+                # next batch is uploaded while the current step runs, multiple GPU slice the batch on CPU
+                self.input_staging = nn.InputStaging( [self.warped_src, self.target_src, self.target_srcm, self.target_srcm_em,
+                                                       self.warped_dst, self.target_dst, self.target_dstm, self.target_dstm_em],
+                                                      device=nn.tf_default_device_name if len(devices) == 1 else '/CPU:0' )
+                ( self.warped_src, self.target_src, self.target_srcm, self.target_srcm_em,
+                  self.warped_dst, self.target_dst, self.target_dstm, self.target_dstm_em ) = self.input_staging.get_inputs()
+
             self.morph_value_t = tf.placeholder (nn.floatx, (1,), name='morph_value_t')
 
         # Initializing model classes
@@ -481,7 +489,7 @@ class AMPLegacyModel(ModelBase):
 
             for gpu_id in range(gpu_count):
                 with tf.device( f'/{devices[gpu_id].tf_dev_type}:{gpu_id}' if len(devices) != 0 else f'/CPU:0' ):
-                    with tf.device(f'/CPU:0'):
+                    with tf.device(self.input_staging.device):
                         # slice on CPU, otherwise all batch data will be transfered to GPU first
                         batch_slice = slice( gpu_id*bs_per_gpu, (gpu_id+1)*bs_per_gpu )
                         gpu_warped_src      = self.warped_src [batch_slice,:,:,:]
@@ -759,6 +767,10 @@ class AMPLegacyModel(ModelBase):
                 return s, d
             self.src_dst_train = src_dst_train
 
+            def src_dst_staged_train():
+                return nn.tf_sess.run ( [ src_loss, dst_loss, src_dst_loss_gv_op] )[:2]
+            self.src_dst_staged_train = src_dst_staged_train
+
             def get_src_dst_information(warped_src, target_src, target_srcm, target_srcm_em,  \
                                         warped_dst, target_dst, target_dstm, target_dstm_em, ):
                 out_data =nn.tf_sess.run ( [ src_loss, dst_loss, pred_src_src, pred_src_srcm, pred_dst_dst,
@@ -798,8 +810,8 @@ class AMPLegacyModel(ModelBase):
                                             feed_dict={self.warped_src:warped_src, self.warped_dst:warped_dst, self.morph_value_t:[morph_value] })
 
             self.AE_view = AE_view
-        else:
-            #Initializing merge function
+        elif not self.is_exporting:
+            #Initializing merge function, export_dfm() builds its own graph
             with tf.device( nn.tf_default_device_name if len(devices) != 0 else f'/CPU:0'):
                 gpu_dst_code = self.encoder (self.warped_dst)
                 gpu_dst_inter_src_code = self.inter_src ( gpu_dst_code)
@@ -977,8 +989,8 @@ class AMPLegacyModel(ModelBase):
                 name='AMP',
                 input_names=['in_face:0','morph_value:0'],
                 output_names=['out_face_mask:0','out_celeb_face:0','out_celeb_face_mask:0'],
-                opset=12,
-                output_path=output_path)
+                opset=12)
+        self.save_dfm(model_proto, output_path)
 
     #override
     def get_model_filename_list(self):
@@ -998,10 +1010,13 @@ class AMPLegacyModel(ModelBase):
     def onTrainOneIter(self):
         bs = self.get_batch_size()
 
+        if self.input_staging.thread is None:
+            self.start_input_staging( lambda sample: [*sample[0], *sample[1]] )
+
         ( (warped_src, target_src, target_srcm, target_srcm_em), \
-          (warped_dst, target_dst, target_dstm, target_dstm_em) ) = self.generate_next_samples()
+          (warped_dst, target_dst, target_dstm, target_dstm_em) ) = self.generate_next_staged_samples()
 
-        src_loss, dst_loss = self.src_dst_train (warped_src, target_src, target_srcm, target_srcm_em, warped_dst, target_dst, target_dstm, target_dstm_em)
+        src_loss, dst_loss = self.src_dst_staged_train()
 
         if self.options['retraining_samples']:
             for i in range(bs):
@@ -1120,12 +1135,24 @@ class AMPLegacyModel(ModelBase):
 
         return result
 
+    def predictor_batch_func (self, faces, morph_value):
+        faces = nn.to_data_format(faces, self.model_data_format, "NHWC")
+
+        bgr, mask_dst_dstm, mask_src_dstm = [ nn.to_data_format(x,"NHWC", self.model_data_format).astype(np.float32) for x in self.AE_merge (faces, morph_value) ]
+
+        return bgr, mask_src_dstm[...,0], mask_dst_dstm[...,0]
+
     def predictor_func (self, face, morph_value):
-        face = nn.to_data_format(face[None,...], self.model_data_format, "NHWC")
+        bgr, mask_src_dstm, mask_dst_dstm = self.predictor_batch_func(face[None,...], morph_value)
+        return bgr[0], mask_src_dstm[0], mask_dst_dstm[0]
+
+    #override
+    def get_MergerBatchPredictor(self):
 
-        bgr, mask_dst_dstm, mask_src_dstm = [ nn.to_data_format(x,"NHWC", self.model_data_format).astype(np.float32) for x in self.AE_merge (face, morph_value) ]
+        def predictor_batch_morph(faces, func_morph_factor=1.0):
+            return self.predictor_batch_func(faces, func_morph_factor)
 
-        return bgr[0], mask_src_dstm[0][...,0], mask_dst_dstm[0][...,0]
+        return predictor_batch_morph
 
     #override
     def get_MergerConfig(self):
@@ -62,6 +62,14 @@ class QModel(ModelBase):
             self.target_srcm = tf.placeholder (nn.floatx, mask_shape)
             self.target_dstm = tf.placeholder (nn.floatx, mask_shape)
 
+            if self.is_training:
+                # next batch is uploaded while the current step runs, multiple GPU slice the batch on CPU
+                self.input_staging = nn.InputStaging( [self.warped_src, self.target_src, self.target_srcm,
+                                                       self.warped_dst, self.target_dst, self.target_dstm],
+                                                      device=nn.tf_default_device_name if len(devices) == 1 else '/CPU:0' )
+                ( self.warped_src, self.target_src, self.target_srcm,
+                  self.warped_dst, self.target_dst, self.target_dstm ) = self.input_staging.get_inputs()
+
         # Initializing model classes
         with tf.device (models_opt_device):
             self.encoder = model_archi.Encoder(in_ch=input_ch, e_ch=e_dims, name='encoder')
@@ -107,7 +115,7 @@ class QModel(ModelBase):
             for gpu_id in range(gpu_count):
                 with tf.device( f'/{devices[gpu_id].tf_dev_type}:{gpu_id}' if len(devices) != 0 else f'/CPU:0' ):
                     batch_slice = slice( gpu_id*bs_per_gpu, (gpu_id+1)*bs_per_gpu )
-                    with tf.device(f'/CPU:0'):
+                    with tf.device(self.input_staging.device):
                         # slice on CPU, otherwise all batch data will be transfered to GPU first
                         gpu_warped_src   = self.warped_src [batch_slice,:,:,:]
                         gpu_warped_dst   = self.warped_dst [batch_slice,:,:,:]
@@ -191,6 +199,11 @@ class QModel(ModelBase):
                 return s, d
             self.src_dst_train = src_dst_train
 
+            def src_dst_staged_train():
+                s, d, _ = nn.tf_sess.run ( [ src_loss, dst_loss, src_dst_loss_gv_op] )
+                return np.mean(s), np.mean(d)
+            self.src_dst_staged_train = src_dst_staged_train
+
             def AE_view(warped_src, warped_dst):
                 return nn.tf_sess.run ( [pred_src_src, pred_dst_dst, pred_dst_dstm, pred_src_dst, pred_src_dstm],
                                             feed_dict={self.warped_src:warped_src,
@@ -284,19 +297,20 @@ class QModel(ModelBase):
 
     #override
     def onTrainOneIter(self):
+        if self.input_staging.thread is None:
+            self.start_input_staging( lambda sample: [*sample[0], *sample[1]] )
 
         if self.get_iter() % 3 == 0 and self.last_samples is not None:
             ( (warped_src, target_src, target_srcm), \
               (warped_dst, target_dst, target_dstm) ) = self.last_samples
             warped_src = target_src
             warped_dst = target_dst
-        else:
-            samples = self.last_samples = self.generate_next_samples()
-            ( (warped_src, target_src, target_srcm), \
-              (warped_dst, target_dst, target_dstm) ) = samples
 
-        src_loss, dst_loss = self.src_dst_train (warped_src, target_src, target_srcm,
-                                                 warped_dst, target_dst, target_dstm)
+            src_loss, dst_loss = self.src_dst_train (warped_src, target_src, target_srcm,
+                                                     warped_dst, target_dst, target_dstm)
+        else:
+            self.last_samples = self.generate_next_staged_samples()
+            src_loss, dst_loss = self.src_dst_staged_train()
 
         return ( ('src_loss', src_loss), ('dst_loss', dst_loss), )
 
@@ -339,11 +353,20 @@ class QModel(ModelBase):
 
         return result
 
+    def predictor_batch_func (self, faces):
+        faces = nn.to_data_format(faces, self.model_data_format, "NHWC")
+
+        bgr, mask_dst_dstm, mask_src_dstm = [ nn.to_data_format(x,"NHWC", self.model_data_format).astype(np.float32) for x in self.AE_merge (faces) ]
+
+        return bgr, mask_src_dstm[...,0], mask_dst_dstm[...,0]
+
     def predictor_func (self, face=None):
-        face = nn.to_data_format(face[None,...], self.model_data_format, "NHWC")
+        bgr, mask_src_dstm, mask_dst_dstm = self.predictor_batch_func(face[None,...])
+        return bgr[0], mask_src_dstm[0], mask_dst_dstm[0]
 
-        bgr, mask_dst_dstm, mask_src_dstm = [ nn.to_data_format(x, "NHWC", self.model_data_format).astype(np.float32) for x in self.AE_merge (face) ]
-        return bgr[0], mask_src_dstm[0][...,0], mask_dst_dstm[0][...,0]
+    #override
+    def get_MergerBatchPredictor(self):
+        return self.predictor_batch_func
 
     #override
     def get_MergerConfig(self):
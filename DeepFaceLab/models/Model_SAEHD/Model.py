@@ -373,6 +373,14 @@ class SAEHDModel(ModelBase):
             self.target_dstm    = tf.placeholder (nn.floatx, mask_shape, name='target_dstm')
             self.target_dstm_em = tf.placeholder (nn.floatx, mask_shape, name='target_dstm_em')
 
+            if self.is_training:
+                # next batch is uploaded while the current step runs, multiple GPU slice the batch on CPU
+                self.input_staging = nn.InputStaging( [self.warped_src, self.target_src, self.target_srcm, self.target_srcm_em,
+                                                       self.warped_dst, self.target_dst, self.target_dstm, self.target_dstm_em],
+                                                      device=nn.tf_default_device_name if len(devices) == 1 else '/CPU:0' )
+                ( self.warped_src, self.target_src, self.target_srcm, self.target_srcm_em,
+                  self.warped_dst, self.target_dst, self.target_dstm, self.target_dstm_em ) = self.input_staging.get_inputs()
+
         # Initializing model classes
         model_archi = nn.DeepFakeArchi(resolution, use_fp16=use_fp16, opts=archi_opts)
 
@@ -477,7 +485,7 @@ class SAEHDModel(ModelBase):
 
             for gpu_id in range(gpu_count):
                 with tf.device( f'/{devices[gpu_id].tf_dev_type}:{gpu_id}' if len(devices) != 0 else f'/CPU:0' ):
-                    with tf.device(f'/CPU:0'):
+                    with tf.device(self.input_staging.device):
                         # slice on CPU, otherwise all batch data will be transfered to GPU first
                         batch_slice = slice( gpu_id*bs_per_gpu, (gpu_id+1)*bs_per_gpu )
                         gpu_warped_src      = self.warped_src [batch_slice,:,:,:]
@@ -772,6 +780,10 @@ class SAEHDModel(ModelBase):
                 return s, d
             self.src_dst_train = src_dst_train
 
+            def src_dst_staged_train():
+                return nn.tf_sess.run ( [ src_loss, dst_loss, src_dst_loss_gv_op] )[:2]
+            self.src_dst_staged_train = src_dst_staged_train
+
             def get_src_dst_information(warped_src, target_src, target_srcm, target_srcm_em,  \
                                         warped_dst, target_dst, target_dstm, target_dstm_em, ):
                 out_data =nn.tf_sess.run ( [ src_loss, dst_loss, pred_src_src, pred_src_srcm, pred_dst_dst,
@@ -814,8 +826,8 @@ class SAEHDModel(ModelBase):
                                             feed_dict={self.warped_src:warped_src,
                                                     self.warped_dst:warped_dst})
             self.AE_view = AE_view
-        else:
-            # Initializing merge function
+        elif not self.is_exporting:
+            # Initializing merge function, export_dfm() builds its own graph
             with tf.device( nn.tf_default_device_name if len(devices) != 0 else f'/CPU:0'):
                 if 'df' in archi_type:
                     gpu_dst_code     = self.inter(self.encoder(self.warped_dst))
@@ -1035,8 +1047,8 @@ class SAEHDModel(ModelBase):
                 name='SAEHD',
                 input_names=['in_face:0'],
                 output_names=['out_face_mask:0','out_celeb_face:0','out_celeb_face_mask:0'],
-                opset=12,
-                output_path=output_path)
+                opset=12)
+        self.save_dfm(model_proto, output_path)
 
     #override
     def get_model_filename_list(self):
@@ -1057,10 +1069,13 @@ class SAEHDModel(ModelBase):
         if self.is_first_run() and not self.pretrain and not self.pretrain_just_disabled:
             io.log_info('You are training the model from scratch. It is strongly recommended to use a pretrained model to speed up the training and improve the quality.\n')
 
+        if self.input_staging.thread is None:
+            self.start_input_staging( lambda sample: [*sample[0], *sample[1]] )
+
         ( (warped_src, target_src, target_srcm, target_srcm_em), \
-          (warped_dst, target_dst, target_dstm, target_dstm_em) ) = self.generate_next_samples()
+          (warped_dst, target_dst, target_dstm, target_dstm_em) ) = self.generate_next_staged_samples()
 
-        src_loss, dst_loss = self.src_dst_train (warped_src, target_src, target_srcm, target_srcm_em, warped_dst, target_dst, target_dstm, target_dstm_em)
+        src_loss, dst_loss = self.src_dst_staged_train()
 
         if self.options['retraining_samples']:
             bs = self.get_batch_size()
@@ -1197,12 +1212,20 @@ class SAEHDModel(ModelBase):
 
         return result
 
-    def predictor_func (self, face=None):
-        face = nn.to_data_format(face[None,...], self.model_data_format, "NHWC")
+    def predictor_batch_func (self, faces):
+        faces = nn.to_data_format(faces, self.model_data_format, "NHWC")
+
+        bgr, mask_dst_dstm, mask_src_dstm = [ nn.to_data_format(x,"NHWC", self.model_data_format).astype(np.float32) for x in self.AE_merge (faces) ]
 
-        bgr, mask_dst_dstm, mask_src_dstm = [ nn.to_data_format(x,"NHWC", self.model_data_format).astype(np.float32) for x in self.AE_merge (face) ]
+        return bgr, mask_src_dstm[...,0], mask_dst_dstm[...,0]
 
-        return bgr[0], mask_src_dstm[0][...,0], mask_dst_dstm[0][...,0]
+    def predictor_func (self, face=None):
+        bgr, mask_src_dstm, mask_dst_dstm = self.predictor_batch_func(face[None,...])
+        return bgr[0], mask_src_dstm[0], mask_dst_dstm[0]
+
+    #override
+    def get_MergerBatchPredictor(self):
+        return self.predictor_batch_func
 
     #override
     def get_MergerConfig(self):
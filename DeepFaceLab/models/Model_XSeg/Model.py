@@ -78,6 +78,11 @@ class XSegModel(ModelBase):
             self.set_iter(0)
             
         if self.is_training:
+            # next batch is uploaded while the current step runs, multiple GPU slice the batch on CPU
+            self.input_staging = nn.InputStaging( [self.model.input_t, self.model.target_t],
+                                                  device=nn.tf_default_device_name if len(devices) == 1 else '/CPU:0' )
+            self.model.input_t, self.model.target_t = self.input_staging.get_inputs()
+
             # Adjust batch size for multiple GPU
             gpu_count = max(1, len(devices) )
             bs_per_gpu = max(1, self.get_batch_size() // gpu_count)
@@ -91,7 +96,7 @@ class XSegModel(ModelBase):
 
             for gpu_id in range(gpu_count):
                 with tf.device(f'/{devices[gpu_id].tf_dev_type}:{gpu_id}' if len(devices) != 0 else f'/CPU:0' ):
-                    with tf.device(f'/CPU:0'):
+                    with tf.device(self.input_staging.device):
                         # slice on CPU, otherwise all batch data will be transfered to GPU first
                         batch_slice = slice( gpu_id*bs_per_gpu, (gpu_id+1)*bs_per_gpu )
                         gpu_input_t       = self.model.input_t [batch_slice,:,:,:]
@@ -135,6 +140,10 @@ class XSegModel(ModelBase):
                     return l
             self.train = train
 
+            def staged_train():
+                return nn.tf_sess.run ( [loss, loss_gv_op] )[0]
+            self.staged_train = staged_train
+
             def view(input_np):
                 return nn.tf_sess.run ( [pred], feed_dict={self.model.input_t :input_np})
             self.view = view
@@ -206,8 +215,11 @@ class XSegModel(ModelBase):
 
     #override
     def onTrainOneIter(self):
-        image_np, target_np = self.generate_next_samples()[0]
-        loss = self.train (image_np, target_np)
+        if self.input_staging.thread is None:
+            self.start_input_staging( lambda sample: sample[0] )
+
+        self.generate_next_staged_samples()
+        loss = self.staged_train()
         
         return ( ('loss', np.mean(loss) ), )
 
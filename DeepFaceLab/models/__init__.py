@@ -1,4 +1,5 @@
 from .ModelBase import ModelBase
+from .LossHistory import LossHistory
 
 def import_model(model_class_name):
     module = __import__('Model_'+model_class_name, globals(), locals(), [], 1)
@@ -0,0 +1,196 @@
+import os
+import pickle
+import traceback
+from pathlib import Path
+
+import numpy as np
+
+from core import pathex
+from core.interact import interact as io
+
+faceset_index_filename = "faceset_index.dat"
+
+
+class FacesetIndex():
+    """
+    Persistent metadata index of unpacked aligned folder, stored as faceset_index.dat sidecar.
+
+    Every entry is fingerprinted by file mtime and size, and the index is revalidated
+    with a single os.scandir pass, so only added or edited files are read again.
+    Deleted files are dropped from the index.
+    """
+    VERSION = 1
+
+    list_columns = ['filenames', 'seg_ie_polys', 'xseg_masks_compressed', 'source_filenames']
+    array_columns = ['mtimes', 'sizes', 'face_types', 'shapes', 'landmarks', 'eyebrows_expand_mods']
+
+    @staticmethod
+    def load_face_samples_data(image_paths):
+        """
+        Same as FaceSamplesLoader(image_paths).run(), but served from the index of every directory.
+        """
+        image_paths = [ str(x) for x in image_paths ]
+
+        dir_names = {}
+        for image_path in image_paths:
+            dir_path, name = os.path.split(image_path)
+            dir_names.setdefault(dir_path, []).append(name)
+
+        dir_paths = list(dir_names.keys())
+        dir_indexes = [ FacesetIndex.update(dir_path, dir_names[dir_path]) for dir_path in dir_paths ]
+        dir_rows = [ { name : i for i, name in enumerate(index['filenames']) } for index in dir_indexes ]
+        dir_ids = { dir_path : dir_id for dir_id, dir_path in enumerate(dir_paths) }
+
+        filenames = []
+        rows = []
+        for image_path in image_paths:
+            dir_path, name = os.path.split(image_path)
+            dir_id = dir_ids[dir_path]
+            row = dir_rows[dir_id].get(name, None)
+            if row is not None:
+                filenames.append(image_path)
+                rows.append( (dir_id, row) )
+
+        rows_dir_ids = np.array([ dir_id for dir_id, _ in rows ], np.int64)
+        rows_ids = np.array([ row for _, row in rows ], np.int64)
+
+        def gather(column):
+            return [ dir_indexes[dir_id][column][row] for dir_id, row in rows ]
+
+        def gather_array(column):
+            empty = FacesetIndex.empty()[column]
+            result = np.zeros( (len(rows),)+empty.shape[1:], empty.dtype )
+            for dir_id, index in enumerate(dir_indexes):
+                mask = rows_dir_ids == dir_id
+                result[mask] = index[column][rows_ids[mask]]
+            return result
+
+        return ( filenames,
+                 gather_array('face_types'),
+                 gather_array('shapes'),
+                 gather_array('landmarks'),
+                 gather('seg_ie_polys'),
+                 gather('xseg_masks_compressed'),
+                 gather_array('eyebrows_expand_mods'),
+                 gather('source_filenames') )
+
+    @staticmethod
+    def update(dir_path, names=None):
+        """
+        Revalidates and saves the index of dir_path, reading metadata of names that are not up to date.
+        names   list of filenames in dir_path to be included, None - all images of dir_path
+
+        returns index dict of columns
+        """
+        dir_path = Path(dir_path)
+        index_path = dir_path / faceset_index_filename
+        index = FacesetIndex.load(index_path)
+
+        stats = {}
+        with os.scandir(str(dir_path)) as it:
+            for entry in it:
+                if entry.is_file() and any([entry.name.lower().endswith(ext) for ext in pathex.image_extensions]):
+                    st = entry.stat()
+                    stats[entry.name] = (st.st_mtime_ns, st.st_size)
+
+        if names is None:
+            names = sorted(stats.keys())
+
+        if index is None:
+            index = FacesetIndex.empty()
+
+        keep_rows = [ i for i, (name, mtime, size) in enumerate(zip(index['filenames'], index['mtimes'], index['sizes'])) \
+                      if stats.get(name, None) == (mtime, size) ]
+        indexed_names = set( index['filenames'][i] for i in keep_rows )
+        load_names = [ name for name in names if name in stats and name not in indexed_names ]
+
+        is_changed = len(keep_rows) != len(index['filenames'])
+        if is_changed:
+            index = FacesetIndex.select(index, keep_rows)
+
+        if len(load_names) != 0:
+            from .SampleLoader import FaceSamplesLoader
+            ( filenames,
+              face_types,
+              shapes,
+              landmarks,
+              seg_ie_polys,
+              xseg_masks_compressed,
+              eyebrows_expand_mods,
+              source_filenames ) = FaceSamplesLoader( [ str(dir_path / name) for name in load_names ] ).run()
+
+            if len(filenames) != 0:
+                filenames = [ Path(filename).name for filename in filenames ]
+                index = FacesetIndex.concat(index, {'filenames' : filenames,
+                                                    'mtimes' : np.array([ stats[name][0] for name in filenames ], np.int64),
+                                                    'sizes' : np.array([ stats[name][1] for name in filenames ], np.int64),
+                                                    'face_types' : face_types,
+                                                    'shapes' : shapes,
+                                                    'landmarks' : landmarks,
+                                                    'seg_ie_polys' : seg_ie_polys,
+                                                    'xseg_masks_compressed' : xseg_masks_compressed,
+                                                    'eyebrows_expand_mods' : eyebrows_expand_mods,
+                                                    'source_filenames' : source_filenames,
+                                                   })
+                is_changed = True
+
+        if is_changed:
+            FacesetIndex.save(index_path, index)
+        return index
+
+    @staticmethod
+    def empty():
+        return {'filenames' : [],
+                'mtimes' : np.zeros( (0,), np.int64),
+                'sizes' : np.zeros( (0,), np.int64),
+                'face_types' : np.zeros( (0,), np.uint8),
+                'shapes' : np.zeros( (0,3), np.int32),
+                'landmarks' : np.zeros( (0,68,2), np.float32),
+                'seg_ie_polys' : [],
+                'xseg_masks_compressed' : [],
+                'eyebrows_expand_mods' : np.zeros( (0,), np.float32),
+                'source_filenames' : [],
+               }
+
+    @staticmethod
+    def select(index, rows):
+        result = { column : [ index[column][i] for i in rows ] for column in FacesetIndex.list_columns }
+        rows = np.array(rows, np.int64)
+        result.update ( { column : index[column][rows] for column in FacesetIndex.array_columns } )
+        return result
+
+    @staticmethod
+    def concat(index_a, index_b):
+        result = { column : index_a[column] + index_b[column] for column in FacesetIndex.list_columns }
+        result.update ( { column : np.concatenate([index_a[column], index_b[column]], 0) for column in FacesetIndex.array_columns } )
+        return result
+
+    @staticmethod
+    def load(index_path):
+        """
+        returns None if index does not exist, is corrupted or of another version
+        """
+        index_path = Path(index_path)
+        if not index_path.exists():
+            return None
+        try:
+            d = pickle.loads(index_path.read_bytes())
+            if d.get('version', None) != FacesetIndex.VERSION:
+                return None
+            return d['index']
+        except:
+            io.log_info(f"Unable to read {index_path}, it will be rebuilt.")
+            return None
+
+    @staticmethod
+    def save(index_path, index):
+        try:
+            pathex.write_bytes_safe ( Path(index_path), pickle.dumps( {'version' : FacesetIndex.VERSION, 'index' : index }, 4) )
+        except:
+            io.log_err(f"Unable to save {index_path} : {traceback.format_exc()}")
+
+    @staticmethod
+    def remove(dir_path):
+        index_path = Path(dir_path) / faceset_index_filename
+        if index_path.exists():
+            index_path.unlink()
@@ -0,0 +1,281 @@
+import bisect
+import multiprocessing
+import pickle
+
+import numpy as np
+
+from core.imagelib import SegIEPolys
+from facelib import FaceType, LandmarksProcessor
+
+from .Sample import Sample, SampleType
+
+
+class MPSharedSampleList():
+    """
+    Provides read-only list of face samples via shared memory aka 'multiprocessing.RawArray'
+    Thus no 4GB limit for subprocesses.
+
+    Samples are stored by columns:
+        fixed size fields as typed arrays, for example landmarks as one (N,68,2) float32 array,
+        variable length fields as blobs with offset tables.
+
+    __getitem__ returns SampleView, which reads the fields lazily without unpickling the whole sample.
+
+    supports list concat via + or sum()
+    """
+
+    fixed_columns = [ ('sample_type',         np.uint8,   () ),
+                      ('face_type',           np.uint8,   () ),
+                      ('shape',               np.int32,   (3,) ),
+                      ('landmarks',           np.float32, (68,2) ),
+                      ('eyebrows_expand_mod', np.float32, () ),
+                    ]
+
+    # 'extra' is pickled dict of rarely used fields
+    blob_columns = ['filename', 'source_filename', 'person_name', 'seg_ie_polys', 'xseg_mask_compressed', 'extra']
+
+    def __init__(self, sample_list):
+        self.chunks = []
+        self.obj_counts = []
+        self.obj_starts = []
+        self.obj_count = 0
+        self.chunks_views = []
+
+        if sample_list is not None:
+            chunk = MPSharedSampleList.bake_data(sample_list)
+            if chunk is not None:
+                self._add_chunks([chunk])
+
+    def _add_chunks(self, chunks):
+        for chunk in chunks:
+            layout, sh_b = chunk
+            self.chunks.append(chunk)
+            self.obj_starts.append(self.obj_count)
+            self.obj_counts.append(layout['count'])
+            self.obj_count += layout['count']
+            self.chunks_views.append(None)
+
+    def __add__(self, o):
+        if isinstance(o, MPSharedSampleList):
+            m = MPSharedSampleList(None)
+            m._add_chunks(self.chunks + o.chunks)
+            return m
+        elif isinstance(o, int):
+            return self
+        else:
+            raise ValueError(f"MPSharedSampleList object of class {o.__class__} is not supported for __add__ operator.")
+
+    def __radd__(self, o):
+        return self+o
+
+    def __len__(self):
+        return self.obj_count
+
+    def __getitem__(self, key):
+        if key < 0:
+            key = self.obj_count+key
+        if key < 0 or key >= self.obj_count:
+            raise ValueError("out of range")
+
+        chunk_id = bisect.bisect_right(self.obj_starts, key) - 1
+        return SampleView(self.get_chunk_views(chunk_id), key - self.obj_starts[chunk_id])
+
+    def __iter__(self):
+        for i in range(self.__len__()):
+            yield self.__getitem__(i)
+
+    def get_chunk_views(self, chunk_id):
+        """
+        returns dict of numpy arrays which are views of the shared memory of the chunk
+        """
+        views = self.chunks_views[chunk_id]
+        if views is None:
+            layout, sh_b = self.chunks[chunk_id]
+            sh_b = np.frombuffer( memoryview(sh_b).cast('B'), np.uint8)
+
+            def get_view(offset, dtype, shape):
+                count = int(np.prod(shape, dtype=np.int64))
+                ar = sh_b[offset:offset+count*np.dtype(dtype).itemsize].view(dtype).reshape(shape)
+                ar.flags.writeable = False
+                return ar
+
+            views = {}
+            for name, (offset, dtype, shape) in layout['fixed'].items():
+                views[name] = get_view(offset, dtype, shape)
+
+            for name, (offsets_offset, nones_offset, data_offset, data_size) in layout['blobs'].items():
+                views[name] = ( get_view(offsets_offset, np.int64, (layout['count']+1,) ),
+                                get_view(nones_offset, np.bool_, (layout['count'],) ),
+                                get_view(data_offset, np.uint8, (data_size,) ) )
+
+            self.chunks_views[chunk_id] = views
+        return views
+
+    # views are process local, shared memory goes with chunks
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        d['chunks_views'] = [None]*len(self.chunks)
+        return d
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+
+    @staticmethod
+    def bake_data(sample_list):
+        if not isinstance(sample_list, list):
+            raise ValueError("MPSharedSampleList: sample_list should be list type.")
+
+        count = len(sample_list)
+        if count == 0:
+            return None
+
+        blobs = { name : [] for name in MPSharedSampleList.blob_columns }
+        for sample in sample_list:
+            if sample.landmarks is None:
+                raise ValueError(f"MPSharedSampleList: sample {sample.filename} has no landmarks.")
+
+            blobs['filename'].append( sample.filename.encode('utf-8') if sample.filename is not None else None )
+            blobs['source_filename'].append( sample.source_filename.encode('utf-8') if sample.source_filename is not None else None )
+            blobs['person_name'].append( sample.person_name.encode('utf-8') if sample.person_name is not None else None )
+            blobs['seg_ie_polys'].append( pickle.dumps(sample.seg_ie_polys.dump(), 4) if sample.seg_ie_polys.has_polys() else None )
+            blobs['xseg_mask_compressed'].append( np.asarray(sample.xseg_mask_compressed, np.uint8).tobytes() if sample.xseg_mask_compressed is not None else None )
+
+            extra = { name : getattr(sample, name) for name in ['xseg_mask', 'pitch_yaw_roll', '_filename_offset_size'] if getattr(sample, name) is not None }
+            blobs['extra'].append( pickle.dumps(extra, 4) if len(extra) != 0 else None )
+
+        def align(x):
+            return (x + 7) // 8 * 8
+
+        layout = {'count' : count, 'fixed' : {}, 'blobs' : {} }
+        total_size = 0
+        for name, dtype, shape in MPSharedSampleList.fixed_columns:
+            shape = (count,) + shape
+            layout['fixed'][name] = (total_size, dtype, shape)
+            total_size += align( int(np.prod(shape)) * np.dtype(dtype).itemsize )
+
+        for name in MPSharedSampleList.blob_columns:
+            data_size = sum( len(b) for b in blobs[name] if b is not None )
+            offsets_offset = total_size
+            nones_offset = offsets_offset + align( (count+1)*8 )
+            data_offset = nones_offset + align(count)
+            layout['blobs'][name] = (offsets_offset, nones_offset, data_offset, data_size)
+            total_size = data_offset + align(data_size)
+
+        sh_b = multiprocessing.RawArray('B', max(1, total_size) )
+        sh_b_ar = np.frombuffer( memoryview(sh_b).cast('B'), np.uint8)
+
+        def get_view(offset, dtype, shape):
+            return sh_b_ar[offset:offset+int(np.prod(shape))*np.dtype(dtype).itemsize].view(dtype).reshape(shape)
+
+        get_view( *layout['fixed']['sample_type'] )[:] = [ sample.sample_type for sample in sample_list ]
+        get_view( *layout['fixed']['face_type'] )[:] = [ sample.face_type for sample in sample_list ]
+        get_view( *layout['fixed']['shape'] )[:] = [ sample.shape[0:3] for sample in sample_list ]
+        get_view( *layout['fixed']['eyebrows_expand_mod'] )[:] = [ sample.eyebrows_expand_mod for sample in sample_list ]
+        landmarks = get_view( *layout['fixed']['landmarks'] )
+        for i, sample in enumerate(sample_list):
+            landmarks[i] = sample.landmarks
+
+        for name in MPSharedSampleList.blob_columns:
+            offsets_offset, nones_offset, data_offset, data_size = layout['blobs'][name]
+            offsets = get_view(offsets_offset, np.int64, (count+1,) )
+            nones = get_view(nones_offset, np.bool_, (count,) )
+            data = get_view(data_offset, np.uint8, (data_size,) )
+
+            offset = 0
+            for i, b in enumerate(blobs[name]):
+                offsets[i] = offset
+                if b is None:
+                    nones[i] = True
+                else:
+                    data[offset:offset+len(b)] = np.frombuffer(b, np.uint8)
+                    offset += len(b)
+            offsets[count] = offset
+
+        return layout, sh_b
+
+
+class SampleView():
+    """
+    Read-only Sample stored in MPSharedSampleList.
+
+    Fixed size fields are zero copy views of the shared memory,
+    variable length fields are decoded on first access.
+    """
+    __slots__ = ['_views', '_idx', '_seg_ie_polys', '_extra', 'pitch_yaw_roll']
+
+    def __init__(self, views, idx):
+        self._views = views
+        self._idx = idx
+        self._seg_ie_polys = None
+        self._extra = None
+        self.pitch_yaw_roll = None
+
+    def _get_blob(self, name):
+        offsets, nones, data = self._views[name]
+        idx = self._idx
+        if nones[idx]:
+            return None
+        return data[offsets[idx]:offsets[idx+1]]
+
+    def _get_str(self, name):
+        b = self._get_blob(name)
+        return b.tobytes().decode('utf-8') if b is not None else None
+
+    def _get_extra(self, name):
+        if self._extra is None:
+            b = self._get_blob('extra')
+            self._extra = pickle.loads(b) if b is not None else {}
+        return self._extra.get(name, None)
+
+    @property
+    def sample_type(self): return SampleType(self._views['sample_type'][self._idx])
+    @property
+    def face_type(self): return FaceType(self._views['face_type'][self._idx])
+    @property
+    def shape(self): return tuple(self._views['shape'][self._idx].tolist())
+    @property
+    def landmarks(self): return self._views['landmarks'][self._idx]
+    @property
+    def eyebrows_expand_mod(self): return float(self._views['eyebrows_expand_mod'][self._idx])
+    @property
+    def filename(self): return self._get_str('filename')
+    @property
+    def source_filename(self): return self._get_str('source_filename')
+    @property
+    def person_name(self): return self._get_str('person_name')
+    @property
+    def xseg_mask_compressed(self): return self._get_blob('xseg_mask_compressed')
+    @property
+    def xseg_mask(self): return self._get_extra('xseg_mask')
+    @property
+    def _filename_offset_size(self): return self._get_extra('_filename_offset_size')
+
+    @property
+    def seg_ie_polys(self):
+        if self._seg_ie_polys is None:
+            b = self._get_blob('seg_ie_polys')
+            self._seg_ie_polys = SegIEPolys.load( pickle.loads(b) if b is not None else None )
+        return self._seg_ie_polys
+
+    def get_pitch_yaw_roll(self):
+        if self.pitch_yaw_roll is None:
+            self.pitch_yaw_roll = self._get_extra('pitch_yaw_roll')
+        if self.pitch_yaw_roll is None:
+            self.pitch_yaw_roll = LandmarksProcessor.estimate_pitch_yaw_roll(self.landmarks, size=self.shape[1])
+        return self.pitch_yaw_roll
+
+    # views are process local, so pickled as regular Sample
+    def __reduce__(self):
+        return (_sample_from_config, (self.get_config(), self._filename_offset_size) )
+
+    has_xseg_mask = Sample.has_xseg_mask
+    get_xseg_mask = Sample.get_xseg_mask
+    read_raw_file = Sample.read_raw_file
+    load_bgr = Sample.load_bgr
+    get_config = Sample.get_config
+
+def _sample_from_config(config, filename_offset_size):
+    sample = Sample(**config)
+    if filename_offset_size is not None:
+        sample.set_filename_offset_size(*filename_offset_size)
+    return sample
@@ -6,7 +6,9 @@ from pathlib import Path
 import samplelib.SampleLoader
 from core.interact import interact as io
 from samplelib import Sample
+from samplelib.FacesetIndex import FacesetIndex
 from core import pathex
+from core.joblib import ThreadPoolMap
 
 import zipfile
 import hashlib
@@ -20,11 +22,21 @@ packed_faceset_filename = "faceset.pak"
 packed_faceset_filename_zip = "faceset.zip"
 packed_faceset_filename_config = "config.pak"
 PACK_EXTENSION = 'pak'
+write_buffer_size = 16*1024*1024
 
 
 
 class PackedFaceset():
-    VERSION = 1
+    """
+    .pak format:
+        Q version
+        Q size of pickled samples configs
+          pickled samples configs
+        Q*(N+1) samples data offsets relative to data start
+        I*N     samples data crc32, since version 2
+          samples data
+    """
+    VERSION = 2
     
     @staticmethod
     def pack(samples_path, ext=".pak"):
@@ -68,66 +80,64 @@ class PackedFaceset():
             samples_configs.append ( sample.get_config() )            
 
         samples_bytes = pickle.dumps(samples_configs, 4)
-        
+
+        sample_paths = []
+        for sample in samples:
+            if sample.person_name is not None:
+                sample_paths.append ( samples_path / sample.person_name / sample.filename )
+            else:
+                sample_paths.append ( samples_path / sample.filename )
+
         if "pak" == ext:
-            of = open(samples_dat_path, "wb")
+            of = open(samples_dat_path, "wb", buffering=write_buffer_size)
             of.write ( struct.pack ("Q", PackedFaceset.VERSION ) )
             of.write ( struct.pack ("Q", len(samples_bytes) ) )
             of.write ( samples_bytes )
             sample_data_table_offset = of.tell()
             of.write ( bytes( 8*(samples_len+1) ) ) #sample data offset table
+            of.write ( bytes( 4*samples_len ) )     #sample data crc32 table
 
             data_start_offset = of.tell()
             offsets = []
+            crcs = []
         elif "zip" == ext:
-            samples_config_path = samples_path / packed_faceset_filename_config
-            with samples_config_path.open(mode="wb") as cfg_file:
-                cfg_file.write(samples_bytes)
-                
-            zipObj = zipfile.ZipFile(samples_dat_path, 'w')
-            zipObj.write(samples_config_path, packed_faceset_filename_config, compress_type=compression)
-            samples_config_path.unlink()
-            
+            zipObj = zipfile.ZipFile( open(samples_dat_path, "wb", buffering=write_buffer_size), 'w')
+            zipObj.writestr(packed_faceset_filename_config, samples_bytes, compress_type=compression)
+
         del samples_bytes   #just free mem
         del samples_configs
 
-        
-
-        for sample in io.progress_bar_generator(samples, "Packing"):
-            try:
-                if sample.person_name is not None:
-                    sample_path = samples_path / sample.person_name / sample.filename
-                else:
-                    sample_path = samples_path / sample.filename
-
-                if "pak" == ext:
-                    with open(sample_path, "rb") as f:
-                       b = f.read()
-
-                    offsets.append ( of.tell() - data_start_offset )
-                    of.write(b)
-                elif "zip" == ext:
-                    zipObj.write(sample_path, sample.filename, compress_type=compression)
-                    
-            except:
-                raise Exception(f"error while processing sample {sample_path}")
+        io.progress_bar ("Packing", samples_len)
+        #files are read ahead by the pool of threads, and written sequentially
+        for sample, sample_path, b in ThreadPoolMap(PackedFaceset._read_sample_file)( zip(samples, sample_paths) ):
+            if "pak" == ext:
+                offsets.append ( of.tell() - data_start_offset )
+                crcs.append ( zlib.crc32(b) )
+                of.write(b)
+            elif "zip" == ext:
+                #jpeg is already compressed
+                zipObj.writestr(sample.filename, b, compress_type=zipfile.ZIP_STORED if Path(sample.filename).suffix.lower() in ['.jpg','.jpeg'] else compression)
+            io.progress_bar_inc(1)
+        io.progress_bar_close()
 
         if "pak" == ext:
-            offsets.append ( of.tell() )
+            offsets.append ( of.tell() - data_start_offset )
 
             of.seek(sample_data_table_offset, 0)
-            for offset in offsets:
-                of.write ( struct.pack("Q", offset) )
+            of.write ( struct.pack( f"{len(offsets)}Q", *offsets ) )
+            of.write ( struct.pack( f"{len(crcs)}I", *crcs ) )
             of.seek(0,2)
             of.close()
         elif "zip" == ext:
             zipObj.comment = hashlib.md5(str(zipObj.namelist()).encode()).digest()
+            zip_fp = zipObj.fp
             zipObj.close()
-          
-        
+            zip_fp.close()
+
         if io.input_bool(f"Delete original files?", True):
             for filename in io.progress_bar_generator(image_paths, "Deleting files"):
                 Path(filename).unlink()
+            FacesetIndex.remove(samples_path)
 
             if as_person_faceset:
                 for dir_name in io.progress_bar_generator(dir_names, "Deleting dirs"):
@@ -137,31 +147,70 @@ class PackedFaceset():
                     except:
                         io.log_info (f"unable to remove: {dir_path} ")
 
+    @staticmethod
+    def _read_sample_file(param):
+        sample, sample_path = param
+        try:
+            with open(sample_path, "rb") as f:
+                return sample, sample_path, f.read()
+        except:
+            raise Exception(f"error while processing sample {sample_path}")
+
+    @staticmethod
+    def _write_file(param):
+        filepath, b = param
+        with open(filepath, "wb") as f:
+            f.write(b)
+
     @staticmethod
     def unpack(samples_path):
-    
+
         if (samples_path / packed_faceset_filename).exists():
             samples_dat_path = samples_path / packed_faceset_filename
             samples = PackedFaceset.load(samples_path)
-            for sample in io.progress_bar_generator(samples, "Unpacking"):
-                person_name = sample.person_name
-                if person_name is not None:
-                    person_path = samples_path / person_name
-                    person_path.mkdir(parents=True, exist_ok=True)
-
-                    target_filepath = person_path / sample.filename
-                else:
-                    target_filepath = samples_path / sample.filename
-
-                with open(target_filepath, "wb") as f:
-                    f.write( sample.read_raw_file() )
-                
+
+            def gen_files():
+                #samples data is read sequentially, verified and passed to the pool of writers
+                with open(samples_dat_path, "rb", buffering=write_buffer_size) as f:
+                    for sample in samples:
+                        _, offset, size, crc = sample._filename_offset_size
+                        f.seek(offset, 0)
+                        b = f.read(size)
+                        if crc is not None and zlib.crc32(b) != crc:
+                            raise Exception(f"Corrupted data of {sample.filename} in {samples_dat_path}, crc mismatch.")
+
+                        person_name = sample.person_name
+                        if person_name is not None:
+                            person_path = samples_path / person_name
+                            person_path.mkdir(parents=True, exist_ok=True)
+
+                            target_filepath = person_path / sample.filename
+                        else:
+                            target_filepath = samples_path / sample.filename
+                        yield target_filepath, b
+
+            io.progress_bar ("Unpacking", len(samples))
+            for _ in ThreadPoolMap(PackedFaceset._write_file)( gen_files() ):
+                io.progress_bar_inc(1)
+            io.progress_bar_close()
+
         elif (samples_path / packed_faceset_filename_zip).exists():
             samples_dat_path = samples_path / packed_faceset_filename_zip
+
             with zipfile.ZipFile(samples_dat_path, 'r') as zipObj:
-                zipObj.extractall(path=samples_path)
-            samples_config_path = samples_path / packed_faceset_filename_config
-            samples_config_path.unlink()
+                names = [ name for name in zipObj.namelist() if name != packed_faceset_filename_config ]
+
+                def gen_files():
+                    for name in names:
+                        target_filepath = samples_path / name
+                        target_filepath.parent.mkdir(parents=True, exist_ok=True)
+                        #zipfile verifies crc of entry on read
+                        yield target_filepath, zipObj.read(name)
+
+                io.progress_bar ("Unpacking", len(names))
+                for _ in ThreadPoolMap(PackedFaceset._write_file)( gen_files() ):
+                    io.progress_bar_inc(1)
+                io.progress_bar_close()
         else:
             io.log_info(f"{samples_path} : not files not found.")
 
@@ -210,7 +259,7 @@ class PackedFaceset():
         
             f = open(samples_dat_path, "rb")
             version, = struct.unpack("Q", f.read(8) )
-            if version != PackedFaceset.VERSION:
+            if version not in [1, PackedFaceset.VERSION]:
                 raise NotImplementedError
 
             sizeof_samples_bytes, = struct.unpack("Q", f.read(8) )
@@ -221,13 +270,17 @@ class PackedFaceset():
                 sample_config = pickle.loads(pickle.dumps (sample_config))
                 samples.append ( Sample (**sample_config) )
 
-            offsets = [ struct.unpack("Q", f.read(8) )[0] for _ in range(len(samples)+1) ]
+            offsets = struct.unpack( f"{len(samples)+1}Q", f.read( 8*(len(samples)+1) ) )
+            if version >= 2:
+                crcs = struct.unpack( f"{len(samples)}I", f.read( 4*len(samples) ) )
+            else:
+                crcs = [None]*len(samples)
             data_start_offset = f.tell()
             f.close()
 
             for i, sample in enumerate(samples):
                 start_offset, end_offset = offsets[i], offsets[i+1]
-                sample.set_filename_offset_size( str(samples_dat_path), data_start_offset+start_offset, end_offset-start_offset )
+                sample.set_filename_offset_size( str(samples_dat_path), data_start_offset+start_offset, end_offset-start_offset, crcs[i] )
 
             return samples
         else:
@@ -10,6 +10,7 @@ from core import imagelib
 from core.imagelib import SegIEPolys
 
 import zipfile
+import zlib
 
 class SampleType(IntEnum):
     IMAGE = 0 #raw image
@@ -97,19 +98,23 @@ class Sample(object):
             self.pitch_yaw_roll = LandmarksProcessor.estimate_pitch_yaw_roll(self.landmarks, size=self.shape[1])
         return self.pitch_yaw_roll
 
-    def set_filename_offset_size(self, filename, offset, size):
-        self._filename_offset_size = (filename, offset, size)
+    def set_filename_offset_size(self, filename, offset, size, crc=None):
+        self._filename_offset_size = (filename, offset, size, crc)
 
     def read_raw_file(self, filename=None):
         if self._filename_offset_size is not None:
-            filename, offset, size = self._filename_offset_size
+            filename, offset, size, crc = self._filename_offset_size
             if filename.endswith(".zip"):
+                #zipfile verifies crc of entry by itself
                 with zipfile.ZipFile(filename, 'r') as zipObj:
                     return zipObj.read(self.filename)
             else:
                 with open(filename, "rb") as f:
                     f.seek( offset, 0)
-                    return f.read (size)
+                    data = f.read (size)
+                if crc is not None and zlib.crc32(data) != crc:
+                    raise Exception(f"Corrupted data of {self.filename} in {filename}, crc mismatch.")
+                return data
         else:
             with open(filename, "rb") as f:
                 return f.read()
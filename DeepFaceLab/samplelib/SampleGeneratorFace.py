@@ -5,6 +5,7 @@ import numpy as np
 from core import mplib
 from core.interact import interact as io
 from core.joblib import SubprocessGenerator, ThisThreadGenerator
+from facelib import LandmarksProcessor
 from samplelib import (SampleGeneratorBase, SampleLoader, SampleProcessor,
                        SampleType)
 
@@ -16,6 +17,8 @@ output_sample_types = [
                         [SampleProcessor.TypeFlags, size, (optional) {} opts ] ,
                         ...
                       ]
+
+masks_cache_size    bytes of memoized landmarks masks of all generators, split between their processes
 '''
 class SampleGeneratorFace(SampleGeneratorBase):
     def __init__ (self, samples_path,
@@ -29,6 +32,7 @@ class SampleGeneratorFace(SampleGeneratorBase):
                         generators_count=4,
                         ignore_same_path=False,
                         raise_on_no_data=True,                        
+                        masks_cache_size=512*1024*1024,
                         **kwargs):
 
         super().__init__(debug, batch_size)
@@ -40,6 +44,7 @@ class SampleGeneratorFace(SampleGeneratorBase):
             self.generators_count = 1
         else:
             self.generators_count = max(1, generators_count)
+        self.masks_cache_size = masks_cache_size
 
         samples = SampleLoader.load (SampleType.FACE, samples_path, pak_name=pak_name, ignore_same_path=ignore_same_path)
         self.samples = samples # used to have minimal changes with the repo - used for train analysis 
@@ -116,6 +121,8 @@ class SampleGeneratorFace(SampleGeneratorBase):
     def batch_func(self, param ):
         samples, index_host, ct_samples, ct_index_host = param
  
+        LandmarksProcessor.set_masks_cache_max_size(self.masks_cache_size // self.generators_count)
+
         bs = self.batch_size
 
         # needed to know if the sample will be flipped or not
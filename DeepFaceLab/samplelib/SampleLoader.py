@@ -5,12 +5,13 @@ from pathlib import Path
 
 import samplelib.PackedFaceset
 from core import pathex
-from core.mplib import MPSharedList
 from core.interact import interact as io
-from core.joblib import Subprocessor
 from DFLIMG import *
 from facelib import FaceType
+import numpy as np
 
+from .FacesetIndex import FacesetIndex
+from .MPSharedSampleList import MPSharedSampleList
 from .Sample import Sample, SampleType
 
 
@@ -34,7 +35,7 @@ class SampleLoader:
     @staticmethod
     def load(sample_type, samples_path, subdirs=False, ignore_same_path=False, pak_name=None):
         """
-        Return MPSharedList of samples
+        Return MPSharedSampleList of face samples or list of image samples
         """
         samples_cache = SampleLoader.samples_cache
         
@@ -64,39 +65,36 @@ class SampleLoader:
                 if result is None:
                     result = SampleLoader.load_face_samples( pathex.get_image_paths(samples_path, subdirs=subdirs) )
 
-                samples[sample_type] = MPSharedList(result)
+                samples[sample_type] = MPSharedSampleList(result)
         elif sample_type == SampleType.FACE_TEMPORAL_SORTED:
             result = SampleLoader.load (SampleType.FACE, samples_path)
             result = SampleLoader.upgradeToFaceTemporalSortedSamples(result)
-            samples[sample_type] = MPSharedList(result)
+            samples[sample_type] = MPSharedSampleList(result)
 
         return samples[sample_type]
 
     @staticmethod
     def load_face_samples ( image_paths):
-        result = FaceSamplesLoaderSubprocessor(image_paths).run()
-        sample_list = []
+        ( filenames,
+          face_types,
+          shapes,
+          landmarks,
+          seg_ie_polys,
+          xseg_masks_compressed,
+          eyebrows_expand_mods,
+          source_filenames ) = FacesetIndex.load_face_samples_data(image_paths)
 
-        for filename, data in result:
-            if data is None:
-                continue
-            ( face_type,
-              shape,
-              landmarks,
-              seg_ie_polys,
-              xseg_mask_compressed,
-              eyebrows_expand_mod,
-              source_filename ) = data
-              
+        sample_list = []
+        for i, filename in enumerate(filenames):
             sample_list.append( Sample(filename=filename,
                                         sample_type=SampleType.FACE,
-                                        face_type=FaceType.fromString (face_type),
-                                        shape=shape,
-                                        landmarks=landmarks,
-                                        seg_ie_polys=seg_ie_polys,
-                                        xseg_mask_compressed=xseg_mask_compressed,
-                                        eyebrows_expand_mod=eyebrows_expand_mod,
-                                        source_filename=source_filename,
+                                        face_type=FaceType(face_types[i]),
+                                        shape=tuple(shapes[i].tolist()),
+                                        landmarks=landmarks[i],
+                                        seg_ie_polys=seg_ie_polys[i],
+                                        xseg_mask_compressed=xseg_masks_compressed[i],
+                                        eyebrows_expand_mod=float(eyebrows_expand_mods[i]),
+                                        source_filename=source_filenames[i],
                                     ))
         return sample_list
 
@@ -108,71 +106,127 @@ class SampleLoader:
         return [ s[0] for s in new_s]
 
 
-class FaceSamplesLoaderSubprocessor(Subprocessor):
-    #override
-    def __init__(self, image_paths ):
-        self.image_paths = image_paths
-        self.image_paths_len = len(image_paths)
-        self.idxs = [*range(self.image_paths_len)]
-        self.result = [None]*self.image_paths_len
-        super().__init__('FaceSamplesLoader', FaceSamplesLoaderSubprocessor.Cli, 60)
-
-    #override
-    def on_clients_initialized(self):
-        io.progress_bar ("Loading samples", len (self.image_paths))
-
-    #override
-    def on_clients_finalized(self):
+def _load_face_samples_chunk(image_paths):
+    """
+    FaceSamplesLoader pool worker.
+    Reads metadata of chunk of image paths via fast DFLJPG path and returns it as compact arrays.
+    """
+    valid_idxs = []
+    face_types = []
+    shapes = []
+    landmarks = []
+    seg_ie_polys = []
+    xseg_masks_compressed = []
+    eyebrows_expand_mods = []
+    source_filenames = []
+    errors = []
+
+    for i, filename in enumerate(image_paths):
+        dflimg = DFLIMG.load_meta (Path(filename))
+
+        if dflimg is None or not dflimg.has_data():
+            errors.append (f"FaceSamplesLoader: {filename} is not a dfl image file.")
+            continue
+
+        valid_idxs.append(i)
+        face_types.append( FaceType.fromString (dflimg.get_face_type()) )
+        shapes.append( dflimg.get_shape() )
+        landmarks.append( dflimg.get_landmarks() )
+        seg_ie_polys.append( dflimg.get_dict().get('seg_ie_polys', None) )
+        xseg_masks_compressed.append( dflimg.get_xseg_mask_compressed() )
+        eyebrows_expand_mods.append( dflimg.get_eyebrows_expand_mod() )
+        source_filenames.append( dflimg.get_source_filename() )
+
+    n = len(valid_idxs)
+    return ( np.array(valid_idxs, np.int64),
+             np.array(face_types, np.uint8),
+             np.array(shapes, np.int32).reshape( (n,3) ),
+             np.array(landmarks, np.float32).reshape( (n,68,2) ),
+             seg_ie_polys,
+             xseg_masks_compressed,
+             np.array(eyebrows_expand_mods, np.float32),
+             source_filenames,
+             errors )
+
+class FaceSamplesLoader():
+    """
+    Loads face samples metadata of image_paths.
+
+    Image paths are dispatched to multiprocessing.Pool in large chunks,
+    each worker returns compact arrays for the whole chunk.
+
+    run() returns ( filenames,
+                    face_types              np.uint8   (N,),
+                    shapes                  np.int32   (N,3),
+                    landmarks               np.float32 (N,68,2),
+                    seg_ie_polys            list of dumped SegIEPolys or None,
+                    xseg_masks_compressed   list,
+                    eyebrows_expand_mods    np.float32 (N,),
+                    source_filenames        list )
+
+    non-dfl images are skipped.
+    """
+
+    def __init__(self, image_paths, workers_count=None, chunk_size=None):
+        self.image_paths = [ str(x) for x in image_paths ]
+
+        if workers_count is None:
+            workers_count = multiprocessing.cpu_count()
+        self.workers_count = max(1, workers_count)
+
+        if chunk_size is None:
+            #enough chunks to balance the pool, but large enough to amortize the round-trips
+            chunk_size = min(1024, max(16, len(self.image_paths) // (self.workers_count*4) ))
+        self.chunk_size = chunk_size
+
+    def run(self):
+        image_paths = self.image_paths
+        image_paths_len = len(image_paths)
+        chunk_size = self.chunk_size
+        chunks = [ image_paths[i:i+chunk_size] for i in range(0, image_paths_len, chunk_size) ]
+
+        results = [None]*len(chunks)
+
+        io.progress_bar ("Loading samples", image_paths_len)
+        if self.workers_count == 1 or len(chunks) <= 1:
+            for chunk_idx, chunk in enumerate(chunks):
+                results[chunk_idx] = _load_face_samples_chunk(chunk)
+                io.progress_bar_inc(len(chunk))
+        else:
+            with multiprocessing.Pool( min(self.workers_count, len(chunks)) ) as pool:
+                for chunk_idx, result in pool.imap_unordered(FaceSamplesLoader._process_chunk, enumerate(chunks) ):
+                    results[chunk_idx] = result
+                    io.progress_bar_inc(len(chunks[chunk_idx]))
         io.progress_bar_close()
 
-    #override
-    def process_info_generator(self):
-        for i in range(min(multiprocessing.cpu_count(), 8) ):
-            yield 'CPU%d' % (i), {}, {}
-
-    #override
-    def get_data(self, host_dict):
-        if len (self.idxs) > 0:
-            idx = self.idxs.pop(0)
-            return idx, self.image_paths[idx]
-
-        return None
-
-    #override
-    def on_data_return (self, host_dict, data):
-        self.idxs.insert(0, data[0])
-
-    #override
-    def on_result (self, host_dict, data, result):
-        idx, dflimg = result
-        self.result[idx] = (self.image_paths[idx], dflimg)
-        io.progress_bar_inc(1)
-
-    #override
-    def get_result(self):
-        return self.result
-
-    class Cli(Subprocessor.Cli):
-        #override
-        def process_data(self, data):
-            idx, filename = data
-            dflimg = DFLIMG.load (Path(filename))
-
-            if dflimg is None or not dflimg.has_data():
-                self.log_err (f"FaceSamplesLoader: {filename} is not a dfl image file.")
-                data = None
-            else:
-                data = (dflimg.get_face_type(),
-                        dflimg.get_shape(),
-                        dflimg.get_landmarks(),
-                        dflimg.get_seg_ie_polys(),
-                        dflimg.get_xseg_mask_compressed(),
-                        dflimg.get_eyebrows_expand_mod(),
-                        dflimg.get_source_filename() )
-
-            return idx, data
-
-        #override
-        def get_data_name (self, data):
-            #return string identificator of your data
-            return data[1]
+        filenames = []
+        seg_ie_polys = []
+        xseg_masks_compressed = []
+        source_filenames = []
+        for chunk, result in zip(chunks, results):
+            valid_idxs, _, _, _, chunk_seg_ie_polys, chunk_xseg_masks_compressed, _, chunk_source_filenames, errors = result
+            for err in errors:
+                io.log_err(err)
+            filenames += [ chunk[i] for i in valid_idxs ]
+            seg_ie_polys += chunk_seg_ie_polys
+            xseg_masks_compressed += chunk_xseg_masks_compressed
+            source_filenames += chunk_source_filenames
+
+        def concat(column_id, empty_shape, dtype):
+            if len(results) == 0:
+                return np.zeros(empty_shape, dtype)
+            return np.concatenate([ result[column_id] for result in results ], 0)
+
+        return ( filenames,
+                 concat(1, (0,), np.uint8),
+                 concat(2, (0,3), np.int32),
+                 concat(3, (0,68,2), np.float32),
+                 seg_ie_polys,
+                 xseg_masks_compressed,
+                 concat(6, (0,), np.float32),
+                 source_filenames )
+
+    @staticmethod
+    def _process_chunk(param):
+        chunk_idx, image_paths = param
+        return chunk_idx, _load_face_samples_chunk(image_paths)
@@ -60,6 +60,14 @@ class SampleProcessor(object):
             ct_sample_bgr = None
             h,w,c = sample_bgr.shape
 
+            face_masks = None
+            def get_face_masks():
+                # hull, eye and mouth masks are rasterized at once for the sample
+                nonlocal face_masks
+                if face_masks is None:
+                    face_masks = LandmarksProcessor.get_image_face_masks (sample_bgr.shape, sample_landmarks, eyebrows_expand_mod=sample.eyebrows_expand_mod, memoize=True )
+                return face_masks
+
             def get_full_face_mask():
                 xseg_mask = sample.get_xseg_mask()
                 if xseg_mask is not None:
@@ -68,18 +76,18 @@ class SampleProcessor(object):
                         xseg_mask = imagelib.normalize_channels(xseg_mask, 1)
                     return np.clip(xseg_mask, 0, 1)
                 else:
-                    full_face_mask = LandmarksProcessor.get_image_hull_mask (sample_bgr.shape, sample_landmarks, eyebrows_expand_mod=sample.eyebrows_expand_mod )
+                    full_face_mask = get_face_masks()[0]
                     return np.clip(full_face_mask, 0, 1)
 
             def get_eyes_mask():
-                eyes_mask = LandmarksProcessor.get_image_eye_mask (sample_bgr.shape, sample_landmarks)
+                eyes_mask = get_face_masks()[1]
                 # set eye masks to 1-2
                 clip = np.clip(eyes_mask, 0, 1)
                 clip[clip > 0.1] += 1
                 return clip
 
             def get_mouth_mask():
-                mouth_mask = LandmarksProcessor.get_image_mouth_mask (sample_bgr.shape, sample_landmarks)
+                mouth_mask = get_face_masks()[2]
                 # set eye masks to 2-3
                 clip = np.clip(mouth_mask, 0, 1)
                 clip[clip > 0.1] += 2
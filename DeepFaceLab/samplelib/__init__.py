@@ -1,5 +1,6 @@
 from .Sample import Sample
 from .Sample import SampleType
+from .MPSharedSampleList import MPSharedSampleList, SampleView
 from .SampleLoader import SampleLoader
 from .SampleProcessor import SampleProcessor
 from .SampleGeneratorBase import SampleGeneratorBase
@@ -10,4 +11,5 @@ from .SampleGeneratorImage import SampleGeneratorImage
 from .SampleGeneratorImageTemporal import SampleGeneratorImageTemporal
 from .SampleGeneratorFaceCelebAMaskHQ import SampleGeneratorFaceCelebAMaskHQ
 from .SampleGeneratorFaceXSeg import SampleGeneratorFaceXSeg
-from .PackedFaceset import PackedFaceset
\ No newline at end of file
+from .PackedFaceset import PackedFaceset
+from .FacesetIndex import FacesetIndex
\ No newline at end of file